@@ -31,18 +31,27 @@
 
 import os
 import sys
+import shutil
+import itertools
 
 from cp6.tables.image_table import ImageTable
 from cp6.tables.image_indicator_table import ImageIndicatorTable
 from cp6.tables.image_indicator_lookup_table import ImageIndicatorLookupTable
 from cp6.tables.label_table import LabelTable
 from cp6.tables.edge_table import EdgeTable
+from cp6.tables.edge_sort import EdgeSorter, EdgeSortStats
+from cp6.tables.edge_sparsify import EdgeSparsifier
+from cp6.tables.edge_hypergraph import HyperedgeTable
 from cp6.utilities.image_edge import ImageEdge
+from cp6.utilities.table_io import TableIO
 
 class SandboxAdapter:
 
-    def __init__( self, sandbox_root ):
+    def __init__( self, sandbox_root, top_k = None ):
+        # top_k, if set, keeps only each node's top_k edges (see edge_sparsify.py)
+        self.top_k = top_k
         self.files = dict()
+        # any of these may be compressed (see table_io.py)
         self.files[ 'lt' ] = os.path.join( sandbox_root, 'eval_in', 'etc', 'label_table.txt' )
         self.files[ 'iilut' ] = os.path.join( sandbox_root, 'eval_in', 'etc', 'image_indicator_lookup_table.txt' )
 
@@ -53,11 +62,13 @@ class SandboxAdapter:
         self.files[ 'train-iit' ] = os.path.join( sandbox_root, 'run_in', 'training', 'image_indicator_table.txt' )
         self.files[ 'test-iit' ] = os.path.join( sandbox_root, 'run_in', 'testing', 'image_indicator_table.txt' )
 
-        self.files[ 'train-et' ] = os.path.join( sandbox_root, 'run_in', 'training', 'image_edge_table.txt' )
-        self.files[ 'test-et' ] = os.path.join( sandbox_root, 'run_in', 'testing', 'image_edge_table.txt' )
+        # either text or .cp6e
+        self.files[ 'train-et' ] = EdgeTable.find_table( os.path.join( sandbox_root, 'run_in', 'training' ))
+        self.files[ 'test-et' ] = EdgeTable.find_table( os.path.join( sandbox_root, 'run_in', 'testing' ))
 
-        for (k,v) in self.files.iteritems():
-            if not os.path.isfile( v ):
+        for (k,v) in self.files.items():
+            self.files[ k ] = TableIO.find( os.path.dirname( v ), os.path.basename( v )) or v
+            if not os.path.isfile( self.files[ k ] ):
                 raise AssertionError( 'Expected file %s (tag %s) is not present\n' % (v,k))
 
     @staticmethod
@@ -227,6 +238,10 @@ class SandboxAdapter:
         #
         # We don't record collections or galleries, only groups.
         #
+        # edge_table may be an EdgeTable or a HyperedgeTable; either's
+        # edges has a length and can be iterated, and a HyperedgeTable's
+        # are expanded one at a time as they're written.
+        #
 
         with open(fn, 'w') as f:
 
@@ -236,15 +251,48 @@ class SandboxAdapter:
 
             # write the edges [2]
 
-            for e in edge_table.edges:
-                f.write('%d %d ' % (e.image_A_id, e.image_B_id))
-                f.write('%d %d 0 0 ' % (len(e.shared_words), len(e.shared_groups)))
-                f.write('%d %d %d\n' % (ImageEdge.canonical_flag_int( e.same_location_flag ), \
-                                       ImageEdge.canonical_flag_int( e.same_user_flag ), \
-                                       ImageEdge.canonical_flag_int( e.shared_contact_flag )))
+            SandboxAdapter.write_edge_feature_lines( f, edge_table.edges )
 
             # all done
 
+    @staticmethod
+    def write_edge_feature_lines( f, edges ):
+        # the [2] lines of write_edge_features; returns how many were written
+        n = 0
+        for e in edges:
+            f.write('%d %d ' % (e.image_A_id, e.image_B_id))
+            f.write('%d %d 0 0 ' % (e.n_shared_words, e.n_shared_groups))
+            f.write('%d %d %d\n' % (ImageEdge.canonical_flag_int( e.same_location_flag ), \
+                                   ImageEdge.canonical_flag_int( e.same_user_flag ), \
+                                   ImageEdge.canonical_flag_int( e.shared_contact_flag )))
+            n += 1
+        return n
+
+    @staticmethod
+    def write_merged_edge_features( fn, edge_tables ):
+        #
+        # write_edge_features for the union of edge_tables, merged through
+        # the external sort (see edge_sort.py) so an edge present in more
+        # than one table, or in both orientations, is written once. The
+        # merged edges are streamed, never held as a list; since the count
+        # for the header isn't known until the merge ends, the lines go to
+        # a temporary file which is then copied in after the header.
+        #
+        stats = EdgeSortStats()
+        tmp_fn = fn + '.tmp'
+        try:
+            with open( tmp_fn, 'w' ) as f:
+                edges = EdgeSorter.iter_sorted( itertools.chain( *[ t.edges for t in edge_tables ] ), stats, columns=() )
+                n = SandboxAdapter.write_edge_feature_lines( f, edges )
+            with open( fn, 'w' ) as f:
+                f.write('%d 7\n' % n)
+                with open( tmp_fn ) as lines:
+                    shutil.copyfileobj( lines, f )
+        finally:
+            if os.path.exists( tmp_fn ):
+                os.remove( tmp_fn )
+        stats.report( fn )
+
     @staticmethod
     def write_text_features( fn, image_table, image_indicator_table, iilut ):
         #
@@ -336,25 +384,20 @@ class SandboxAdapter:
         label2group = dict()  # key: label ID; val: set of group IDs
         label2tag = dict()   # key: label ID; val: set of tag IDs
 
-        for (img_id, img) in image_table.entries.iteritems():
-            ii = image_indicator_table.image_indicators[ img_id ]
-            lv = img.label_vector
-
-            if len(label2group) == 0:
-                for i in range(0,len(lv)):
-                    label2group[i] = set()
-                    label2tag[i] = set()
-
-            for label_index in range(0, len(lv)):
-                if lv[label_index] != 1:
-                    continue
-                # we now know that img_id is associated with label_index
-                # (assumes label_index == label_id, hmm)
-                for i in ii.group_list.iteritems():
-                    label2group[label_index].add( i[0] )
-                for i in ii.word_list.iteritems():
-                    if iilut.tag_word_text_src[i[0]] in ['T','B']:
-                        label2tag[label_index].add( i[0] )
+        # one column of the label matrix per label; rows (and so the order
+        # IDs go into each set) follow image_table.entries, as the old
+        # per-image loop did
+        labels = image_table.label_matrix()
+        image_tags = dict()  # key: image ID; val: its 'T' / 'B' word IDs
+        for label_index in range(0, labels.n_labels()):
+            (label2group[label_index], label2tag[label_index]) = (set(), set())
+            # (assumes label_index == label_id, hmm)
+            for img_id in labels.ids_with( label_index, 1 ).tolist():
+                ii = image_indicator_table.image_indicators[ img_id ]
+                label2group[label_index].update( ii.group_list )
+                if img_id not in image_tags:
+                    image_tags[ img_id ] = [w for w in ii.word_list if iilut.tag_word_text_src[w] in ['T','B']]
+                label2tag[label_index].update( image_tags[ img_id ] )
 
         with open(fn, 'w') as f:
             for i in sorted( label2group.iteritems(), key=lambda x:x[1] ):
@@ -387,22 +430,17 @@ class SandboxAdapter:
 
         label2word = dict()   # key: label ID; val: set of word IDs
 
-        for (img_id, img) in image_table.entries.iteritems():
-            ii = image_indicator_table.image_indicators[ img_id ]
-            lv = img.label_vector
-
-            if len(label2word) == 0:
-                for i in range(0,len(lv)):
-                    label2word[i] = set()
-
-            for label_index in range(0, len(lv)):
-                if lv[label_index] != 1:
-                    continue
-                # we now know that img_id is associated with label_index
-                # (assumes label_index == label_id, hmm)
-                for i in ii.word_list.iteritems():
-                    if iilut.tag_word_text_src[i[0]] in ['W']:
-                        label2word[label_index].add( i[0] )
+        # as in write_id_file, a column of the label matrix per label
+        labels = image_table.label_matrix()
+        image_words = dict()  # key: image ID; val: its 'W' word IDs
+        for label_index in range(0, labels.n_labels()):
+            label2word[label_index] = set()
+            # (assumes label_index == label_id, hmm)
+            for img_id in labels.ids_with( label_index, 1 ).tolist():
+                if img_id not in image_words:
+                    ii = image_indicator_table.image_indicators[ img_id ]
+                    image_words[ img_id ] = [w for w in ii.word_list if iilut.tag_word_text_src[w] in ['W']]
+                label2word[label_index].update( image_words[ img_id ] )
 
         with open(fn, 'w') as f:
             for i in sorted( label2word.iteritems(), key=lambda x:x[1] ):
@@ -425,18 +463,32 @@ class SandboxAdapter:
             sys.stderr.write('Exiting\n')
             sys.exit(1)
         sys.stderr.write('Info: loaded and verified image indicator lookup table\n')
-        self.train_it = ImageTable.read_from_file( self.files[ 'train-it' ] )
+        # none of the McAuley files use titles or descriptions
+        self.train_it = ImageTable.read_from_file( self.files[ 'train-it' ], text=ImageTable.TEXT_DROP )
         sys.stderr.write('Info: loaded training image table\n' )
-        self.test_it = ImageTable.read_from_file( self.files[ 'test-it' ] )
+        self.test_it = ImageTable.read_from_file( self.files[ 'test-it' ], text=ImageTable.TEXT_DROP )
         sys.stderr.write('Info: loaded testing image table\n' )
         self.train_iit = ImageIndicatorTable.read_from_file( self.files[ 'train-iit'] )
         sys.stderr.write('Info: loaded training image indicator table\n' )
         self.test_iit = ImageIndicatorTable.read_from_file( self.files[ 'test-iit'] )
         sys.stderr.write('Info: loaded testing image indicator table\n' )
-        self.train_et = EdgeTable.read_from_file( self.files[ 'train-et' ] )
+        self.train_et = SandboxAdapter.read_edge_table( self.files[ 'train-et' ] )
         sys.stderr.write('Info: loaded training edge table\n')
-        self.test_et = EdgeTable.read_from_file( self.files[ 'test-et' ] )
+        self.test_et = SandboxAdapter.read_edge_table( self.files[ 'test-et' ] )
         sys.stderr.write('Info: loaded testing edge table\n')
+        if self.top_k is not None:
+            self.train_et = EdgeTable( EdgeSparsifier.sparsify_edges( list( self.train_et.edges ), self.top_k ))
+            self.test_et = EdgeTable( EdgeSparsifier.sparsify_edges( list( self.test_et.edges ), self.top_k ))
+
+    @staticmethod
+    def read_edge_table( fn ):
+        # a .cp6h table stays clique-compressed until it's written
+        if EdgeTable.is_hyper( fn ):
+            h = HyperedgeTable.read_from_file( fn )
+            h.report( fn )
+            return h
+        # write_edge_features only needs the counts and flags
+        return EdgeTable.read_from_file( fn, columns=() )
 
     def write( self, out_dir ):
         outfiles = dict()
@@ -468,11 +520,12 @@ class SandboxAdapter:
 
         self.test_it.entries.update( self.train_it.entries )
         self.test_iit.image_indicators.update( self.train_iit.image_indicators)
-        self.test_et.edges.extend( self.train_et.edges )
 
         SandboxAdapter.write_node_features( outfiles['test-node'], self.iilut, self.lt, self.test_it, self.test_iit )
         SandboxAdapter.write_text_features( outfiles['test-text'], self.test_it, self.test_iit, self.iilut )
-        SandboxAdapter.write_edge_features( outfiles['test-edge'], self.test_et)
+        # merge rather than append, so an edge present in both tables (or in
+        # both orientations) is written once
+        SandboxAdapter.write_merged_edge_features( outfiles['test-edge'], (self.test_et, self.train_et) )
 
         # have to write these AFTER write_edge_features, because that sets all the mcauley_id_maps...
         SandboxAdapter.write_text_id_file( outfiles['train-textId'], self.lt, self.train_it, self.train_iit, self.iilut )
@@ -566,13 +619,14 @@ double BMRM.lambda 0.001
             sys.stderr.write('Info: wrote %s\n' % conf_fn )
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        sys.stderr.write('Usage: $0 output-dir\n')
+    if len(sys.argv) not in (2, 3):
+        sys.stderr.write('Usage: $0 output-dir [top-k]\n')
+        sys.stderr.write('  top-k, if given, keeps only the top-k edges per node (by shared groups + words)\n')
         sys.exit(1)
     out_dir = (sys.argv[1])
     if not os.path.isdir( out_dir ):
         os.mkdir(out_dir)
 
-    s = SandboxAdapter('.')
+    s = SandboxAdapter('.', int( sys.argv[2] ) if len(sys.argv) == 3 else None )
     s.load()
     s.write( out_dir )
@@ -221,79 +221,200 @@ class CP6Data:
 
         return imgind
 
+    def get_flickr_id( self, mir_id ):
+        return int( self.xmldata.mir_nodes[ mir_id ].get('id') )
+
+    def get_image_edge( self, a, b, a_flickr_id, b_flickr_id, counts ):
+        #
+        # Decide whether (a, b) is an edge and build it if so; returns None
+        # if the pair shares nothing. counts is a dict accumulating the
+        # 'missed_user_flag' and 'empty_group_word' diagnostics.
+        #
+
+        if a_flickr_id < b_flickr_id:
+            key = '%d:%d' % (a_flickr_id, b_flickr_id)
+        else:
+            key = '%d:%d' % (b_flickr_id, a_flickr_id)
+        in_mcauley = (key in self.mcauley_edge_features.edgemap)
+        mcauley_flags_nonzero = False
+        if in_mcauley:
+            e = self.mcauley_edge_features.edgemap[ key ]
+            (loc_flag, user_flag, friend_flag) = \
+              (e.location_flag, e.user_flag, e.friend_flag)
+            mcauley_flags_nonzero = (loc_flag != '0') or (user_flag != '0') or (friend_flag != '0')
+        else:
+            (loc_flag, user_flag, friend_flag) = ('.','.','.')
+
+        group_id_vector = \
+          ImageEdge.get_shared_group_id_vector( self.image_indicator_table.image_indicators[ a ], \
+                                                self.image_indicator_table.image_indicators[ b ] )
+        word_id_vector = \
+          ImageEdge.get_shared_word_id_vector( self.image_indicator_table.image_indicators[ a ], \
+                                               self.image_indicator_table.image_indicators[ b ] )
+        edge_is_present = mcauley_flags_nonzero or len(group_id_vector) or len(word_id_vector)
+
+        if not edge_is_present:
+            return None
+
+        if mcauley_flags_nonzero:
+            # trust, but verify
+            xml_user_flag = \
+              self.xmldata.mir_nodes[ a ].find('owner').get('nsid') == \
+              self.xmldata.mir_nodes[ b ].find('owner').get('nsid')
+            user_flag_bool = (user_flag != '0')
+            if xml_user_flag != user_flag_bool:
+                if (not user_flag_bool) and xml_user_flag:
+                    counts['missed_user_flag'] += 1
+                else:
+                    sys.stderr.write('WARN: %d / %d user flag mismatch: mcauley %s, xml %s; going with xml\n' % (a_flickr_id, b_flickr_id, user_flag, xml_user_flag))
+                user_flag = xml_user_flag
+
+        if (len(group_id_vector)==0) and (len(word_id_vector)==0):
+            counts['empty_group_word'] += 1
+        return ImageEdge.from_data( self.image_indicator_table.image_indicators[ a ], \
+                                    self.image_indicator_table.image_indicators[ b ], \
+                                    group_id_vector, \
+                                    word_id_vector, \
+                                    user_flag, \
+                                    loc_flag, \
+                                    friend_flag )
+
     def get_image_edges( self, data_split ):
         #
         # An edge has two sources: McAuley's edge table, which contains
         # the contact info, and our shared_{group,word}_id_vectors.
         #
+        # This checks every pair of IDs in the split; see
+        # get_image_edges_indexed for the version which only looks at
+        # pairs which share something.
+        #
 
         edges = list()
         sorted_ids = sorted( data_split.ids )
         (n_possible_edges, n_found_edges) = (0,0)
-        (n_mcauley_missed_user_flag, n_empty_group_word) = (0,0)
+        counts = { 'missed_user_flag': 0, 'empty_group_word': 0 }
         for a_index in range( 0, len(sorted_ids) ):
             if a_index % 100 == 0:
                 sys.stderr.write('Info: Edge %d of %d: %d found, %d possible\n' % \
                                  (a_index, len(sorted_ids), n_found_edges, n_possible_edges))
             a = sorted_ids[ a_index ]
-            a_flickr_id = int(self.xmldata.mir_nodes[a].get('id'))
+            a_flickr_id = self.get_flickr_id( a )
             for b_index in range(a_index+1, len(sorted_ids)):
                 b = sorted_ids[ b_index ]
-                b_flickr_id = int(self.xmldata.mir_nodes[b].get('id'))
+                b_flickr_id = self.get_flickr_id( b )
                 n_possible_edges += 1
 
-                if a_flickr_id < b_flickr_id:
-                    key = '%d:%d' % (a_flickr_id, b_flickr_id)
-                else:
-                    key = '%d:%d' % (b_flickr_id, a_flickr_id)
-                in_mcauley = (key in self.mcauley_edge_features.edgemap)
-                mcauley_flags_nonzero = False
-                if in_mcauley:
-                    e = self.mcauley_edge_features.edgemap[ key ]
-                    (loc_flag, user_flag, friend_flag) = \
-                      (e.location_flag, e.user_flag, e.friend_flag)
-                    mcauley_flags_nonzero = (loc_flag != '0') or (user_flag != '0') or (friend_flag != '0')
-                else:
-                    (loc_flag, user_flag, friend_flag) = ('.','.','.')
-
-                group_id_vector = \
-                  ImageEdge.get_shared_group_id_vector( self.image_indicator_table.image_indicators[ a ], \
-                                                        self.image_indicator_table.image_indicators[ b ] )
-                word_id_vector = \
-                  ImageEdge.get_shared_word_id_vector( self.image_indicator_table.image_indicators[ a ], \
-                                                       self.image_indicator_table.image_indicators[ b ] )
-                edge_is_present = mcauley_flags_nonzero or len(group_id_vector) or len(word_id_vector)
-
-                if edge_is_present:
-                    if mcauley_flags_nonzero:
-                        # trust, but verify
-                        xml_user_flag = \
-                          self.xmldata.mir_nodes[ a ].find('owner').get('nsid') == \
-                          self.xmldata.mir_nodes[ b ].find('owner').get('nsid')
-                        user_flag_bool = (user_flag != '0')
-                        if xml_user_flag != user_flag_bool:
-                            if (not user_flag_bool) and xml_user_flag:
-                                n_mcauley_missed_user_flag += 1
-                            else:
-                                sys.stderr.write('WARN: %d / %d user flag mismatch: mcauley %s, xml %s; going with xml\n' % (a_flickr_id, b_flickr_id, user_flag, xml_user_flag))
-                            user_flag = xml_user_flag
-
+                e = self.get_image_edge( a, b, a_flickr_id, b_flickr_id, counts )
+                if e is not None:
                     n_found_edges += 1
-                    if (len(group_id_vector)==0) and (len(word_id_vector)==0):
-                        n_empty_group_word += 1
-                    edges.append( ImageEdge.from_data( \
-                                            self.image_indicator_table.image_indicators[ a ], \
-                                            self.image_indicator_table.image_indicators[ b ], \
-                                            group_id_vector, \
-                                            word_id_vector, \
-                                            user_flag, \
-                                            loc_flag, \
-                                            friend_flag ))
+                    edges.append( e )
 
         sys.stderr.write('Info: Found %d of %d possible edges\n' % (n_found_edges, n_possible_edges))
-        sys.stderr.write('Info: Found %d missed McAuley user flags; %d edges with no words or groups\n' % (n_mcauley_missed_user_flag, n_empty_group_word))
+        sys.stderr.write('Info: Found %d missed McAuley user flags; %d edges with no words or groups\n' % (counts['missed_user_flag'], counts['empty_group_word']))
         return edges
 
+    def get_candidate_pairs( self, a_ids, b_ids = None ):
+        #
+        # Return a dict: key: image ID a; val: set of image IDs b > a such
+        # that (a, b) share at least one group, one word, or have a non-zero
+        # McAuley flag. Every edge get_image_edges can find is in here.
+        #
+        # a_ids must be sorted. If b_ids is None, pairs are taken within
+        # a_ids; otherwise a comes from a_ids and b from b_ids (which must
+        # also be sorted.)
+        #
+        # Candidates come from posting lists (group ID -> images, word ID ->
+        # images) and from the McAuley edge map. Sharing an owner alone
+        # never makes an edge, so owners aren't a source of candidates.
+        #
+
+        a_set = set( a_ids )
+        b_set = a_set if b_ids is None else set( b_ids )
+        all_ids = a_ids if b_ids is None else sorted( a_set | b_set )
+
+        group_postings = defaultdict( list )
+        word_postings = defaultdict( list )
+        for mir_id in all_ids:
+            ii = self.image_indicator_table.image_indicators[ mir_id ]
+            for g in ii.group_list:
+                group_postings[ g ].append( mir_id )
+            for w in ii.word_list:
+                word_postings[ w ].append( mir_id )
+
+        candidates = defaultdict( set )
+        for postings in (group_postings, word_postings):
+            for members in postings.itervalues():
+                # members are in sorted order, so everything after i is > members[i]
+                if b_ids is None:
+                    for i in range( 0, len(members)-1 ):
+                        candidates[ members[i] ].update( members[i+1:] )
+                else:
+                    b_members = [m for m in members if m in b_set]
+                    if not b_members:
+                        continue
+                    for a in members:
+                        if a in a_set:
+                            candidates[ a ].update( b for b in b_members if b > a )
+
+        flickr2mir = defaultdict( list )
+        for mir_id in all_ids:
+            flickr2mir[ self.get_flickr_id( mir_id ) ].append( mir_id )
+        for (key, e) in self.mcauley_edge_features.edgemap.iteritems():
+            if (e.location_flag == '0') and (e.user_flag == '0') and (e.friend_flag == '0'):
+                continue
+            (flickr_a, flickr_b) = map( int, key.split(':') )
+            if (flickr_a not in flickr2mir) or (flickr_b not in flickr2mir):
+                continue
+            for x in flickr2mir[ flickr_a ]:
+                for y in flickr2mir[ flickr_b ]:
+                    (a, b) = (min(x, y), max(x, y))
+                    if (a != b) and (a in a_set) and (b in b_set):
+                        candidates[ a ].add( b )
+
+        return candidates
+
+    def get_image_edges_between( self, a_ids, b_ids = None ):
+        #
+        # Edges (a, b) with a < b, a in a_ids and b in b_ids (or in a_ids
+        # if b_ids is None), in sorted (a, b) order. Both lists must be
+        # sorted. Only the pairs returned by get_candidate_pairs are examined.
+        #
+
+        edges = list()
+        candidates = self.get_candidate_pairs( a_ids, b_ids )
+        n_candidates = sum( len(v) for v in candidates.itervalues() )
+        n_b = len(a_ids) if b_ids is None else len(b_ids)
+        sys.stderr.write('Info: %d candidate pairs among %d x %d images\n' % \
+                         (n_candidates, len(a_ids), n_b))
+
+        flickr_ids = dict()
+        counts = { 'missed_user_flag': 0, 'empty_group_word': 0 }
+        for a_index in range( 0, len(a_ids) ):
+            if a_index % 1000 == 0:
+                sys.stderr.write('Info: Edge %d of %d: %d found\n' % \
+                                 (a_index, len(a_ids), len(edges)))
+            a = a_ids[ a_index ]
+            if a not in candidates:
+                continue
+            for b in sorted( candidates[ a ] ):
+                for x in (a, b):
+                    if x not in flickr_ids:
+                        flickr_ids[ x ] = self.get_flickr_id( x )
+                e = self.get_image_edge( a, b, flickr_ids[a], flickr_ids[b], counts )
+                if e is not None:
+                    edges.append( e )
+
+        sys.stderr.write('Info: Found %d edges in %d candidate pairs\n' % (len(edges), n_candidates))
+        sys.stderr.write('Info: Found %d missed McAuley user flags; %d edges with no words or groups\n' % (counts['missed_user_flag'], counts['empty_group_word']))
+        return edges
+
+    def get_image_edges_indexed( self, data_split ):
+        #
+        # Same edges, in the same order, as get_image_edges, but cost scales
+        # with the number of edges rather than the square of the split size.
+        #
+        return self.get_image_edges_between( sorted( data_split.ids ))
+
     def write_global_tables( self ):
         self.label_table.write_to_file( self.paths.label_table_path )
         self.imglut.write_to_file( self.paths.image_indicator_lut_path )
@@ -304,7 +425,7 @@ class CP6Data:
         img_table = self.image_table_from_split( s )
         img_table.write_to_file( t.image_table )
         self.image_indicator_table.write_to_file( t.image_indicator_table, s.ids )
-        edge_table = EdgeTable( self.get_image_edges( s ) )
+        edge_table = EdgeTable( self.get_image_edges_indexed( s ) )
         edge_table.write_to_file( t.image_edge_table )
 
 if __name__ == '__main__':
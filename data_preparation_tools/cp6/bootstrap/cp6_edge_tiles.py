@@ -0,0 +1,247 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Split edge generation for one phase into (block_i, block_j) tiles which
+## can be run in parallel, either in a local multiprocessing pool or by
+## several machines sharing a work directory, then merged back into the
+## edge table write_phase_tables would have written.
+##
+## The work directory holds:
+##
+## plan.txt                 block size, image count, and block boundaries
+## tile_IIIII_JJJJJ.txt     finished edge shard for tile (i, j), i <= j
+## claims/tile_IIIII_JJJJJ  directory created (atomically) by whoever runs the tile
+##
+## A tile is done when its shard exists; shards are written to a temporary
+## name and renamed, so a half-written shard is never mistaken for a
+## finished one. Restarting skips finished tiles.
+##
+
+import sys
+import os
+import time
+import heapq
+import socket
+import argparse
+import multiprocessing
+
+from cp6.utilities.paths import Paths
+from cp6.tables.edge_table import EdgeTable
+
+class EdgeTilePlan:
+
+    def __init__( self, sorted_ids, block_size ):
+        self.block_size = block_size
+        self.n_ids = len( sorted_ids )
+        self.blocks = [ sorted_ids[i:i+block_size] for i in range( 0, len(sorted_ids), block_size ) ]
+
+    def tiles( self ):
+        return [ (i, j) for i in range( 0, len(self.blocks) ) for j in range( i, len(self.blocks) ) ]
+
+    def signature( self ):
+        # one line per block: first and last ID; enough to notice a changed split
+        lines = [ '%d %d %d' % (self.block_size, self.n_ids, len(self.blocks)) ]
+        for b in self.blocks:
+            lines.append( '%d %d %d' % (len(b), b[0], b[-1]) )
+        return '\n'.join( lines ) + '\n'
+
+class EdgeTileWorker:
+
+    def __init__( self, cp6data, plan, work_dir ):
+        self.data = cp6data
+        self.plan = plan
+        self.work_dir = work_dir
+        self.claim_dir = os.path.join( work_dir, 'claims' )
+        for d in (self.work_dir, self.claim_dir):
+            if not os.path.isdir( d ):
+                try:
+                    os.makedirs( d )
+                except OSError:
+                    # another node got there first
+                    if not os.path.isdir( d ):
+                        raise
+        self.check_plan()
+
+    def check_plan( self ):
+        plan_fn = os.path.join( self.work_dir, 'plan.txt' )
+        sig = self.plan.signature()
+        if os.path.isfile( plan_fn ):
+            with open( plan_fn ) as f:
+                if f.read() != sig:
+                    raise AssertionError( 'Tile plan in %s does not match this split / block size; use a fresh work directory' % plan_fn )
+        else:
+            tmp_fn = '%s.%s.%d' % (plan_fn, socket.gethostname(), os.getpid())
+            with open( tmp_fn, 'w' ) as f:
+                f.write( sig )
+            os.rename( tmp_fn, plan_fn )
+
+    @staticmethod
+    def tile_name( tile ):
+        return 'tile_%05d_%05d' % tile
+
+    def shard_path( self, tile ):
+        return os.path.join( self.work_dir, '%s.txt' % EdgeTileWorker.tile_name( tile ))
+
+    def is_done( self, tile ):
+        return os.path.isfile( self.shard_path( tile ))
+
+    def pending_tiles( self ):
+        return [ t for t in self.plan.tiles() if not self.is_done( t ) ]
+
+    def run_tile( self, tile ):
+        (i, j) = tile
+        a_ids = self.plan.blocks[i]
+        b_ids = None if i == j else self.plan.blocks[j]
+        edges = self.data.get_image_edges_between( a_ids, b_ids )
+        fn = self.shard_path( tile )
+        tmp_fn = '%s.%s.%d.tmp' % (fn, socket.gethostname(), os.getpid())
+        EdgeTable( edges ).write_to_file( tmp_fn )
+        os.rename( tmp_fn, fn )
+        return len( edges )
+
+    def claim( self, tile, stale_seconds ):
+        # os.mkdir is atomic, including over NFS; whoever creates the
+        # directory owns the tile. Claims older than stale_seconds whose
+        # shard never appeared are assumed to belong to a dead worker.
+        path = os.path.join( self.claim_dir, EdgeTileWorker.tile_name( tile ))
+        try:
+            os.mkdir( path )
+        except OSError:
+            if (stale_seconds is None) or self.is_done( tile ):
+                return False
+            try:
+                age = time.time() - os.path.getmtime( path )
+            except OSError:
+                return False
+            if age < stale_seconds:
+                return False
+            sys.stderr.write( 'Info: reclaiming stale tile %s (%d seconds old)\n' % (EdgeTileWorker.tile_name( tile ), age))
+            os.utime( path, None )
+        with open( os.path.join( path, '%s.%d' % (socket.gethostname(), os.getpid())), 'w' ) as f:
+            f.write( '%f\n' % time.time() )
+        return True
+
+    def run_queue( self, stale_seconds = None ):
+        # Work through the shared queue until no unclaimed tiles remain.
+        # Safe to run on several machines at once against the same work_dir.
+        c = 0
+        for tile in self.pending_tiles():
+            if self.is_done( tile ) or not self.claim( tile, stale_seconds ):
+                continue
+            n = self.run_tile( tile )
+            c += 1
+            sys.stderr.write( 'Info: %s: tile %s done, %d edges\n' % (socket.gethostname(), EdgeTileWorker.tile_name( tile ), n))
+        return c
+
+    def run_pool( self, n_procs ):
+        # Fork n_procs workers which inherit the already-loaded CP6Data.
+        global _pool_worker
+        _pool_worker = self
+        pending = self.pending_tiles()
+        sys.stderr.write( 'Info: %d of %d tiles pending\n' % (len(pending), len(self.plan.tiles())))
+        pool = multiprocessing.Pool( n_procs )
+        try:
+            for (tile, n) in pool.imap_unordered( _run_pool_tile, pending ):
+                sys.stderr.write( 'Info: tile %s done, %d edges\n' % (EdgeTileWorker.tile_name( tile ), n))
+        finally:
+            pool.close()
+            pool.join()
+        return len( pending )
+
+    @staticmethod
+    def iter_shard( fn ):
+        with open( fn ) as f:
+            for line in f:
+                fields = line.split( ' ', 2 )
+                yield (int(fields[0]), int(fields[1]), line)
+
+    @staticmethod
+    def merge( work_dir, out_fn ):
+        #
+        # Concatenate the shards in (a, b) order. Within a block row i, every
+        # tile (i, j) holds edges with a in block i, sorted by (a, b); the
+        # b ranges of different j don't overlap, so a merge on (a, b) gives
+        # exactly the order of get_image_edges.
+        #
+        # Only needs the work directory, not the source data.
+        #
+        with open( os.path.join( work_dir, 'plan.txt' )) as f:
+            n_blocks = int( f.readline().split()[2] )
+        shard_path = lambda tile: os.path.join( work_dir, '%s.txt' % EdgeTileWorker.tile_name( tile ))
+        missing = [ (i, j) for i in range( 0, n_blocks ) for j in range( i, n_blocks ) \
+                    if not os.path.isfile( shard_path( (i, j) )) ]
+        if missing:
+            raise AssertionError( '%d tiles not finished (first: %s); cannot merge' % \
+                                  (len(missing), EdgeTileWorker.tile_name( missing[0] )))
+        c = 0
+        with open( out_fn, 'w' ) as f:
+            for i in range( 0, n_blocks ):
+                shards = [ EdgeTileWorker.iter_shard( shard_path( (i, j) )) for j in range( i, n_blocks ) ]
+                for (a, b, line) in heapq.merge( *shards ):
+                    f.write( line )
+                    c += 1
+        sys.stderr.write( 'Info: merged %d edges into %s\n' % (c, out_fn ))
+        return c
+
+_pool_worker = None
+
+def _run_pool_tile( tile ):
+    return (tile, _pool_worker.run_tile( tile ))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='PPAML CP6 tiled edge table generation' )
+    parser.add_argument( 'mode', choices=['pool', 'queue', 'merge'], help='pool: run pending tiles locally; queue: claim tiles from a shared work dir; merge: write the edge table' )
+    parser.add_argument( '--phase', required=True, choices=['r1train', 'r1test', 'r2train', 'r2test'], help='phase key' )
+    parser.add_argument( '--work-dir', required=True, help='directory for the plan, claims, and shards (shared between nodes in queue mode)' )
+    parser.add_argument( '--block-size', type=int, default=2000, help='images per block' )
+    parser.add_argument( '--procs', type=int, default=multiprocessing.cpu_count(), help='pool mode: number of worker processes' )
+    parser.add_argument( '--stale', type=int, help='queue mode: reclaim tiles claimed more than this many seconds ago without a shard' )
+    parser.add_argument( '--output', help='merge mode: output edge table (default: the phase table from Paths)' )
+    args = parser.parse_args()
+
+    p = Paths()
+    if args.mode == 'merge':
+        EdgeTileWorker.merge( args.work_dir, args.output if args.output else p.phase_tables[ args.phase ].image_edge_table )
+        sys.exit(0)
+
+    # deferred so that merging doesn't need the source data
+    from cp6.bootstrap.cp6_data import CP6Data
+
+    d = CP6Data( p )
+    d.set_splits()
+    plan = EdgeTilePlan( sorted( d.splits[ args.phase ].ids ), args.block_size )
+    w = EdgeTileWorker( d, plan, args.work_dir )
+
+    if args.mode == 'pool':
+        w.run_pool( args.procs )
+    else:
+        w.run_queue( args.stale )
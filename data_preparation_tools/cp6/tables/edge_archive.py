@@ -0,0 +1,491 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Archival (.cp6e) form of the image edge table, for shipping sandboxes.
+##
+## The file is 'CP6E', a format version, and a sequence of blocks of up
+## to BLOCK_ROWS edges, ended by an empty block. Each block is sorted by
+## (A, B) and stored column by column; every column but 'row' is a run
+## of varints (7 bits per byte, high bit set on all but the last byte):
+##
+## a            each distinct A, as a delta from the previous one
+## a_rows       number of rows with that A
+## b            B; zigzag(B-A) on A's first row, else delta from the previous B
+## row          one byte per row: flags + 27*(g + 3*w), where flags is
+##              same_user + 3*same_location + 9*shared_contact (codes 0/1/.)
+##              and g, w are the group and word counts, capped at 2
+## group_len    number of shared groups, minus 2, for rows with g == 2
+## group        shared group IDs, sorted, delta-coded within the row
+## word_len     number of shared words, minus 2, for rows with w == 2
+## word         shared word IDs, sorted, delta-coded within the row
+## word_type    word types, permuted along with the words
+## type_len     only if some row's word and word type counts differ
+## n_groups,    only if fields 2 and 3 don't match the list lengths:
+## n_words      zigzag(field - list length)
+## group_ref    with BLOCK_GROUP_DICT: each row's entry in the group dictionary
+## word_ref     with BLOCK_WORD_DICT: each row's entry in the word dictionary
+##
+## Dictionary pages: when it makes the block smaller, the distinct group
+## lists of a block (or distinct word lists, with their types) are stored
+## once, in order of first appearance, and rows refer to them by index;
+## group_len (word_len) then holds each dictionary list's full length and
+## group (word, word_type) the dictionary's lists. See list_pool.py.
+##
+## A block is preceded by its row count and a flag word (BLOCK_* below);
+## each column by its length in bytes. Blocks are independent, so both
+## directions stream in constant memory.
+##
+## Decoding gives back the table in canonical form: each block's rows
+## sorted by (A, B), and lists sorted (with word types following their
+## words.) Apart from that order, the round trip is exact; a table which
+## is already canonical comes back byte for byte.
+##
+
+import sys
+import time
+from itertools import islice
+
+import numpy as np
+
+from cp6.tables.edge_columns import EdgeColumns
+from cp6.utilities.table_io import TableIO
+from cp6.utilities.list_pool import ListPool
+
+class EdgeArchive:
+
+    MAGIC = 'CP6E'
+    VERSION = 2                   # version 1 archives (no dictionary pages) are still read
+    EXTENSION = '.cp6e'
+    BLOCK_ROWS = 65536
+
+    # block flags
+    BLOCK_WORDS_UNSORTED = 1      # word and word type counts differ somewhere; words kept in order
+    BLOCK_EXPLICIT_COUNTS = 2     # fields 2/3 differ from the list lengths somewhere
+    BLOCK_GROUP_DICT = 4          # group lists are in a dictionary page
+    BLOCK_WORD_DICT = 8           # word (and word type) lists are in a dictionary page
+
+    # set False to never write dictionary pages
+    DICTIONARY = True
+
+    # codes in the row byte
+    (N_FLAG_CODES, MAX_INLINE_LEN) = (27, 2)
+
+    COLUMNS_V1 = ( 'a', 'a_rows', 'b', 'row', 'group_len', 'group', 'word_len', 'word', 'word_type', \
+                   'type_len', 'n_groups', 'n_words' )
+    COLUMNS = COLUMNS_V1 + ( 'group_ref', 'word_ref' )
+
+    @staticmethod
+    def is_archive( fn ):
+        return TableIO.base_name( fn ).endswith( EdgeArchive.EXTENSION )
+
+    #
+    # varints and zigzag coding, over int64 numpy arrays
+    #
+
+    @staticmethod
+    def varint_encode( v ):
+        v = np.asarray( v, dtype=np.int64 )
+        if len(v) == 0:
+            return ''
+        if v.min() < 0:
+            raise AssertionError( 'varint_encode: negative value %d' % v.min() )
+        nb = np.ones( len(v), dtype=np.int64 )
+        for k in range( 1, 10 ):
+            nb += (v >= (1 << (7*k)))
+        pos = np.cumsum( nb ) - nb
+        out = np.zeros( int(nb.sum()), dtype=np.uint8 )
+        for k in range( 0, int(nb.max()) ):
+            m = nb > k
+            more = (nb[m] - 1 > k).astype( np.int64 ) << 7
+            out[ pos[m] + k ] = ((v[m] >> (7*k)) & 0x7f) | more
+        return out.tostring()
+
+    @staticmethod
+    def varint_decode( buf ):
+        b = np.frombuffer( buf, dtype=np.uint8 )
+        ends = np.flatnonzero( b < 0x80 )
+        if len(ends) == 0:
+            return np.zeros( 0, dtype=np.int64 )
+        if ends[-1] != len(b)-1:
+            raise AssertionError( 'varint_decode: truncated varint' )
+        starts = np.concatenate( ([0], ends[:-1]+1) )
+        lens = ends - starts + 1
+        v = np.zeros( len(ends), dtype=np.int64 )
+        for k in range( 0, int(lens.max()) ):
+            m = lens > k
+            v[m] |= (b[ starts[m] + k ] & 0x7f).astype( np.int64 ) << (7*k)
+        return v
+
+    @staticmethod
+    def zigzag( x ):
+        x = np.asarray( x, dtype=np.int64 )
+        return (x << 1) ^ (x >> 63)
+
+    @staticmethod
+    def unzigzag( z ):
+        return (z >> 1) ^ -(z & 1)
+
+    @staticmethod
+    def segment_cumsum( d, starts ):
+        # cumulative sum of d, restarting at each index in starts (sorted, starting with 0)
+        if len(d) == 0:
+            return d
+        cs = np.cumsum( d )
+        seg = np.zeros( len(d), dtype=np.int64 )
+        seg[ starts ] = 1
+        seg = np.cumsum( seg ) - 1
+        return cs - (cs[ starts ] - d[ starts ])[ seg ]
+
+    @staticmethod
+    def list_deltas( offsets, values ):
+        # values minus the previous value in the same row; row starts stay absolute
+        d = np.array( values, dtype=np.int64 )
+        d[1:] -= d[:-1]
+        starts = offsets[:-1][ np.diff( offsets ) > 0 ]
+        d[ starts ] = values[ starts ]
+        return d
+
+    @staticmethod
+    def sort_within_rows( offsets, values ):
+        # permutation sorting values within each row
+        row_of = np.repeat( np.arange( len(offsets)-1 ), np.diff( offsets ))
+        return np.lexsort( (values, row_of) )
+
+    #
+    # blocks
+    #
+
+    @staticmethod
+    def encode_block( c ):
+        # c is an EdgeColumns; returns the bytes of one block
+        c = c.take( np.lexsort( (c.cols['b'], c.cols['a']) ))
+        cols = c.cols
+        n = len(c)
+        flags = 0
+        streams = dict( (name, np.zeros( 0, dtype=np.int64 )) for name in EdgeArchive.COLUMNS )
+
+        a = cols['a'].astype( np.int64 )
+        b = cols['b'].astype( np.int64 )
+        new_a = np.ones( n, dtype=bool )
+        new_a[1:] = a[1:] != a[:-1]
+        a_starts = np.flatnonzero( new_a )
+        streams['a'] = np.diff( np.concatenate( ([0], a[ a_starts ] )))
+        streams['a_rows'] = np.diff( np.concatenate( (a_starts, [n]) ))
+        streams['b'] = np.where( new_a, EdgeArchive.zigzag( b - a ), b - np.concatenate( ([0], b[:-1]) ))
+
+        (g_off, g_val) = (cols['group_offsets'], cols['group_values'])
+        g_val = g_val[ EdgeArchive.sort_within_rows( g_off, g_val ) ]
+        (g_len, w_len) = (np.diff( g_off ), np.diff( cols['word_offsets'] ))
+        cap = EdgeArchive.MAX_INLINE_LEN
+        (g_code, w_code) = (np.minimum( g_len, cap ), np.minimum( w_len, cap ))
+        row = cols['same_user'].astype( np.int64 ) + 3 * cols['same_location'].astype( np.int64 ) + \
+              9 * cols['shared_contact'].astype( np.int64 ) + \
+              EdgeArchive.N_FLAG_CODES * (g_code + (cap+1) * w_code)
+        streams['row'] = row
+        streams['group_len'] = (g_len - cap)[ g_code == cap ]
+        streams['group'] = EdgeArchive.list_deltas( g_off, g_val )
+        if EdgeArchive.DICTIONARY:
+            (d_off, d_val, refs) = ListPool.dedup_csr( g_off, g_val )
+            paged = { 'group_len': np.diff( d_off ), 'group': EdgeArchive.list_deltas( d_off, d_val ), 'group_ref': refs }
+            if EdgeArchive.smaller( paged, streams ):
+                flags |= EdgeArchive.BLOCK_GROUP_DICT
+                streams.update( paged )
+
+        (w_off, w_val) = (cols['word_offsets'], cols['word_values'])
+        (t_off, t_val) = (cols['word_type_offsets'], cols['word_type_values'])
+        streams['word_len'] = (w_len - cap)[ w_code == cap ]
+        if np.array_equal( w_off, t_off ):
+            order = EdgeArchive.sort_within_rows( w_off, w_val )
+            streams['word'] = EdgeArchive.list_deltas( w_off, w_val[ order ] )
+            streams['word_type'] = t_val[ order ]
+            if EdgeArchive.DICTIONARY:
+                (d_off, d_val, refs, d_types) = ListPool.dedup_csr( w_off, w_val[ order ], t_val[ order ] )
+                paged = { 'word_len': np.diff( d_off ), 'word': EdgeArchive.list_deltas( d_off, d_val ), \
+                          'word_type': d_types, 'word_ref': refs }
+                if EdgeArchive.smaller( paged, streams ):
+                    flags |= EdgeArchive.BLOCK_WORD_DICT
+                    streams.update( paged )
+        else:
+            flags |= EdgeArchive.BLOCK_WORDS_UNSORTED
+            streams['word'] = EdgeArchive.zigzag( EdgeArchive.list_deltas( w_off, w_val ))
+            streams['word_type'] = t_val
+            streams['type_len'] = np.diff( t_off )
+
+        d_groups = cols['n_groups'] - g_len
+        d_words = cols['n_words'] - w_len
+        if d_groups.any() or d_words.any():
+            flags |= EdgeArchive.BLOCK_EXPLICIT_COUNTS
+            streams['n_groups'] = EdgeArchive.zigzag( d_groups )
+            streams['n_words'] = EdgeArchive.zigzag( d_words )
+
+        out = [ EdgeArchive.varint_encode( [n, flags] ) ]
+        for name in EdgeArchive.COLUMNS:
+            if name == 'row':
+                s = streams[ name ].astype( np.uint8 ).tostring()
+            else:
+                s = EdgeArchive.varint_encode( streams[ name ] )
+            out.append( EdgeArchive.varint_encode( [len(s)] ))
+            out.append( s )
+        return ''.join( out )
+
+    @staticmethod
+    def smaller( paged, streams ):
+        # True if the paged (dictionary) streams encode smaller than the ones they replace
+        size = lambda d, names: sum( [ len( EdgeArchive.varint_encode( d[k] )) for k in names ] )
+        return size( paged, paged.keys() ) < size( streams, [ k for k in paged.keys() if k in streams ] )
+
+    @staticmethod
+    def read_varint( f, where ):
+        # one varint from a file, for the block and column headers
+        (v, shift) = (0, 0)
+        while True:
+            ch = f.read( 1 )
+            if not ch:
+                raise AssertionError( '%s: truncated edge archive' % where )
+            v |= (ord( ch ) & 0x7f) << shift
+            if ord( ch ) < 0x80:
+                return v
+            shift += 7
+
+    @staticmethod
+    def decode_block( f, where, version = None ):
+        # the next block of f as an EdgeColumns, or None at the end of the archive
+        n = EdgeArchive.read_varint( f, where )
+        if n == 0:
+            return None
+        flags = EdgeArchive.read_varint( f, where )
+        streams = dict( (name, np.zeros( 0, dtype=np.int64 )) for name in EdgeArchive.COLUMNS )
+        for name in (EdgeArchive.COLUMNS_V1 if version == 1 else EdgeArchive.COLUMNS):
+            length = EdgeArchive.read_varint( f, where )
+            buf = f.read( length )
+            if len(buf) != length:
+                raise AssertionError( '%s: truncated edge archive' % where )
+            if name == 'row':
+                streams[ name ] = np.frombuffer( buf, dtype=np.uint8 ).astype( np.int64 )
+            else:
+                streams[ name ] = EdgeArchive.varint_decode( buf )
+        if (len(streams['row']) != n) or (streams['a_rows'].sum() != n):
+            raise AssertionError( '%s: corrupt edge archive block' % where )
+
+        a_rows = streams['a_rows']
+        a = np.repeat( np.cumsum( streams['a'] ), a_rows )
+        a_starts = np.cumsum( a_rows ) - a_rows
+        new_a = np.zeros( n, dtype=bool )
+        new_a[ a_starts ] = True
+        b_steps = np.where( new_a, a + EdgeArchive.unzigzag( streams['b'] ), streams['b'] )
+        b = EdgeArchive.segment_cumsum( b_steps, a_starts )
+
+        cap = EdgeArchive.MAX_INLINE_LEN
+        row = streams['row']
+        f_codes = row % EdgeArchive.N_FLAG_CODES
+        (g_len, w_len) = ((row / EdgeArchive.N_FLAG_CODES) % (cap+1), row / (EdgeArchive.N_FLAG_CODES * (cap+1)))
+        if not flags & EdgeArchive.BLOCK_GROUP_DICT:
+            g_len[ g_len == cap ] += streams['group_len']
+        if not flags & EdgeArchive.BLOCK_WORD_DICT:
+            w_len[ w_len == cap ] += streams['word_len']
+
+        def offsets_of( lengths ):
+            o = np.zeros( len(lengths)+1, dtype=np.int64 )
+            np.cumsum( lengths, out=o[1:] )
+            return o
+
+        def list_values( offsets, deltas ):
+            return EdgeArchive.segment_cumsum( deltas, offsets[:-1][ np.diff( offsets ) > 0 ] )
+
+        def paged( len_name, ref_name ):
+            # (offsets, values, gather) of a dictionary-paged list column
+            d_off = offsets_of( streams[ len_name ] )
+            if (len( streams[ ref_name ] ) != n) or (len(d_off) > 1 and streams[ ref_name ].max() >= len(d_off)-1):
+                raise AssertionError( '%s: corrupt edge archive dictionary page' % where )
+            return ListPool.expand_csr( d_off, list_values( d_off, streams[ len_name[:-4] ] ), streams[ ref_name ] )
+
+        cols = dict()
+        cols['a'] = a.astype( np.int32 )
+        cols['b'] = b.astype( np.int32 )
+        cols['same_user'] = (f_codes % 3).astype( np.uint8 )
+        cols['same_location'] = ((f_codes / 3) % 3).astype( np.uint8 )
+        cols['shared_contact'] = (f_codes / 9).astype( np.uint8 )
+        if flags & EdgeArchive.BLOCK_GROUP_DICT:
+            (g_off, g_val, gather) = paged( 'group_len', 'group_ref' )
+        else:
+            g_off = offsets_of( g_len )
+            g_val = list_values( g_off, streams['group'] )
+        cols['group_offsets'] = g_off
+        cols['group_values'] = g_val.astype( np.int32 )
+        if flags & EdgeArchive.BLOCK_WORD_DICT:
+            (w_off, w_val, gather) = paged( 'word_len', 'word_ref' )
+            cols['word_offsets'] = w_off
+            cols['word_values'] = w_val.astype( np.int32 )
+            cols['word_type_offsets'] = w_off.copy()
+            streams['word_type'] = streams['word_type'][ gather ]
+        elif flags & EdgeArchive.BLOCK_WORDS_UNSORTED:
+            w_off = offsets_of( w_len )
+            cols['word_offsets'] = w_off
+            cols['word_values'] = list_values( w_off, EdgeArchive.unzigzag( streams['word'] )).astype( np.int32 )
+            cols['word_type_offsets'] = offsets_of( streams['type_len'] )
+        else:
+            w_off = offsets_of( w_len )
+            cols['word_offsets'] = w_off
+            cols['word_values'] = list_values( w_off, streams['word'] ).astype( np.int32 )
+            cols['word_type_offsets'] = w_off.copy()
+        cols['word_type_values'] = streams['word_type'].astype( np.int32 )
+        (n_groups, n_words) = (np.diff( g_off ), np.diff( w_off ))
+        if flags & EdgeArchive.BLOCK_EXPLICIT_COUNTS:
+            n_groups = n_groups + EdgeArchive.unzigzag( streams['n_groups'] )
+            n_words = n_words + EdgeArchive.unzigzag( streams['n_words'] )
+        cols['n_groups'] = n_groups.astype( np.int32 )
+        cols['n_words'] = n_words.astype( np.int32 )
+        return EdgeColumns( cols )
+
+    #
+    # reading
+    #
+
+    @staticmethod
+    def iter_blocks( fn ):
+        # the blocks of the archive fn, as EdgeColumns
+        with TableIO.open( fn, 'rb' ) as f:
+            magic = f.read( len(EdgeArchive.MAGIC) )
+            if magic != EdgeArchive.MAGIC:
+                raise AssertionError( '%s: not an edge archive (bad magic)' % fn )
+            version = EdgeArchive.read_varint( f, fn )
+            if version not in (1, EdgeArchive.VERSION):
+                raise AssertionError( '%s: edge archive version %d; expected at most %d' % (fn, version, EdgeArchive.VERSION ))
+            while True:
+                c = EdgeArchive.decode_block( f, fn, version )
+                if c is None:
+                    return
+                yield c
+
+    @staticmethod
+    def read_columns( fn, id_dict_to_keep=None ):
+        blocks = list()
+        for c in EdgeArchive.iter_blocks( fn ):
+            if id_dict_to_keep is not None:
+                c = c.select( c.keep_mask( id_dict_to_keep ))
+            blocks.append( c )
+        if not blocks:
+            return EdgeColumns.from_edges( [] )
+        return EdgeColumns.concatenate( blocks ) if len(blocks) > 1 else blocks[0]
+
+    @staticmethod
+    def iter_edges( fn, id_dict_to_keep=None ):
+        # ImageEdges from the archive fn, one block in memory at a time
+        for c in EdgeArchive.iter_blocks( fn ):
+            rows = range( 0, len(c) ) if id_dict_to_keep is None else np.flatnonzero( c.keep_mask( id_dict_to_keep ))
+            for i in rows:
+                yield c.edge_at( i )
+
+    #
+    # converting to and from the text table
+    #
+
+    @staticmethod
+    def encode_text_file( src_fn, dst_fn, block_rows = None ):
+        block_rows = block_rows or EdgeArchive.BLOCK_ROWS
+        t_start = time.time()
+        c_total = 0
+        with EdgeArchiveWriter( dst_fn, block_rows ) as w:
+            with TableIO.open( src_fn ) as f:
+                while True:
+                    c = EdgeColumns.from_lines( islice( f, block_rows ), src_fn )
+                    if len(c) == 0:
+                        break
+                    c_total += len(c)
+                    w.write_columns( c )
+        sys.stderr.write('Info: encoded %d edges from %s in %f seconds\n' % (c_total, src_fn, time.time() - t_start))
+        return c_total
+
+    @staticmethod
+    def decode_to_text_file( src_fn, dst_fn ):
+        t_start = time.time()
+        c_total = 0
+        with TableIO.open( dst_fn, 'w' ) as f:
+            for c in EdgeArchive.iter_blocks( src_fn ):
+                c_total += c.write_lines( f )
+        sys.stderr.write('Info: decoded %d edges from %s in %f seconds\n' % (c_total, src_fn, time.time() - t_start))
+        return c_total
+
+class EdgeArchiveWriter:
+    #
+    # Streaming archive writer: edges (or EdgeColumns) go in, and are
+    # sorted and written a block at a time. Use as a context manager.
+    #
+
+    def __init__( self, fn, block_rows = None ):
+        self.block_rows = block_rows or EdgeArchive.BLOCK_ROWS
+        self.pending = list()
+        self.f = TableIO.open( fn, 'wb' )
+        self.f.write( EdgeArchive.MAGIC )
+        self.f.write( EdgeArchive.varint_encode( [EdgeArchive.VERSION] ))
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        self.close()
+        return False
+
+    def write( self, e ):
+        self.pending.append( e )
+        if len(self.pending) >= self.block_rows:
+            self.flush()
+
+    def flush( self ):
+        if self.pending:
+            c = EdgeColumns.from_edges( self.pending )
+            self.pending = list()
+            self.f.write( EdgeArchive.encode_block( c ))
+
+    def write_columns( self, c ):
+        self.flush()
+        for start in range( 0, len(c), self.block_rows ):
+            rows = np.arange( start, min( start + self.block_rows, len(c) ))
+            self.f.write( EdgeArchive.encode_block( c.take( rows )))
+
+    def close( self ):
+        if self.f is not None:
+            self.flush()
+            self.f.write( EdgeArchive.varint_encode( [0] ))
+            self.f.close()
+            self.f = None
+
+if __name__ == '__main__':
+    usage = 'Usage: $0 --encode input-edge-table output.cp6e\n' \
+            '       $0 --decode input.cp6e output-edge-table\n'
+    if (len(sys.argv) != 4) or (sys.argv[1] not in ('--encode', '--decode')):
+        sys.stderr.write( usage )
+        sys.exit(0)
+    if sys.argv[1] == '--encode':
+        EdgeArchive.encode_text_file( sys.argv[2], sys.argv[3] )
+    else:
+        EdgeArchive.decode_to_text_file( sys.argv[2], sys.argv[3] )
@@ -0,0 +1,391 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Columnar (struct-of-arrays) form of the image edge table, stored on
+## disk as a directory of .npy files:
+##
+## a, b                  int32   image A and B IDs
+## n_groups, n_words     int32   fields 2 and 3 of the text table
+## group_offsets         int64   CSR offsets (n_edges+1) into group_values
+## group_values          int32   shared group IDs
+## word_offsets          int64   CSR offsets into word_values
+## word_values           int32   shared word IDs
+## word_type_offsets     int64   CSR offsets into word_type_values
+## word_type_values      int32   shared word types
+## same_user             uint8   flag codes (see FLAG_STRS)
+## same_location         uint8
+## shared_contact        uint8
+##
+## ...plus edge_columns.txt, holding the format version and row count.
+## Writing the text table back out reproduces what EdgeTable.write_to_file
+## writes, byte for byte.
+##
+## EdgeColumnList wraps an EdgeColumns so it can stand in for the list of
+## ImageEdges in EdgeTable.edges (the "compact" mode): indexing and
+## iterating yield EdgeColumnViews, which have the same attributes as an
+## ImageEdge but read them out of the columns on demand.
+##
+
+import os
+import sys
+import time
+from array import array
+
+import numpy as np
+
+from cp6.utilities.image_edge import ImageEdge
+from cp6.utilities.chunked_reader import ChunkedReader
+from cp6.utilities.table_io import TableIO
+
+class EdgeColumns:
+
+    VERSION = 1
+    MARKER = 'edge_columns.txt'
+
+    # flag codes; anything not '0', '1', or '.' is '1', as in ImageEdge.canonical_flag
+    FLAG_STRS = ( '0', '1', '.' )
+    FLAG_CODES = { '0': 0, '1': 1, '.': 2 }
+
+    SCALARS = ( ('a', np.int32), ('b', np.int32), ('n_groups', np.int32), ('n_words', np.int32), \
+                ('same_user', np.uint8), ('same_location', np.uint8), ('shared_contact', np.uint8) )
+    LISTS = ( 'group', 'word', 'word_type' )
+
+    def __init__( self, cols ):
+        self.cols = cols
+
+    def __len__( self ):
+        return len( self.cols['a'] )
+
+    @staticmethod
+    def flag_code( s ):
+        return EdgeColumns.FLAG_CODES.get( ImageEdge.canonical_flag( s ), 1 )
+
+    @staticmethod
+    def column_names():
+        names = [ n for (n, t) in EdgeColumns.SCALARS ]
+        for l in EdgeColumns.LISTS:
+            names.extend( [ '%s_offsets' % l, '%s_values' % l ] )
+        return names
+
+    @staticmethod
+    def to_numpy( a, dtype ):
+        # array.array -> numpy, without going through python ints
+        if len(a) == 0:
+            return np.zeros( 0, dtype=dtype )
+        return np.frombuffer( a, dtype=dtype ).copy()
+
+    @staticmethod
+    def from_arrays( scalars, lists ):
+        # scalars: name -> array('i') or array('B'); lists: name -> (lengths, values)
+        cols = dict()
+        for (name, dtype) in EdgeColumns.SCALARS:
+            cols[ name ] = EdgeColumns.to_numpy( scalars[name], dtype )
+        for l in EdgeColumns.LISTS:
+            (lengths, values) = lists[ l ]
+            offsets = np.zeros( len(lengths)+1, dtype=np.int64 )
+            np.cumsum( EdgeColumns.to_numpy( lengths, np.int32 ), out=offsets[1:] )
+            cols[ '%s_offsets' % l ] = offsets
+            cols[ '%s_values' % l ] = EdgeColumns.to_numpy( values, np.int32 )
+        return EdgeColumns( cols )
+
+    @staticmethod
+    def new_accumulators():
+        scalars = dict( (name, array( 'B' if dtype == np.uint8 else 'i' )) for (name, dtype) in EdgeColumns.SCALARS )
+        lists = dict( (l, (array('i'), array('i'))) for l in EdgeColumns.LISTS )
+        return (scalars, lists)
+
+    @staticmethod
+    def from_edges( edges ):
+        (scalars, lists) = EdgeColumns.new_accumulators()
+        for e in edges:
+            scalars['a'].append( e.image_A_id )
+            scalars['b'].append( e.image_B_id )
+            scalars['n_groups'].append( len(e.shared_groups) )
+            scalars['n_words'].append( len(e.shared_words) )
+            scalars['same_user'].append( EdgeColumns.flag_code( e.same_user_flag ))
+            scalars['same_location'].append( EdgeColumns.flag_code( e.same_location_flag ))
+            scalars['shared_contact'].append( EdgeColumns.flag_code( e.shared_contact_flag ))
+            for (l, v) in (('group', e.shared_groups), ('word', e.shared_words), ('word_type', e.shared_word_types)):
+                lists[l][0].append( len(v) )
+                lists[l][1].extend( v )
+        return EdgeColumns.from_arrays( scalars, lists )
+
+    @staticmethod
+    def from_lines( lines, where, id_dict_to_keep=None ):
+        # parse text table lines straight into columns, without building
+        # ImageEdges; where names the source in error messages
+        (scalars, lists) = EdgeColumns.new_accumulators()
+        c_line = 0
+        for raw_line in lines:
+            c_line += 1
+            fields = raw_line.split()
+            if len(fields) != 10:
+                raise AssertionError( '%s line %d: expected 10 fields, got %d' % \
+                                      (where, c_line, len(fields) ))
+            (image_A_id, image_B_id) = (int(fields[0]), int(fields[1]))
+            if (id_dict_to_keep is not None) and not ((image_A_id in id_dict_to_keep) and (image_B_id in id_dict_to_keep)):
+                continue
+            scalars['a'].append( image_A_id )
+            scalars['b'].append( image_B_id )
+            scalars['n_groups'].append( int(fields[2]) )
+            scalars['n_words'].append( int(fields[3]) )
+            for (l, field) in (('group', fields[4]), ('word', fields[5]), ('word_type', fields[6])):
+                if field == 'none':
+                    lists[l][0].append( 0 )
+                else:
+                    v = [int(x) for x in field.split(',')]
+                    lists[l][0].append( len(v) )
+                    lists[l][1].extend( v )
+            scalars['same_user'].append( EdgeColumns.flag_code( fields[7] ))
+            scalars['same_location'].append( EdgeColumns.flag_code( fields[8] ))
+            scalars['shared_contact'].append( EdgeColumns.flag_code( fields[9] ))
+        return EdgeColumns.from_arrays( scalars, lists )
+
+    @staticmethod
+    def read_from_text_file( fn, id_dict_to_keep=None, n_workers=1 ):
+        #
+        # With n_workers > 1 (or None, for one per CPU), the file is split
+        # into line-aligned byte ranges which are parsed in parallel and
+        # concatenated in file order; the ID filter is applied in the workers.
+        #
+        t_start = time.time()
+        if (n_workers is None) or (n_workers > 1):
+            if (id_dict_to_keep is not None) and not isinstance( id_dict_to_keep, (dict, set, frozenset) ):
+                id_dict_to_keep = set( id_dict_to_keep )
+            chunks = ChunkedReader.parallel_map( fn, read_edge_chunk, n_workers, (id_dict_to_keep,) )
+            t = EdgeColumns.concatenate( chunks ) if chunks else EdgeColumns.from_lines( [], fn )
+        else:
+            with TableIO.open( fn ) as f:
+                t = EdgeColumns.from_lines( f, fn, id_dict_to_keep )
+        sys.stderr.write('Info: read %d edges into columns in %f seconds\n' % (len(t), time.time() - t_start))
+        return t
+
+    def write_to_dir( self, dir_name ):
+        if not os.path.isdir( dir_name ):
+            os.makedirs( dir_name )
+        for name in EdgeColumns.column_names():
+            np.save( os.path.join( dir_name, '%s.npy' % name ), self.cols[ name ] )
+        # write the marker last, so a partially-written directory doesn't load
+        with open( os.path.join( dir_name, EdgeColumns.MARKER ), 'w' ) as f:
+            f.write( '%d %d\n' % (EdgeColumns.VERSION, len(self)) )
+
+    @staticmethod
+    def is_columns_dir( dir_name ):
+        return os.path.isfile( os.path.join( dir_name, EdgeColumns.MARKER ))
+
+    @staticmethod
+    def read_from_dir( dir_name, mmap=True ):
+        marker = os.path.join( dir_name, EdgeColumns.MARKER )
+        if not os.path.isfile( marker ):
+            raise AssertionError( '%s: no %s; not an edge column directory?' % (dir_name, EdgeColumns.MARKER ))
+        with open( marker ) as f:
+            (version, n_rows) = map( int, f.readline().split() )
+        if version != EdgeColumns.VERSION:
+            raise AssertionError( '%s: edge column version %d; expected %d' % (dir_name, version, EdgeColumns.VERSION ))
+        cols = dict()
+        for name in EdgeColumns.column_names():
+            cols[ name ] = np.load( os.path.join( dir_name, '%s.npy' % name ), mmap_mode='r' if mmap else None )
+        t = EdgeColumns( cols )
+        if len(t) != n_rows:
+            raise AssertionError( '%s: %d rows in columns, %d in marker' % (dir_name, len(t), n_rows ))
+        return t
+
+    def list_at( self, l, i ):
+        offsets = self.cols[ '%s_offsets' % l ]
+        return self.cols[ '%s_values' % l ][ offsets[i]:offsets[i+1] ].tolist()
+
+    def edge_at( self, i ):
+        c = self.cols
+        return ImageEdge( int(c['a'][i]), int(c['b'][i]), \
+                          self.list_at( 'group', i ), self.list_at( 'word', i ), self.list_at( 'word_type', i ), \
+                          EdgeColumns.FLAG_STRS[ c['same_user'][i] ], \
+                          EdgeColumns.FLAG_STRS[ c['same_location'][i] ], \
+                          EdgeColumns.FLAG_STRS[ c['shared_contact'][i] ] )
+
+    def to_edges( self ):
+        return [ self.edge_at( i ) for i in range( 0, len(self) ) ]
+
+    @staticmethod
+    def concatenate( tables ):
+        cols = dict()
+        for (name, dtype) in EdgeColumns.SCALARS:
+            cols[ name ] = np.concatenate( [ t.cols[name] for t in tables ] ).astype( dtype )
+        for l in EdgeColumns.LISTS:
+            (o, v) = ('%s_offsets' % l, '%s_values' % l)
+            offsets = [ np.zeros( 1, dtype=np.int64 ) ]
+            base = 0
+            for t in tables:
+                offsets.append( t.cols[o][1:] - t.cols[o][0] + base )
+                base += t.cols[o][-1] - t.cols[o][0]
+            cols[ o ] = np.concatenate( offsets ).astype( np.int64 )
+            cols[ v ] = np.concatenate( [ t.cols[v][ t.cols[o][0]:t.cols[o][-1] ] for t in tables ] ).astype( np.int32 )
+        return EdgeColumns( cols )
+
+    def select( self, mask ):
+        # new EdgeColumns holding the rows where mask is True, in order
+        return self.take( np.flatnonzero( mask ))
+
+    def take( self, rows ):
+        # new EdgeColumns holding the given rows, in the given order
+        rows = np.asarray( rows, dtype=np.int64 )
+        cols = dict()
+        for (name, dtype) in EdgeColumns.SCALARS:
+            cols[ name ] = np.asarray( self.cols[ name ][ rows ], dtype=dtype )
+        for l in EdgeColumns.LISTS:
+            old_offsets = self.cols[ '%s_offsets' % l ]
+            starts = old_offsets[ rows ]
+            lengths = old_offsets[ rows+1 ] - starts
+            offsets = np.zeros( len(rows)+1, dtype=np.int64 )
+            np.cumsum( lengths, out=offsets[1:] )
+            # position k of the output list for row r comes from starts[r] + (k - offsets[r])
+            gather = np.arange( offsets[-1], dtype=np.int64 ) + np.repeat( starts - offsets[:-1], lengths )
+            cols[ '%s_offsets' % l ] = offsets
+            cols[ '%s_values' % l ] = np.asarray( self.cols[ '%s_values' % l ][ gather ], dtype=np.int32 )
+        return EdgeColumns( cols )
+
+    def nbytes( self ):
+        return sum( self.cols[ name ].nbytes for name in EdgeColumns.column_names() )
+
+    def keep_mask( self, ids_to_keep ):
+        # True for each edge whose endpoints are both in ids_to_keep
+        ids = np.array( sorted( ids_to_keep ), dtype=np.int64 )
+        maxid = ids[-1] if len(ids) else -1
+        keep = np.zeros( maxid+2, dtype=bool )
+        keep[ ids ] = True
+        a = np.clip( self.cols['a'], -1, maxid+1 )
+        b = np.clip( self.cols['b'], -1, maxid+1 )
+        return keep[a] & keep[b] & (a >= 0) & (b >= 0)
+
+    def write_text( self, fn, ids_to_keep = None ):
+        # same format as EdgeTable.write_to_file, including the
+        # (c_total, c_written) return; works in blocks so a memory-mapped
+        # table isn't pulled into RAM all at once
+        mask = None if ids_to_keep is None else self.keep_mask( ids_to_keep )
+        with TableIO.open( fn, 'w' ) as f:
+            c_written = self.write_lines( f, mask )
+        return (len(self), c_written)
+
+    def write_lines( self, f, mask = None ):
+        # write the rows (where mask is True) as text table lines to the
+        # open file f; returns the number written
+        c = self.cols
+        block = 65536
+        c_written = 0
+        for start in range( 0, len(self), block ):
+            end = min( start+block, len(self) )
+            scalars = dict( (name, c[name][start:end].tolist()) for (name, dtype) in EdgeColumns.SCALARS )
+            lists = dict()
+            for l in EdgeColumns.LISTS:
+                offsets = c[ '%s_offsets' % l ][start:end+1]
+                values = c[ '%s_values' % l ][ offsets[0]:offsets[-1] ].tolist()
+                rel = (offsets - offsets[0]).tolist()
+                lists[ l ] = [ values[ rel[i]:rel[i+1] ] for i in range( 0, end-start ) ]
+            rows = range( 0, end-start ) if mask is None else np.flatnonzero( mask[start:end] ).tolist()
+            c_written += len( rows )
+            for i in rows:
+                f.write( '%d %d %d %d ' % (scalars['a'][i], scalars['b'][i], scalars['n_groups'][i], scalars['n_words'][i]))
+                strs = [ ','.join(map(str, lists[l][i])) if len(lists[l][i]) else 'none' for l in EdgeColumns.LISTS ]
+                f.write( '%s %s %s ' % tuple( strs ))
+                f.write( '%s %s %s\n' % (EdgeColumns.FLAG_STRS[ scalars['same_user'][i] ], \
+                                         EdgeColumns.FLAG_STRS[ scalars['same_location'][i] ], \
+                                         EdgeColumns.FLAG_STRS[ scalars['shared_contact'][i] ]))
+        return c_written
+
+def read_edge_chunk( fn, start, end, id_dict_to_keep ):
+    # ChunkedReader worker: one byte range of a text edge table -> EdgeColumns
+    return EdgeColumns.from_lines( ChunkedReader.iter_lines( fn, start, end ), \
+                                   '%s bytes %d-%d' % (fn, start, end), id_dict_to_keep )
+
+class EdgeColumnView( object ):
+    # read-only stand-in for an ImageEdge, backed by row i of an EdgeColumns
+
+    __slots__ = ( 'columns', 'i' )
+
+    def __init__( self, columns, i ):
+        self.columns = columns
+        self.i = i
+
+    image_A_id = property( lambda self: int( self.columns.cols['a'][ self.i ] ))
+    image_B_id = property( lambda self: int( self.columns.cols['b'][ self.i ] ))
+    n_shared_groups = property( lambda self: int( self.columns.cols['n_groups'][ self.i ] ))
+    n_shared_words = property( lambda self: int( self.columns.cols['n_words'][ self.i ] ))
+    shared_groups = property( lambda self: self.columns.list_at( 'group', self.i ))
+    shared_words = property( lambda self: self.columns.list_at( 'word', self.i ))
+    shared_word_types = property( lambda self: self.columns.list_at( 'word_type', self.i ))
+    same_user_flag = property( lambda self: EdgeColumns.FLAG_STRS[ self.columns.cols['same_user'][ self.i ]] )
+    same_location_flag = property( lambda self: EdgeColumns.FLAG_STRS[ self.columns.cols['same_location'][ self.i ]] )
+    shared_contact_flag = property( lambda self: EdgeColumns.FLAG_STRS[ self.columns.cols['shared_contact'][ self.i ]] )
+
+    def to_image_edge( self ):
+        return self.columns.edge_at( self.i )
+
+class EdgeColumnList( object ):
+    #
+    # Enough of the list protocol for the existing EdgeTable.edges callers:
+    # len(), indexing, iteration, append() and extend(). Appending is
+    # amortized by buffering ImageEdges until the next read.
+    #
+
+    def __init__( self, columns ):
+        self.columns = columns
+        self.pending = list()
+
+    def flush( self ):
+        if self.pending:
+            self.columns = EdgeColumns.concatenate( [ self.columns, EdgeColumns.from_edges( self.pending ) ] )
+            self.pending = list()
+        return self.columns
+
+    def __len__( self ):
+        return len( self.columns ) + len( self.pending )
+
+    def __getitem__( self, i ):
+        n = len( self.flush() )
+        if i < 0:
+            i += n
+        if (i < 0) or (i >= n):
+            raise IndexError( 'edge index %d out of range (%d edges)' % (i, n) )
+        return EdgeColumnView( self.columns, i )
+
+    def __iter__( self ):
+        columns = self.flush()
+        for i in xrange( 0, len(columns) ):
+            yield EdgeColumnView( columns, i )
+
+    def append( self, e ):
+        self.pending.append( e )
+
+    def extend( self, edges ):
+        if isinstance( edges, EdgeColumnList ):
+            self.columns = EdgeColumns.concatenate( [ self.flush(), edges.flush() ] )
+        else:
+            self.pending.extend( edges )
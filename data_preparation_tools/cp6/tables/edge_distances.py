@@ -0,0 +1,200 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Visual distances along edges: for each edge (A, B) of an edge table
+## and each chosen image feature table (see image_feature_table.py), the
+## distances between A's and B's feature vectors, written next to the
+## edge table as image_edge_distances.txt (compressed like the table):
+##
+## image_A_id image_B_id CEDD_l1 CEDD_l2 ... Gabor_chi2 ...
+##
+## The first line names the columns; then there is one line per edge, in
+## edge table order, so line i+1 belongs to edge table row i. A distance
+## is nan if either image has no vector in that feature table.
+##
+## METRICS:
+##
+## l1       sum |x-y|
+## l2       sqrt( sum (x-y)^2 )
+## cosine   1 - x.y / (|x| |y|); two zero vectors are at 0, a zero
+##          vector and any other at 1
+## chi2     1/2 sum (x-y)^2 / (|x|+|y|), over terms with |x|+|y| > 0
+##          (for histograms, |x|+|y| is the usual x+y)
+##
+## Feature tables are memory-mapped matrices; the endpoints of each block
+## of edges are gathered from them with one fancy-index per side and the
+## distances computed as whole-block numpy operations. Blocks hold about
+## BLOCK_VALUES values per side, so fewer edges for longer vectors.
+##
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from cp6.tables.edge_index import EdgeIndex
+from cp6.tables.image_feature_table import ImageFeatureTable
+from cp6.utilities.table_io import TableIO
+
+class EdgeDistances:
+
+    METRICS = ( 'l1', 'l2', 'cosine', 'chi2' )
+    BLOCK_VALUES = 1 << 16
+    WRITE_ROWS = 65536
+    BASE_NAME = 'image_edge_distances.txt'
+
+    def __init__( self, names, a, b, values ):
+        # values[i,j] is distance column names[j] of edge (a[i], b[i])
+        self.names = names
+        self.a = a
+        self.b = b
+        self.values = values
+
+    def __len__( self ):
+        return len( self.a )
+
+    def column( self, name ):
+        return self.values[ :, self.names.index( name ) ]
+
+    @staticmethod
+    def parse_metrics( s ):
+        metrics = tuple( s.split( ',' )) if s else EdgeDistances.METRICS
+        for m in metrics:
+            if m not in EdgeDistances.METRICS:
+                raise AssertionError( 'Unknown distance "%s"; expected one of %s' % (m, ','.join( EdgeDistances.METRICS )))
+        return metrics
+
+    @staticmethod
+    def output_fn( edge_fn ):
+        # where the distances for edge_fn go: beside it, compressed the same way
+        return TableIO.like( os.path.join( os.path.dirname( edge_fn.rstrip( os.sep )), EdgeDistances.BASE_NAME ), edge_fn )
+
+    @staticmethod
+    def block_distances( x, y, metrics ):
+        # {metric: distances between the rows of x and y}; x and y are float64 blocks, overwritten
+        d = dict()
+        diff = x - y
+        if 'l2' in metrics:
+            d['l2'] = np.sqrt( np.einsum( 'ij,ij->i', diff, diff ))
+        if 'cosine' in metrics:
+            (nx, ny) = (np.sqrt( np.einsum( 'ij,ij->i', x, x )), np.sqrt( np.einsum( 'ij,ij->i', y, y )))
+            with np.errstate( divide='ignore', invalid='ignore' ):
+                c = 1.0 - np.einsum( 'ij,ij->i', x, y ) / (nx * ny)
+            zero = (nx == 0) | (ny == 0)
+            c[ zero ] = np.where( (nx == 0) & (ny == 0), 0.0, 1.0 )[ zero ]
+            d['cosine'] = c
+        if 'chi2' in metrics:
+            # where |x|+|y| is 0 so is x-y, so any positive divisor gives the term's 0
+            s = np.abs( x, x )
+            s += np.abs( y, y )
+            np.maximum( s, np.finfo( np.float64 ).tiny, s )
+            d['chi2'] = 0.5 * np.einsum( 'ij,ij->i', diff, np.divide( diff, s, s ))
+        if 'l1' in metrics:
+            d['l1'] = np.abs( diff, diff ).sum( axis=1 )
+        return d
+
+    @staticmethod
+    def compute( a, b, tables, metrics = None, block_edges = None ):
+        #
+        # EdgeDistances for edges (a, b) over each ImageFeatureTable in
+        # tables; columns are <feature>_<metric>, by table then metric.
+        #
+        metrics = metrics or EdgeDistances.METRICS
+        (a, b) = (np.asarray( a, dtype=np.int64 ), np.asarray( b, dtype=np.int64 ))
+        names = [ '%s_%s' % (ImageFeatureTable.name_of( t.fn ), m) for t in tables for m in metrics ]
+        values = np.empty( (len(a), len(names)), dtype=np.float64 )
+        for (k, t) in enumerate( tables ):
+            n_block = block_edges or max( 64, EdgeDistances.BLOCK_VALUES / max( 1, t.dim() ))
+            (rows_a, rows_b) = (t.rows_of( a ), t.rows_of( b ))
+            missing = (rows_a < 0) | (rows_b < 0)
+            (rows_a, rows_b) = (np.maximum( rows_a, 0 ), np.maximum( rows_b, 0 ))
+            for start in range( 0, len(a), n_block ):
+                end = min( start + n_block, len(a) )
+                x = t.values[ rows_a[ start:end ]].astype( np.float64 )
+                y = t.values[ rows_b[ start:end ]].astype( np.float64 )
+                d = EdgeDistances.block_distances( x, y, metrics )
+                for (j, m) in enumerate( metrics ):
+                    values[ start:end, k * len(metrics) + j ] = d[m]
+            values[ missing, k * len(metrics):(k+1) * len(metrics) ] = np.nan
+            if missing.any():
+                sys.stderr.write('Info: %s has no vector for an endpoint of %d of %d edges\n' % \
+                                 (t.fn, np.count_nonzero( missing ), len(a)))
+        return EdgeDistances( names, a, b, values )
+
+    @staticmethod
+    def from_edge_table( edge_fn, feature_fns, metrics = None, block_edges = None ):
+        # EdgeDistances for every edge in edge_fn (text, archive, or column directory)
+        t_start = time.time()
+        (a, b, offsets) = EdgeIndex.scan_endpoints( edge_fn )
+        tables = [ ImageFeatureTable.load( fn ) for fn in feature_fns ]
+        d = EdgeDistances.compute( a, b, tables, metrics, block_edges )
+        sys.stderr.write('Info: computed %d distances for %d edges of %s in %f seconds\n' % \
+                         (len(d.names), len(a), edge_fn, time.time() - t_start))
+        return d
+
+    def write_to_file( self, fn ):
+        with TableIO.open( fn, 'w' ) as f:
+            f.write( ' '.join( ['image_A_id', 'image_B_id'] + self.names ) + '\n' )
+            fmt = '%d %d' + ' %.6g' * len( self.names ) + '\n'
+            for start in range( 0, len(self), EdgeDistances.WRITE_ROWS ):
+                end = min( start + EdgeDistances.WRITE_ROWS, len(self) )
+                rows = zip( self.a[ start:end ].tolist(), self.b[ start:end ].tolist(), *self.values[ start:end ].T.tolist() )
+                f.write( ''.join( [ fmt % r for r in rows ] ))
+        return len(self)
+
+    @staticmethod
+    def read_from_file( fn ):
+        with TableIO.open( fn ) as f:
+            header = f.readline().split()
+            if header[ :2 ] != ['image_A_id', 'image_B_id']:
+                raise AssertionError( '%s: expected an image_A_id image_B_id ... header' % fn )
+            v = np.fromstring( f.read(), dtype=np.float64, sep=' ' )
+        if len(v) % len(header):
+            raise AssertionError( '%s: %d values is not a whole number of %d-column rows' % (fn, len(v), len(header)))
+        v = v.reshape( (-1, len(header)) )
+        return EdgeDistances( header[2:], v[:,0].astype( np.int64 ), v[:,1].astype( np.int64 ), v[:,2:].copy() )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='Per-edge visual feature distances' )
+    parser.add_argument( '-m', '--metrics', help='comma list from %s (default: all)' % ','.join( EdgeDistances.METRICS ))
+    parser.add_argument( '-o', '--output', help='output file (default: %s beside the edge table)' % EdgeDistances.BASE_NAME )
+    parser.add_argument( '--block-edges', type=int, help='edges per vectorized block (default: about %d values per side)' % EdgeDistances.BLOCK_VALUES )
+    parser.add_argument( 'edge_table', help='edge table, archive, or column directory' )
+    parser.add_argument( 'features', nargs='+', help='feature table files, or names (e.g. CEDD) found beside the edge table' )
+    args = parser.parse_args()
+    edge_dir = os.path.dirname( args.edge_table.rstrip( os.sep ))
+    feature_fns = [ fn if os.path.isfile( fn ) else ImageFeatureTable.find( edge_dir, fn ) for fn in args.features ]
+    d = EdgeDistances.from_edge_table( args.edge_table, feature_fns, EdgeDistances.parse_metrics( args.metrics ), args.block_edges )
+    out_fn = args.output or EdgeDistances.output_fn( args.edge_table )
+    sys.stderr.write('Info: wrote %d edges to %s\n' % (d.write_to_file( out_fn ), out_fn ))
@@ -0,0 +1,402 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Clique-compressed edge tables (.cp6h).
+##
+## Sharing a group (or a word) makes an edge between every pair of
+## images holding it, and McAuley's same-user flag does the same for
+## every pair of photos by one owner; an owner with 2000 photos is ~2M
+## edge table rows. A HyperedgeTable stores each such complete clique
+## once, as a hyperedge listing its members, and keeps a residual table
+## of whatever the hyperedges don't imply:
+##
+## O members                   an owner: every pair has same_user 1
+## G group_id members          every pair shares group_id
+## W word_id members types     every pair shares word_id; types[i] is
+##                             member i's word type nibble (the pair's
+##                             shared word type is A's + 16 * B's)
+## E <edge table row>          a residual edge (see below)
+##
+## members and types are comma lists. The file starts with the header
+##
+## cp6h version n_edges user location contact owner_location owner_contact
+##
+## giving the number of edges the table expands to and the flags implied
+## for pairs without a residual row: (user, location, contact) for pairs
+## made by groups or words, and (1, owner_location, owner_contact) for
+## pairs in an owner hyperedge.
+##
+## A pair is an edge if both images are in some hyperedge or it has a
+## residual row. Its shared groups (words, types) are those implied by
+## the hyperedges plus those in its residual row, and its flags are the
+## residual row's if there is one, otherwise the implied ones. A residual
+## row holds an edge none of the hyperedges imply, or the leftover lists
+## and actual flags of one they imply only in part.
+##
+## Hyperedges are only made for complete cliques of at least MIN_MEMBERS
+## images whose members agree (e.g., on their type for a word), so the
+## expansion is exact: the edges come back in canonical form (see
+## EdgeSorter.canonical_edge), sorted by (A, B), with A < B.
+##
+## Expansion is lazy. iter_edges generates the pairs a node at a time,
+## and each is a HyperImageEdge, whose shared lists are only intersected
+## from its endpoints' memberships when first read.
+##
+## The format is line-oriented text and may be compressed like any other
+## table (image_edge_table.cp6h.gz; see table_io.py.)
+##
+
+import sys
+import time
+import argparse
+from collections import defaultdict, Counter
+
+from cp6.tables.edge_sort import EdgeSorter
+from cp6.tables.edge_partition import UnionFind
+from cp6.utilities.image_edge import ImageEdge
+from cp6.utilities.table_io import TableIO
+
+class HyperedgeTable:
+
+    VERSION = 1
+    MIN_MEMBERS = 3
+
+    def __init__( self, owners, groups, words, residual, n_edges, flags, owner_flags ):
+        #
+        # owners: list of member lists; groups: {group_id: members};
+        # words: {word_id: (members, types)}; residual: canonical
+        # ImageEdges; flags: implied (user, location, contact);
+        # owner_flags: implied (location, contact) within an owner.
+        #
+        self.owners = owners
+        self.groups = groups
+        self.words = words
+        self.residual = dict( ((e.image_A_id, e.image_B_id), e) for e in residual )
+        self.n_edges = n_edges
+        self.flags = tuple( flags )
+        self.owner_flags = tuple( owner_flags )
+
+        # per-node memberships, for expanding pairs
+        self.node_owner = dict()
+        for (i, members) in enumerate( owners ):
+            for m in members:
+                self.node_owner[ m ] = i
+        self.node_groups = defaultdict( set )
+        for (g, members) in groups.iteritems():
+            for m in members:
+                self.node_groups[ m ].add( g )
+        self.node_words = defaultdict( dict )
+        for (w, (members, types)) in words.iteritems():
+            for (m, t) in zip( members, types ):
+                self.node_words[ m ][ w ] = t
+        self.residual_nbrs = defaultdict( list )
+        for (a, b) in self.residual:
+            self.residual_nbrs[ a ].append( b )
+
+    def __len__( self ):
+        return self.n_edges
+
+    @property
+    def edges( self ):
+        # a sized, iterable view of the expanded edges, as EdgeTable.edges
+        return HyperedgeList( self )
+
+    def nodes( self ):
+        return sorted( set( self.node_owner ) | set( self.node_groups ) | set( self.node_words ) | set( self.residual_nbrs ))
+
+    def partners( self, a ):
+        # sorted b > a such that (a, b) is an edge
+        nbrs = set( self.residual_nbrs.get( a, () ))
+        o = self.node_owner.get( a )
+        if o is not None:
+            nbrs.update( self.owners[ o ] )
+        for g in self.node_groups.get( a, () ):
+            nbrs.update( self.groups[ g ] )
+        for w in self.node_words.get( a, () ):
+            nbrs.update( self.words[ w ][0] )
+        return sorted( b for b in nbrs if b > a )
+
+    def edge( self, a, b ):
+        # the edge (a, b), a < b, assumed present
+        return HyperImageEdge( self, a, b, self.residual.get( (a, b) ))
+
+    def iter_edges( self, id_dict_to_keep = None ):
+        # every edge, in (A, B) order; only those with both endpoints in id_dict_to_keep if given
+        for a in self.nodes():
+            if (id_dict_to_keep is not None) and (a not in id_dict_to_keep):
+                continue
+            for b in self.partners( a ):
+                if (id_dict_to_keep is None) or (b in id_dict_to_keep):
+                    yield HyperImageEdge( self, a, b, self.residual.get( (a, b) ))
+
+    def implied_flags( self, a, b ):
+        o = self.node_owner.get( a )
+        if (o is not None) and (o == self.node_owner.get( b )):
+            return ('1',) + self.owner_flags
+        return self.flags
+
+    def shared_lists( self, a, b ):
+        # (groups, words, word types) the hyperedges imply for (a, b)
+        groups = self.node_groups.get( a, set() ) & self.node_groups.get( b, set() )
+        (wa, wb) = (self.node_words.get( a, {} ), self.node_words.get( b, {} ))
+        words = sorted( w for w in wa if w in wb )
+        return (sorted( groups ), words, [ wa[w] + 16 * wb[w] for w in words ])
+
+    #
+    # compression
+    #
+
+    @staticmethod
+    def cliques( members, counts, min_members ):
+        # keys whose members form a complete clique of at least min_members
+        r = set()
+        for (k, m) in members.iteritems():
+            n = len(m)
+            if (n >= min_members) and (counts[k] == n * (n-1) / 2):
+                r.add( k )
+        return r
+
+    @staticmethod
+    def from_edges( edges, min_members = None ):
+        min_members = min_members or HyperedgeTable.MIN_MEMBERS
+        canon = dict()
+        for e in edges:
+            c = EdgeSorter.canonical_edge( e )[0]
+            key = (c.image_A_id, c.image_B_id)
+            if key in canon:
+                raise AssertionError( 'Edge %d-%d appears more than once; dedup the table first (see edge_sort.py)' % key )
+            canon[ key ] = c
+
+        # which groups and words form consistent complete cliques
+        (g_members, g_counts) = (defaultdict( set ), Counter())
+        (w_types, w_counts, w_bad) = (defaultdict( dict ), Counter(), set())
+        owner_edges = list()
+        for ((a, b), c) in canon.iteritems():
+            for g in c.shared_groups:
+                g_members[ g ].update( (a, b) )
+                g_counts[ g ] += 1
+            if len( c.shared_words ) != len( c.shared_word_types ):
+                w_bad.update( c.shared_words )
+            else:
+                for (w, t) in zip( c.shared_words, c.shared_word_types ):
+                    w_counts[ w ] += 1
+                    for (m, mt) in ((a, t & 15), (b, t >> 4)):
+                        if w_types[ w ].setdefault( m, mt ) != mt:
+                            w_bad.add( w )
+            if c.same_user_flag == '1':
+                owner_edges.append( (a, b) )
+        clique_groups = HyperedgeTable.cliques( g_members, g_counts, min_members )
+        clique_words = HyperedgeTable.cliques( w_types, w_counts, min_members ) - w_bad
+
+        # owners: components of the same-user edges which are complete cliques
+        owner_nodes = sorted( set( x for ab in owner_edges for x in ab ))
+        index = dict( (n, i) for (i, n) in enumerate( owner_nodes ))
+        uf = UnionFind( len(owner_nodes) )
+        for (a, b) in owner_edges:
+            uf.union( index[a], index[b] )
+        (o_members, o_counts) = (defaultdict( set ), Counter())
+        for (a, b) in owner_edges:
+            r = uf.find( index[a] )
+            o_members[ r ].update( (a, b) )
+            o_counts[ r ] += 1
+        owners = sorted( sorted( o_members[r] ) for r in HyperedgeTable.cliques( o_members, o_counts, min_members ))
+        owner_of = dict()
+        for (i, members) in enumerate( owners ):
+            for m in members:
+                owner_of[ m ] = i
+
+        # implied flags are the commonest among the pairs the hyperedges imply
+        (flag_counts, owner_flag_counts) = (Counter(), Counter())
+        for ((a, b), c) in canon.iteritems():
+            flags = (c.same_user_flag, c.same_location_flag, c.shared_contact_flag)
+            if (a in owner_of) and (owner_of[a] == owner_of.get( b )):
+                owner_flag_counts[ flags[1:] ] += 1
+            elif any( g in clique_groups for g in c.shared_groups ) or any( w in clique_words for w in c.shared_words ):
+                flag_counts[ flags ] += 1
+        flags = flag_counts.most_common( 1 )[0][0] if flag_counts else ('0', '0', '0')
+        owner_flags = owner_flag_counts.most_common( 1 )[0][0] if owner_flag_counts else ('0', '0')
+
+        residual = list()
+        for (key, c) in sorted( canon.iteritems() ):
+            (a, b) = key
+            in_owner = (a in owner_of) and (owner_of[a] == owner_of.get( b ))
+            groups = [ g for g in c.shared_groups if g not in clique_groups ]
+            if len( c.shared_words ) == len( c.shared_word_types ):
+                word_pairs = [ (w, t) for (w, t) in zip( c.shared_words, c.shared_word_types ) if w not in clique_words ]
+                (words, types) = ([ w for (w, t) in word_pairs ], [ t for (w, t) in word_pairs ])
+            else:
+                (words, types) = (c.shared_words, c.shared_word_types)
+            implied = in_owner or (len(groups) < len( c.shared_groups )) or (len(words) < len( c.shared_words ))
+            c_flags = (c.same_user_flag, c.same_location_flag, c.shared_contact_flag)
+            implied_flags = (('1',) + owner_flags) if in_owner else flags
+            if implied and not groups and not words and (c_flags == implied_flags):
+                continue
+            residual.append( ImageEdge( a, b, groups, words, types, *c_flags ))
+
+        groups = dict( (g, sorted( g_members[g] )) for g in clique_groups )
+        words = dict()
+        for w in clique_words:
+            members = sorted( w_types[w] )
+            words[ w ] = (members, [ w_types[w][m] for m in members ])
+        return HyperedgeTable( owners, groups, words, residual, len(canon), flags, owner_flags )
+
+    def report( self, where ):
+        n_members = sum( len(m) for m in self.owners ) + sum( len(m) for m in self.groups.itervalues() ) + \
+                    sum( len(m) for (m, t) in self.words.itervalues() )
+        sys.stderr.write('Info: %s: %d edges as %d owner, %d group, and %d word hyperedges (%d memberships) and %d residual rows\n' % \
+                         (where, self.n_edges, len( self.owners ), len( self.groups ), len( self.words ), n_members, len( self.residual )))
+
+    #
+    # I/O
+    #
+
+    def write_to_file( self, fn ):
+        from cp6.tables.edge_table import EdgeTable
+        with TableIO.open( fn, 'w' ) as f:
+            f.write( 'cp6h %d %d %s\n' % (HyperedgeTable.VERSION, self.n_edges, ' '.join( self.flags + self.owner_flags )))
+            for members in self.owners:
+                f.write( 'O %s\n' % ','.join( map( str, members )))
+            for g in sorted( self.groups ):
+                f.write( 'G %d %s\n' % (g, ','.join( map( str, self.groups[g] ))))
+            for w in sorted( self.words ):
+                (members, types) = self.words[w]
+                f.write( 'W %d %s %s\n' % (w, ','.join( map( str, members )), ','.join( map( str, types ))))
+            for key in sorted( self.residual ):
+                f.write( 'E ' + EdgeTable.format_edge( self.residual[ key ] ))
+        return self.n_edges
+
+    @staticmethod
+    def read_from_file( fn ):
+        from cp6.tables.edge_table import EdgeTable
+        (owners, groups, words, residual) = (list(), dict(), dict(), list())
+        with TableIO.open( fn ) as f:
+            header = f.readline().split()
+            if (len(header) != 8) or (header[0] != 'cp6h'):
+                raise AssertionError( '%s: not a cp6h edge table' % fn )
+            if int( header[1] ) != HyperedgeTable.VERSION:
+                raise AssertionError( '%s: cp6h version %s; expected %d' % (fn, header[1], HyperedgeTable.VERSION ))
+            for (line_no, line) in enumerate( f, 2 ):
+                fields = line.split()
+                tag = fields[0] if fields else ''
+                if (tag == 'O') and (len(fields) == 2):
+                    owners.append( ImageEdge.parse_list( fields[1] ))
+                elif (tag == 'G') and (len(fields) == 3):
+                    groups[ int(fields[1]) ] = ImageEdge.parse_list( fields[2] )
+                elif (tag == 'W') and (len(fields) == 4):
+                    words[ int(fields[1]) ] = (ImageEdge.parse_list( fields[2] ), ImageEdge.parse_list( fields[3] ))
+                elif (tag == 'E') and (len(fields) == 11):
+                    residual.append( EdgeTable.parse_fields( fields[1:] ))
+                else:
+                    raise AssertionError( '%s line %d: expected an O, G, W, or E line' % (fn, line_no ))
+        return HyperedgeTable( owners, groups, words, residual, int( header[2] ), header[3:6], header[6:8] )
+
+class HyperedgeList( object ):
+    # HyperedgeTable.edges: len() and iteration over the expanded edges
+
+    def __init__( self, table ):
+        self.table = table
+
+    def __len__( self ):
+        return len( self.table )
+
+    def __iter__( self ):
+        return self.table.iter_edges()
+
+class HyperImageEdge( object ):
+    #
+    # An edge of a HyperedgeTable. The endpoints and flags are set up
+    # front; the shared lists are worked out from the table on first use.
+    #
+
+    __slots__ = ( 'table', 'image_A_id', 'image_B_id', 'same_user_flag', 'same_location_flag', 'shared_contact_flag', \
+                  '_row', '_groups', '_words', '_word_types' )
+
+    def __init__( self, table, a, b, row ):
+        self.table = table
+        (self.image_A_id, self.image_B_id) = (a, b)
+        self._row = row
+        if row is not None:
+            (self.same_user_flag, self.same_location_flag, self.shared_contact_flag) = \
+                (row.same_user_flag, row.same_location_flag, row.shared_contact_flag)
+        else:
+            (self.same_user_flag, self.same_location_flag, self.shared_contact_flag) = table.implied_flags( a, b )
+        self._groups = None
+
+    def expand( self ):
+        (groups, words, types) = self.table.shared_lists( self.image_A_id, self.image_B_id )
+        row = self._row
+        if row is not None:
+            if row.shared_groups:
+                groups = sorted( groups + list( row.shared_groups ))
+            if row.shared_words:
+                pairs = sorted( zip( words, types ) + zip( row.shared_words, row.shared_word_types ))
+                if len( row.shared_words ) == len( row.shared_word_types ):
+                    (words, types) = ([ w for (w, t) in pairs ], [ t for (w, t) in pairs ])
+                else:
+                    (words, types) = (sorted( words + list( row.shared_words )), types + list( row.shared_word_types ))
+        (self._groups, self._words, self._word_types) = (groups, words, types)
+
+    def _list_property( slot ):
+        def get_list( self ):
+            if self._groups is None:
+                self.expand()
+            return getattr( self, slot )
+        return property( get_list )
+
+    shared_groups = _list_property( '_groups' )
+    shared_words = _list_property( '_words' )
+    shared_word_types = _list_property( '_word_types' )
+    del _list_property
+
+    n_shared_groups = property( lambda self: len( self.shared_groups ))
+    n_shared_words = property( lambda self: len( self.shared_words ))
+
+    def to_image_edge( self ):
+        return ImageEdge( self.image_A_id, self.image_B_id, \
+                          self.shared_groups, self.shared_words, self.shared_word_types, \
+                          self.same_user_flag, self.same_location_flag, self.shared_contact_flag )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='Convert edge tables to and from the clique-compressed .cp6h form' )
+    parser.add_argument( '--min-members', type=int, default=HyperedgeTable.MIN_MEMBERS, help='smallest clique stored as a hyperedge' )
+    parser.add_argument( 'input', help='edge table (.txt, .cp6e, .cp6h, possibly compressed)' )
+    parser.add_argument( 'output', help='output edge table; .cp6h compresses, anything else expands' )
+    args = parser.parse_args()
+    from cp6.tables.edge_table import EdgeTable
+    t_start = time.time()
+    if EdgeTable.is_hyper( args.output ):
+        h = HyperedgeTable.from_edges( EdgeTable.iter_file( args.input ), args.min_members )
+        h.report( args.input )
+        h.write_to_file( args.output )
+    else:
+        (c_total, c_written) = EdgeTable.copy_file( args.input, args.output )
+    sys.stderr.write('Info: wrote %s in %f seconds\n' % (args.output, time.time() - t_start))
@@ -0,0 +1,252 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Per-node index over an image edge table, built once and stored in a
+## sidecar directory next to the table (<table>.idx):
+##
+## nodes        int64   sorted node (image) IDs appearing in the table
+## indptr       int64   CSR row pointers (len(nodes)+1) into nbrs and rows
+## nbrs         int64   neighbor IDs, sorted within each node's slice
+## rows         int64   edge table row of each (node, neighbor) entry
+## offsets      int64   byte offset of each row in a text table (n_edges+1)
+## index.txt            format version and the table's size and mtime
+##
+## Each edge appears twice in the adjacency, once from each end. The index
+## is rebuilt when the table changes (see Sidecar.) Edges are read back by
+## seeking to their byte offsets, or for a column directory, archive,
+## clique-compressed, or compressed table (see edge_columns.py,
+## edge_archive.py, edge_hypergraph.py, table_io.py) from the table's
+## columns.
+##
+
+import os
+import sys
+import time
+from array import array
+
+import numpy as np
+
+from cp6.tables.edge_table import EdgeTable
+from cp6.utilities.sidecar import Sidecar
+from cp6.utilities.table_io import TableIO
+
+class EdgeIndex:
+
+    VERSION = 1
+    STAMP = 'index.txt'
+    ARRAYS = ( 'nodes', 'indptr', 'nbrs', 'rows', 'offsets' )
+
+    def __init__( self, fn, arrays ):
+        self.fn = fn
+        self.nodes = arrays['nodes']
+        self.indptr = arrays['indptr']
+        self.nbrs = arrays['nbrs']
+        self.rows = arrays['rows']
+        self.offsets = arrays['offsets']
+        self.columns = None
+
+    def __len__( self ):
+        # number of edges
+        return len( self.rows ) / 2
+
+    @staticmethod
+    def index_dir( fn ):
+        return fn.rstrip( os.sep ) + '.idx'
+
+    @staticmethod
+    def is_text( fn ):
+        # True if fn is an uncompressed text table, which can be read by seeking
+        return not (os.path.isdir( fn ) or (EdgeTable.format_of( fn ) != '.txt') or TableIO.compression( fn ))
+
+    @staticmethod
+    def read_columns( fn ):
+        if EdgeTable.is_archive( fn ):
+            from cp6.tables.edge_archive import EdgeArchive
+            return EdgeArchive.read_columns( fn )
+        from cp6.tables.edge_columns import EdgeColumns
+        if EdgeTable.is_hyper( fn ):
+            return EdgeColumns.from_edges( EdgeTable.iter_file( fn ))
+        if os.path.isdir( fn ):
+            return EdgeColumns.read_from_dir( fn )
+        return EdgeColumns.read_from_text_file( fn )
+
+    @staticmethod
+    def scan_endpoints( fn ):
+        # (a, b, offsets) for the edge table fn; offsets is empty unless fn is a text table
+        if not EdgeIndex.is_text( fn ):
+            c = EdgeIndex.read_columns( fn )
+            return (np.asarray( c.cols['a'], dtype=np.int64 ), np.asarray( c.cols['b'], dtype=np.int64 ), \
+                    np.zeros( 0, dtype=np.int64 ))
+        (a, b, offsets) = (array('l'), array('l'), array('l'))
+        pos = 0
+        with open( fn, 'rb' ) as f:
+            for line in f:
+                fields = line.split( None, 2 )
+                if len(fields) < 3:
+                    raise AssertionError( '%s line %d: expected 10 fields' % (fn, len(a)+1 ))
+                offsets.append( pos )
+                a.append( int(fields[0]) )
+                b.append( int(fields[1]) )
+                pos += len( line )
+        offsets.append( pos )
+        return (np.frombuffer( a, dtype=np.int_ ).astype( np.int64 ), \
+                np.frombuffer( b, dtype=np.int_ ).astype( np.int64 ), \
+                np.frombuffer( offsets, dtype=np.int_ ).astype( np.int64 ))
+
+    @staticmethod
+    def build( fn ):
+        t_start = time.time()
+        (a, b, offsets) = EdgeIndex.scan_endpoints( fn )
+        n_edges = len(a)
+        src = np.concatenate( (a, b) )
+        dst = np.concatenate( (b, a) )
+        rows = np.concatenate( (np.arange( n_edges, dtype=np.int64 ),) * 2 )
+        order = np.lexsort( (dst, src) )
+        (src, dst, rows) = (src[order], dst[order], rows[order])
+        nodes = np.unique( src )
+        indptr = np.zeros( len(nodes)+1, dtype=np.int64 )
+        indptr[1:] = np.cumsum( np.bincount( np.searchsorted( nodes, src ), minlength=len(nodes) ))
+        arrays = { 'nodes': nodes, 'indptr': indptr, 'nbrs': dst, 'rows': rows, 'offsets': offsets }
+
+        Sidecar.write_arrays( EdgeIndex.index_dir( fn ), arrays, EdgeIndex.STAMP, fn, EdgeIndex.VERSION )
+        sys.stderr.write('Info: indexed %d edges on %d nodes from %s in %f seconds\n' % \
+                         (n_edges, len(nodes), fn, time.time() - t_start))
+        return EdgeIndex( fn, arrays )
+
+    @staticmethod
+    def is_fresh( fn ):
+        return Sidecar.is_fresh( os.path.join( EdgeIndex.index_dir( fn ), EdgeIndex.STAMP ), fn, EdgeIndex.VERSION )
+
+    @staticmethod
+    def load( fn, rebuild=True ):
+        # the index for fn, (re)built first if missing or stale (unless rebuild is False)
+        if not EdgeIndex.is_fresh( fn ):
+            if not rebuild:
+                raise AssertionError( '%s: edge index is missing or out of date' % fn )
+            return EdgeIndex.build( fn )
+        idx_dir = EdgeIndex.index_dir( fn )
+        arrays = dict()
+        for name in EdgeIndex.ARRAYS:
+            arrays[ name ] = np.load( os.path.join( idx_dir, '%s.npy' % name ), mmap_mode='r' )
+        return EdgeIndex( fn, arrays )
+
+    #
+    # queries
+    #
+
+    def node_slice( self, node_id ):
+        i = np.searchsorted( self.nodes, node_id )
+        if (i == len(self.nodes)) or (self.nodes[i] != node_id):
+            return (0, 0)
+        return (int(self.indptr[i]), int(self.indptr[i+1]))
+
+    def degree( self, node_id ):
+        (s, e) = self.node_slice( node_id )
+        return e - s
+
+    def neighbors( self, node_id ):
+        # sorted list of node IDs sharing an edge with node_id
+        (s, e) = self.node_slice( node_id )
+        return self.nbrs[ s:e ].tolist()
+
+    def edge_rows( self, a, b ):
+        # edge table rows of the edges between a and b (either direction)
+        (s, e) = self.node_slice( a )
+        nbrs = self.nbrs[ s:e ]
+        (lo, hi) = (np.searchsorted( nbrs, b, 'left' ), np.searchsorted( nbrs, b, 'right' ))
+        return sorted( self.rows[ s+lo:s+hi ].tolist() )
+
+    def has_edge( self, a, b ):
+        return len( self.edge_rows( a, b )) > 0
+
+    def induced_rows( self, ids ):
+        # sorted edge table rows of the edges with both endpoints in ids
+        ids = np.unique( np.asarray( list( ids ), dtype=np.int64 ))
+        present = ids[ np.in1d( ids, self.nodes ) ]
+        if len(present) == 0:
+            return np.zeros( 0, dtype=np.int64 )
+        k = np.searchsorted( self.nodes, present )
+        (starts, ends) = (self.indptr[ k ], self.indptr[ k+1 ])
+        lengths = ends - starts
+        # gather the adjacency slices of all the nodes in ids at once
+        pos = np.repeat( starts - np.cumsum( lengths ) + lengths, lengths ) + np.arange( lengths.sum() )
+        keep = np.in1d( self.nbrs[ pos ], present )
+        return np.unique( self.rows[ pos[ keep ] ] )
+
+    def read_rows( self, rows, columns=None ):
+        # the edges at the given table rows; see EdgeTable.read_from_file for columns
+        columns = EdgeTable.check_columns( columns )
+        if not EdgeIndex.is_text( self.fn ):
+            if self.columns is None:
+                self.columns = EdgeIndex.read_columns( self.fn )
+            return [ self.columns.edge_at( int(r) ) for r in rows ]
+        edges = list()
+        with open( self.fn, 'rb' ) as f:
+            for r in rows:
+                f.seek( int( self.offsets[ r ] ))
+                fields = f.readline().split()
+                if len(fields) != 10:
+                    raise AssertionError( '%s row %d: expected 10 fields, got %d; stale index?' % \
+                                          (self.fn, r, len(fields) ))
+                edges.append( EdgeTable.parse_fields( fields, columns ))
+        return edges
+
+    def edges_of( self, node_id, columns=None ):
+        (s, e) = self.node_slice( node_id )
+        return self.read_rows( sorted( self.rows[ s:e ].tolist() ), columns )
+
+    def induced_subgraph( self, ids, columns=None ):
+        # the edges with both endpoints in ids, in table order
+        return self.read_rows( self.induced_rows( ids ), columns )
+
+if __name__ == '__main__':
+    usage = 'Usage: $0 edge-table build\n' \
+            '       $0 edge-table neighbors node-id\n' \
+            '       $0 edge-table has-edge node-id node-id\n' \
+            '       $0 edge-table subgraph node-id-file\n'
+    if len(sys.argv) < 3:
+        sys.stderr.write( usage )
+        sys.exit(0)
+    (fn, cmd, args) = (sys.argv[1], sys.argv[2], sys.argv[3:])
+    if (cmd == 'build') and (len(args) == 0):
+        EdgeIndex.build( fn )
+    elif (cmd == 'neighbors') and (len(args) == 1):
+        sys.stdout.write( '%s\n' % ' '.join( map( str, EdgeIndex.load( fn ).neighbors( int(args[0]) ))))
+    elif (cmd == 'has-edge') and (len(args) == 2):
+        sys.stdout.write( '%d\n' % EdgeIndex.load( fn ).has_edge( int(args[0]), int(args[1]) ))
+    elif (cmd == 'subgraph') and (len(args) == 1):
+        with open( args[0] ) as f:
+            ids = [ int(line.split()[0]) for line in f if line.strip() ]
+        for e in EdgeIndex.load( fn ).induced_subgraph( ids, columns=() ):
+            sys.stdout.write( EdgeTable.format_edge( e ))
+    else:
+        sys.stderr.write( usage )
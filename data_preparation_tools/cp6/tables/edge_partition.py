@@ -0,0 +1,276 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Connected components and balanced k-way partitioning of the image
+## graph, so a sandbox can be split into independent pieces (e.g. the
+## separate training databases the CRF baseline needs) cutting as few
+## edges as possible.
+##
+## The graph comes from an edge table's EdgeIndex (edge_index.py), so
+## the adjacency is built once and cached next to the table. Nodes are
+## the table's images plus, optionally, any other image IDs (images
+## without edges are singleton components.)
+##
+## Partitioning:
+##
+## 1) Union-find labels the connected components.
+## 2) Components are packed whole, largest first, into the lightest
+##    partition; a component bigger than the room left is split by
+##    growing breadth-first regions through it, one partition at a time.
+## 3) Boundary refinement: each pass computes, for every node, its edge
+##    count into each partition and moves nodes with a positive gain to
+##    their best partition, within the balance limit and best gain first.
+##    Passes alternate between moving toward higher- and lower-numbered
+##    partitions, so neighbors don't swap past each other; the best cut
+##    seen is kept.
+##
+## Partition sizes are at most ceil( (1 + imbalance) * n / k ).
+##
+
+import sys
+import time
+import math
+from collections import deque
+
+import numpy as np
+
+from cp6.tables.edge_index import EdgeIndex
+
+class UnionFind:
+    # over the integers 0..n-1; union by size, with path halving
+    def __init__( self, n ):
+        self.parent = range( n )
+        self.size = [1] * n
+
+    def find( self, x ):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[ parent[x] ]
+            x = parent[x]
+        return x
+
+    def union( self, x, y ):
+        (x, y) = (self.find( x ), self.find( y ))
+        if x == y:
+            return x
+        if self.size[x] < self.size[y]:
+            (x, y) = (y, x)
+        self.parent[y] = x
+        self.size[x] += self.size[y]
+        return x
+
+    def labels( self ):
+        # component label per element: 0 is the largest component, then by size, ties by first element
+        roots = np.array( [ self.find( x ) for x in range( len(self.parent) ) ], dtype=np.int64 )
+        (uniq, first, inverse, counts) = np.unique( roots, return_index=True, return_inverse=True, return_counts=True )
+        order = np.lexsort( (first, -counts) )
+        rank = np.empty( len(uniq), dtype=np.int64 )
+        rank[ order ] = np.arange( len(uniq) )
+        return rank[ inverse ]
+
+class EdgeGraph:
+
+    #
+    # ids: sorted node (image) IDs; node i is ids[i]. src, dst: both
+    # directions of every edge, as node indices, grouped by src
+    # (indptr gives each node's slice.)
+    #
+
+    def __init__( self, ids, src, dst ):
+        self.ids = ids
+        self.src = src
+        self.dst = dst
+        self.indptr = np.zeros( len(ids)+1, dtype=np.int64 )
+        np.cumsum( np.bincount( src, minlength=len(ids) ), out=self.indptr[1:] )
+
+    def __len__( self ):
+        return len( self.ids )
+
+    def n_edges( self ):
+        return len( self.src ) // 2
+
+    @staticmethod
+    def from_index( index, ids = None ):
+        #
+        # graph over an EdgeIndex; if ids is given, the nodes are exactly
+        # those IDs (edges with an endpoint outside them are dropped)
+        #
+        if ids is None:
+            node_ids = np.asarray( index.nodes, dtype=np.int64 )
+        else:
+            node_ids = np.unique( np.asarray( list( ids ), dtype=np.int64 ))
+        src_ids = np.repeat( np.asarray( index.nodes, dtype=np.int64 ), np.diff( index.indptr ))
+        dst_ids = np.asarray( index.nbrs, dtype=np.int64 )
+        keep = np.in1d( src_ids, node_ids ) & np.in1d( dst_ids, node_ids )
+        return EdgeGraph( node_ids, np.searchsorted( node_ids, src_ids[ keep ] ), \
+                          np.searchsorted( node_ids, dst_ids[ keep ] ))
+
+    @staticmethod
+    def from_edge_table( fn, ids = None ):
+        return EdgeGraph.from_index( EdgeIndex.load( fn ), ids )
+
+    def components( self ):
+        # component label per node, 0 being the largest (see UnionFind.labels)
+        uf = UnionFind( len(self) )
+        one_way = self.src < self.dst
+        for (x, y) in zip( self.src[ one_way ].tolist(), self.dst[ one_way ].tolist() ):
+            uf.union( x, y )
+        return uf.labels()
+
+    def cut_size( self, part ):
+        # number of edges whose endpoints are in different partitions
+        return int( np.count_nonzero( part[ self.src ] != part[ self.dst ] )) // 2
+
+    def bfs_order( self, nodes ):
+        # the given nodes (one component) in breadth-first order from a pseudo-peripheral node
+        start = nodes[0]
+        for i in range( 2 ):
+            order = self.bfs( start )
+            start = order[-1]
+        return self.bfs( start )
+
+    def bfs( self, start ):
+        (indptr, dst) = (self.indptr, self.dst)
+        seen = set( [start] )
+        (order, q) = ([start], deque( [start] ))
+        while q:
+            x = q.popleft()
+            for y in dst[ indptr[x]:indptr[x+1] ].tolist():
+                if y not in seen:
+                    seen.add( y )
+                    order.append( y )
+                    q.append( y )
+        return order
+
+class GraphPartitioner:
+
+    IMBALANCE = 0.03
+    PASSES = 20
+
+    @staticmethod
+    def capacity( n, k, imbalance ):
+        return max( 1, int( math.ceil( (1.0 + imbalance) * n / k )))
+
+    @staticmethod
+    def initial( graph, k, cap, labels ):
+        # pack components into partitions, splitting those which don't fit
+        part = np.full( len(graph), -1, dtype=np.int64 )
+        sizes = [0] * k
+        order = np.argsort( labels, kind='mergesort' )
+        bounds = np.flatnonzero( np.r_[ True, labels[ order ][1:] != labels[ order ][:-1], True ] )
+        for (lo, hi) in zip( bounds[:-1], bounds[1:] ):
+            nodes = order[ lo:hi ]
+            p = min( range( k ), key=lambda i: sizes[i] )
+            if sizes[p] + len(nodes) <= cap:
+                part[ nodes ] = p
+                sizes[p] += len(nodes)
+                continue
+            # too big: grow regions through it breadth-first, filling the lightest partition each time
+            pending = graph.bfs_order( nodes.tolist() ) if len(nodes) > 1 else nodes.tolist()
+            while pending:
+                p = min( range( k ), key=lambda i: sizes[i] )
+                room = max( 1, cap - sizes[p] )
+                part[ pending[:room] ] = p
+                sizes[p] += len( pending[:room] )
+                pending = pending[ room: ]
+        return part
+
+    @staticmethod
+    def refine( graph, part, k, cap, passes ):
+        n = len(graph)
+        if graph.n_edges() == 0:
+            return part
+        (best_part, best_cut) = (part.copy(), graph.cut_size( part ))
+        idx = np.arange( n )
+        stale = 0
+        for p in range( passes ):
+            conn = np.bincount( graph.src * k + part[ graph.dst ], minlength=n*k ).reshape( n, k )
+            own = conn[ idx, part ]
+            target = np.argmax( conn, axis=1 )
+            gain = conn[ idx, target ] - own
+            direction = (target > part) if (p % 2 == 0) else (target < part)
+            movers = np.flatnonzero( (gain > 0) & direction )
+            movers = movers[ np.argsort( -gain[ movers ], kind='mergesort' ) ]
+            sizes = np.bincount( part, minlength=k ).tolist()
+            for (x, t) in zip( movers.tolist(), target[ movers ].tolist() ):
+                if sizes[t] < cap:
+                    sizes[ part[x] ] -= 1
+                    sizes[t] += 1
+                    part[x] = t
+            cut = graph.cut_size( part )
+            if cut < best_cut:
+                (best_part, best_cut, stale) = (part.copy(), cut, 0)
+            else:
+                stale += 1
+                if stale >= 2:
+                    break
+        return best_part
+
+    @staticmethod
+    def partition( graph, k, imbalance = None, passes = None ):
+        #
+        # returns a partition number (0..k-1) per node of graph
+        #
+        if k < 1:
+            raise AssertionError( 'Partition count must be at least 1, got %d' % k )
+        t_start = time.time()
+        imbalance = GraphPartitioner.IMBALANCE if imbalance is None else imbalance
+        passes = GraphPartitioner.PASSES if passes is None else passes
+        cap = GraphPartitioner.capacity( len(graph), k, imbalance )
+        labels = graph.components()
+        part = GraphPartitioner.initial( graph, k, cap, labels )
+        initial_cut = graph.cut_size( part )
+        part = GraphPartitioner.refine( graph, part, k, cap, passes )
+        sizes = np.bincount( part, minlength=k )
+        sys.stderr.write('Info: %d nodes, %d edges, %d components (largest %d); %d-way partition sizes %s; '
+                         'cut %d edges (%.2f%%, %d before refinement) in %f seconds\n' % \
+                         (len(graph), graph.n_edges(), labels.max()+1 if len(labels) else 0, \
+                          np.count_nonzero( labels == 0 ), k, ','.join( map( str, sizes.tolist() )), \
+                          graph.cut_size( part ), 100.0 * graph.cut_size( part ) / max( 1, graph.n_edges() ), \
+                          initial_cut, time.time() - t_start))
+        return part
+
+    @staticmethod
+    def partition_ids( graph, k, imbalance = None, passes = None ):
+        # as partition, but returns k lists of image IDs
+        part = GraphPartitioner.partition( graph, k, imbalance, passes )
+        return [ graph.ids[ part == i ].tolist() for i in range( k ) ]
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        sys.stderr.write('Usage: $0 edge-table k [imbalance]\n')
+        sys.stderr.write('  Writes "image-id partition" lines to stdout; k=1 just reports components.\n')
+        sys.exit(1)
+    g = EdgeGraph.from_edge_table( sys.argv[1] )
+    part = GraphPartitioner.partition( g, int( sys.argv[2] ), float( sys.argv[3] ) if len(sys.argv) == 4 else None )
+    for (node_id, p) in zip( g.ids.tolist(), part.tolist() ):
+        sys.stdout.write( '%d %d\n' % (node_id, p) )
@@ -0,0 +1,247 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Sort, canonicalize, and de-duplicate edge tables in bounded memory.
+##
+## Each edge is put in canonical form: A < B (swapping the endpoints also
+## swaps the two nibbles of each word type, which are A's and B's word
+## source flags; see ImageEdge.from_data), groups sorted, words sorted with
+## their types following, and flags canonical. Edges are buffered RUN_EDGES
+## at a time, sorted, and spilled to temporary run files, which are then
+## k-way merged (in several passes if there are more than FAN_IN runs.)
+##
+## As in CP6McAuleyEdgeFeatures, the first edge seen for a pair is kept;
+## later ones are skipped and counted as duplicates if identical, or as
+## conflicts if not (these can be written out for inspection.) The result
+## is sorted by (A, B), so sorted tables can be merge-joined.
+##
+## Self-loops (A == B) have no canonical form and no meaning in the image
+## graph; they're dropped and counted, so every output row has A < B,
+## which is what is_sorted checks.
+##
+
+import os
+import sys
+import time
+import heapq
+import shutil
+import argparse
+import tempfile
+import itertools
+
+from cp6.tables.edge_table import EdgeTable, EdgeTableWriter
+from cp6.utilities.image_edge import ImageEdge
+from cp6.utilities.table_io import TableIO
+
+class EdgeSortStats:
+    def __init__( self ):
+        (self.c_in, self.c_out, self.c_swapped, self.c_dupes, self.c_conflicts, self.c_runs) = (0, 0, 0, 0, 0, 0)
+        self.c_self_loops = 0
+
+    def report( self, where ):
+        sys.stderr.write('Info: %s: sorted %d edges into %d (%d swapped to A<B; skipped %d duplicates, %d conflicts, %d self-loops; %d runs)\n' % \
+                         (where, self.c_in, self.c_out, self.c_swapped, self.c_dupes, self.c_conflicts, self.c_self_loops, self.c_runs))
+
+class EdgeSorter:
+
+    RUN_EDGES = 500000
+    FAN_IN = 64
+
+    @staticmethod
+    def swap_word_type( t ):
+        return ((t & 0x0f) << 4) | ((t >> 4) & 0x0f) | (t & ~0xff)
+
+    @staticmethod
+    def canonical_edge( e ):
+        # (canonical ImageEdge, swapped?) for e
+        (a, b) = (e.image_A_id, e.image_B_id)
+        (words, types) = (e.shared_words, e.shared_word_types)
+        swapped = a > b
+        if swapped:
+            (a, b) = (b, a)
+            types = [ EdgeSorter.swap_word_type( t ) for t in types ]
+        if len(words) == len(types):
+            pairs = sorted( zip( words, types ))
+            (words, types) = ([ w for (w, t) in pairs ], [ t for (w, t) in pairs ])
+        else:
+            words = sorted( words )
+        return (ImageEdge( a, b, sorted( e.shared_groups ), words, types, \
+                           ImageEdge.canonical_flag( e.same_user_flag ), \
+                           ImageEdge.canonical_flag( e.same_location_flag ), \
+                           ImageEdge.canonical_flag( e.shared_contact_flag )), swapped)
+
+    @staticmethod
+    def write_run( keyed_lines, tmp_dir, stats ):
+        # sort (a, b, line) tuples stably on (a, b) and write them as a run file
+        keyed_lines.sort( key=lambda x: (x[0], x[1]) )
+        stats.c_runs += 1
+        fn = os.path.join( tmp_dir, 'run_%06d.txt' % stats.c_runs )
+        with open( fn, 'w' ) as f:
+            for (a, b, line) in keyed_lines:
+                f.write( line )
+        return fn
+
+    @staticmethod
+    def iter_run( fn, run_index ):
+        # (a, b, run_index, position, line) for each line of a run; the
+        # index and position keep the merge stable
+        with open( fn ) as f:
+            for (pos, line) in enumerate( f ):
+                fields = line.split( None, 2 )
+                yield (int(fields[0]), int(fields[1]), run_index, pos, line)
+
+    @staticmethod
+    def merge_runs( run_fns ):
+        # merged (a, b, line) from the runs, stable on input order
+        return ( (a, b, line) for (a, b, i, pos, line) in \
+                 heapq.merge( *[ EdgeSorter.iter_run( fn, i ) for (i, fn) in enumerate( run_fns ) ] ))
+
+    @staticmethod
+    def sorted_runs( edges, tmp_dir, stats, run_edges = None ):
+        # canonicalize edges, dropping self-loops, and spill them into sorted runs; returns the run file names
+        run_edges = run_edges or EdgeSorter.RUN_EDGES
+        (runs, buf) = (list(), list())
+        for e in edges:
+            stats.c_in += 1
+            if e.image_A_id == e.image_B_id:
+                stats.c_self_loops += 1
+                continue
+            (c, swapped) = EdgeSorter.canonical_edge( e )
+            stats.c_swapped += swapped
+            buf.append( (c.image_A_id, c.image_B_id, EdgeTable.format_edge( c )) )
+            if len(buf) >= run_edges:
+                runs.append( EdgeSorter.write_run( buf, tmp_dir, stats ))
+                buf = list()
+        if buf or not runs:
+            runs.append( EdgeSorter.write_run( buf, tmp_dir, stats ))
+        # reduce to at most FAN_IN runs; merging consecutive runs keeps the order stable
+        while len(runs) > EdgeSorter.FAN_IN:
+            merged = list()
+            for i in range( 0, len(runs), EdgeSorter.FAN_IN ):
+                group = runs[ i:i+EdgeSorter.FAN_IN ]
+                stats.c_runs += 1
+                fn = os.path.join( tmp_dir, 'run_%06d.txt' % stats.c_runs )
+                with open( fn, 'w' ) as f:
+                    for (a, b, line) in EdgeSorter.merge_runs( group ):
+                        f.write( line )
+                for old in group:
+                    os.remove( old )
+                merged.append( fn )
+            runs = merged
+        return runs
+
+    @staticmethod
+    def iter_sorted_lines( edges, stats, run_edges = None, tmp_dir = None, conflicts = None ):
+        #
+        # Canonical, sorted, de-duplicated table lines for edges (any
+        # iterable of ImageEdge-like objects.) conflicts, if given, is an
+        # open file which gets each conflicting line after the kept one.
+        #
+        work_dir = tempfile.mkdtemp( prefix='cp6_edge_sort_', dir=tmp_dir )
+        try:
+            runs = EdgeSorter.sorted_runs( edges, work_dir, stats, run_edges )
+            (last_key, last_line) = (None, None)
+            for (a, b, line) in EdgeSorter.merge_runs( runs ):
+                if (a, b) == last_key:
+                    if line == last_line:
+                        stats.c_dupes += 1
+                    else:
+                        stats.c_conflicts += 1
+                        if conflicts is not None:
+                            conflicts.write( 'kept     %s' % last_line )
+                            conflicts.write( 'conflict %s' % line )
+                    continue
+                (last_key, last_line) = ((a, b), line)
+                stats.c_out += 1
+                yield line
+        finally:
+            shutil.rmtree( work_dir )
+
+    @staticmethod
+    def iter_sorted( edges, stats = None, run_edges = None, tmp_dir = None, columns = None ):
+        # as iter_sorted_lines, but yielding edges (see EdgeTable.read_from_file for columns)
+        stats = stats or EdgeSortStats()
+        columns = EdgeTable.check_columns( columns )
+        for line in EdgeSorter.iter_sorted_lines( edges, stats, run_edges, tmp_dir ):
+            yield EdgeTable.parse_fields( line.split(), columns )
+
+    @staticmethod
+    def sort_files( in_fns, out_fn, run_edges = None, tmp_dir = None, conflicts_fn = None ):
+        # sort and merge the edge tables in_fns (any format) into out_fn; returns the stats
+        t_start = time.time()
+        stats = EdgeSortStats()
+        edges = itertools.chain( *[ EdgeTable.iter_file( fn ) for fn in in_fns ] )
+        conflicts = open( conflicts_fn, 'w' ) if conflicts_fn else None
+        try:
+            lines = EdgeSorter.iter_sorted_lines( edges, stats, run_edges, tmp_dir, conflicts )
+            if EdgeTable.format_of( out_fn ) == '.txt':
+                with TableIO.open( out_fn, 'w' ) as f:
+                    for line in lines:
+                        f.write( line )
+            else:
+                with EdgeTableWriter( out_fn ) as w:
+                    for line in lines:
+                        w.write( EdgeTable.parse_fields( line.split() ))
+        finally:
+            if conflicts is not None:
+                conflicts.close()
+        stats.report( out_fn )
+        sys.stderr.write('Info: sorted in %f seconds\n' % (time.time() - t_start))
+        return stats
+
+    @staticmethod
+    def is_sorted( fn ):
+        # True if fn is in canonical (A < B), strictly increasing (A, B) order
+        last = None
+        for e in EdgeTable.iter_file( fn, columns=() ):
+            key = (e.image_A_id, e.image_B_id)
+            if (key[0] >= key[1]) or ((last is not None) and (key <= last)):
+                return False
+            last = key
+        return True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='Sort, canonicalize, and de-duplicate CP6 edge tables' )
+    parser.add_argument( '--output', '-o', help='sorted output edge table' )
+    parser.add_argument( '--run-edges', type=int, default=EdgeSorter.RUN_EDGES, help='edges per in-memory sort run' )
+    parser.add_argument( '--tmp-dir', help='directory for run files (default: system temp)' )
+    parser.add_argument( '--conflicts', help='write conflicting duplicates to this file' )
+    parser.add_argument( '--check', action='store_true', help='just report whether each input is sorted' )
+    parser.add_argument( 'inputs', nargs='+', help='input edge tables' )
+    args = parser.parse_args()
+    if args.check:
+        for fn in args.inputs:
+            sys.stdout.write( '%s %s\n' % (fn, 'sorted' if EdgeSorter.is_sorted( fn ) else 'unsorted' ))
+        sys.exit( 0 )
+    if not args.output:
+        parser.error( '--output is required unless --check' )
+    EdgeSorter.sort_files( args.inputs, args.output, args.run_edges, args.tmp_dir, args.conflicts )
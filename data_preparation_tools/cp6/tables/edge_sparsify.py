@@ -0,0 +1,178 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Degree-capped top-k edge sparsification.
+##
+## Hub images (popular groups, common words) can have tens of thousands
+## of edges. This keeps, for each node, only its k best-scoring edges,
+## where an edge's score is a weighted sum of its shared group count,
+## shared word count, and flags (see EdgeSparsifier.WEIGHTS.)
+##
+## With mode 'either' an edge survives if it is in the top k of either
+## endpoint, so every node keeps its best k edges (degrees can still
+## exceed k); with mode 'both' it must be in the top k of both
+## endpoints, which caps every degree at k.
+##
+## The ranking is vectorized: each edge appears once per endpoint in an
+## incidence list, which is lexsorted on (node, -score, edge) so each
+## node's edges form a contiguous, best-first run (the CSR layout of
+## edge_index.py); an incidence's rank is then its offset in the run.
+## Ties go to the earlier edge in the table.
+##
+
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from cp6.tables.edge_table import EdgeTable
+from cp6.tables.edge_columns import EdgeColumns, EdgeColumnList
+from cp6.utilities.image_edge import ImageEdge
+
+class EdgeSparsifier:
+
+    # default score weights; flags count when '1'
+    WEIGHTS = { 'groups': 1.0, 'words': 1.0, 'user': 0.0, 'location': 0.0, 'contact': 0.0 }
+    MODES = ( 'either', 'both' )
+
+    @staticmethod
+    def parse_weights( s ):
+        # 'groups=2,words=1,user=5' -> WEIGHTS with those entries replaced
+        weights = dict( EdgeSparsifier.WEIGHTS )
+        for item in [ x for x in s.split(',') if x ]:
+            (name, sep, value) = item.partition( '=' )
+            if (name not in weights) or not sep:
+                raise AssertionError( 'Bad score weight "%s"; expected name=value with name in %s' % \
+                                      (item, ','.join( sorted( weights.keys() ))))
+            weights[ name ] = float( value )
+        return weights
+
+    @staticmethod
+    def scores( columns, weights = None ):
+        # the score of each edge in an EdgeColumns
+        w = weights or EdgeSparsifier.WEIGHTS
+        c = columns.cols
+        s = w['groups'] * c['n_groups'].astype( np.float64 ) + w['words'] * c['n_words']
+        for (name, col) in (('user', 'same_user'), ('location', 'same_location'), ('contact', 'shared_contact')):
+            if w[ name ]:
+                s += w[ name ] * (c[ col ] == EdgeColumns.FLAG_CODES['1'])
+        return s
+
+    @staticmethod
+    def incidence_ranks( a, b, score ):
+        # (edge, rank) per incidence: rank 0 is the endpoint's best edge
+        n = len(a)
+        node = np.concatenate( (a, b) )
+        edge = np.concatenate( (np.arange( n ), np.arange( n )) )
+        order = np.lexsort( (edge, -np.concatenate( (score, score) ), node) )
+        (node, edge) = (node[ order ], edge[ order ])
+        starts = np.flatnonzero( np.r_[ True, node[1:] != node[:-1] ] )
+        counts = np.diff( np.r_[ starts, len(node) ] )
+        rank = np.arange( len(node) ) - np.repeat( starts, counts )
+        return (edge, rank)
+
+    @staticmethod
+    def keep_mask( a, b, score, k, mode = 'either' ):
+        # boolean mask over the edges (a[i], b[i]) with score[i]
+        if mode not in EdgeSparsifier.MODES:
+            raise AssertionError( 'Unknown sparsification mode "%s"; expected one of %s' % (mode, ','.join( EdgeSparsifier.MODES )))
+        if len(a) == 0:
+            return np.zeros( 0, dtype=bool )
+        (edge, rank) = EdgeSparsifier.incidence_ranks( np.asarray( a ), np.asarray( b ), np.asarray( score ))
+        votes = np.bincount( edge[ rank < k ], minlength=len(a) )
+        return votes >= (1 if mode == 'either' else 2)
+
+    @staticmethod
+    def max_degree( a, b ):
+        if len(a) == 0:
+            return 0
+        return int( np.unique( np.concatenate( (a, b) ), return_counts=True )[1].max() )
+
+    @staticmethod
+    def sparsify_columns( columns, k, weights = None, mode = 'either' ):
+        # the EdgeColumns restricted to the top-k edges, reporting the reduction
+        c = columns.cols
+        keep = EdgeSparsifier.keep_mask( c['a'], c['b'], EdgeSparsifier.scores( columns, weights ), k, mode )
+        kept = columns.select( keep )
+        sys.stderr.write('Info: top-%d (%s) sparsification kept %d of %d edges (%.1f%%); max degree %d -> %d\n' % \
+                         (k, mode, len(kept), len(columns), 100.0 * len(kept) / max( 1, len(columns) ), \
+                          EdgeSparsifier.max_degree( c['a'], c['b'] ), \
+                          EdgeSparsifier.max_degree( kept.cols['a'], kept.cols['b'] )))
+        return kept
+
+    @staticmethod
+    def edge_score( e, weights = None ):
+        # the score of one ImageEdge-like object; only reads the counts and flags
+        w = weights or EdgeSparsifier.WEIGHTS
+        s = w['groups'] * e.n_shared_groups + w['words'] * e.n_shared_words
+        for (name, flag) in (('user', e.same_user_flag), ('location', e.same_location_flag), ('contact', e.shared_contact_flag)):
+            if w[ name ] and (ImageEdge.canonical_flag( flag ) == '1'):
+                s += w[ name ]
+        return s
+
+    @staticmethod
+    def sparsify_edges( edges, k, weights = None, mode = 'either' ):
+        # as sparsify_columns, for a list of ImageEdge-like objects; returns the kept sublist
+        a = np.array( [ e.image_A_id for e in edges ], dtype=np.int64 )
+        b = np.array( [ e.image_B_id for e in edges ], dtype=np.int64 )
+        score = np.array( [ EdgeSparsifier.edge_score( e, weights ) for e in edges ], dtype=np.float64 )
+        keep = EdgeSparsifier.keep_mask( a, b, score, k, mode )
+        kept = [ e for (e, flag) in zip( edges, keep ) if flag ]
+        sys.stderr.write('Info: top-%d (%s) sparsification kept %d of %d edges (%.1f%%); max degree %d -> %d\n' % \
+                         (k, mode, len(kept), len(edges), 100.0 * len(kept) / max( 1, len(edges) ), \
+                          EdgeSparsifier.max_degree( a, b ), EdgeSparsifier.max_degree( a[ keep ], b[ keep ] )))
+        return kept
+
+    @staticmethod
+    def sparsify_file( in_fn, out_fn, k, weights = None, mode = 'either', n_workers = 1 ):
+        t_start = time.time()
+        t = EdgeTable.read_from_file( in_fn, None, True, n_workers )
+        kept = EdgeSparsifier.sparsify_columns( t.edges.flush(), k, weights, mode )
+        EdgeTable( EdgeColumnList( kept )).write_to_file( out_fn )
+        sys.stderr.write('Info: wrote %d edges to %s in %f seconds\n' % (len(kept), out_fn, time.time() - t_start))
+        return kept
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='Keep the top-k edges per node of a CP6 edge table' )
+    parser.add_argument( '-k', type=int, required=True, help='edges to keep per node' )
+    parser.add_argument( '--score', default='', \
+                         help='score weights, e.g. groups=1,words=1,user=5 (default %s)' % \
+                         ','.join( '%s=%g' % x for x in sorted( EdgeSparsifier.WEIGHTS.items() )))
+    parser.add_argument( '--mode', choices=EdgeSparsifier.MODES, default='either', \
+                         help='keep edges in the top k of either endpoint, or of both (hard degree cap)' )
+    parser.add_argument( '--workers', type=int, default=1, help='parallel parse workers' )
+    parser.add_argument( 'input', help='input edge table' )
+    parser.add_argument( 'output', help='output edge table' )
+    args = parser.parse_args()
+    EdgeSparsifier.sparsify_file( args.input, args.output, args.k, EdgeSparsifier.parse_weights( args.score ), \
+                                  args.mode, args.workers )
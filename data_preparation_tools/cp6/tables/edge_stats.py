@@ -0,0 +1,218 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Edge table statistics; the histograms formerly computed by
+## edge_table_stats.pl, with the same output files:
+##
+## <prefix>edges_per_node_hist.txt   node ID -> edges touching it
+## <prefix>ngroups_hist.txt          n-groups -> edges
+## <prefix>nwords_hist.txt           n-words -> edges
+## <prefix>same_user_hist.txt        flag -> edges
+## <prefix>same_loc_hist.txt         flag -> edges
+## <prefix>same_contact_hist.txt     flag -> edges
+## <prefix>group_id_hist.txt         group ID -> edges sharing it
+## <prefix>word_id_hist.txt          word ID -> edges sharing it
+## <prefix>word_type_hist.txt        word type -> shared words of that type
+##
+## Each line is "key count"; flag keys are sorted as strings, the rest
+## numerically. As in the Perl, an edge with no groups (words, word
+## types) counts once under key 0 of the ID (type) histogram.
+##
+## The numeric histograms are numpy bincounts, taken over the columns of
+## a column directory or archive (one block at a time) or over byte-range
+## chunks of a text table parsed in parallel (see chunked_reader.py.)
+## Flags are counted as they appear in a text table; column directories
+## and archives hold them in canonical form (see edge_columns.py.)
+##
+
+import sys
+import time
+import argparse
+from array import array
+
+import numpy as np
+
+from cp6.tables.edge_table import EdgeTable
+from cp6.utilities.chunked_reader import ChunkedReader
+
+class EdgeStats:
+
+    # (output name, numeric keys?)
+    HISTS = ( ('edges_per_node', True), ('ngroups', True), ('nwords', True), \
+              ('same_user', False), ('same_loc', False), ('same_contact', False), \
+              ('group_id', True), ('word_id', True), ('word_type', True) )
+    FLAGS = ( 'same_user', 'same_loc', 'same_contact' )
+
+    def __init__( self ):
+        # numeric histograms are count arrays indexed by key; flag histograms are dicts
+        self.hists = dict()
+        for (name, numeric) in EdgeStats.HISTS:
+            self.hists[ name ] = np.zeros( 0, dtype=np.int64 ) if numeric else dict()
+        self.c_edges = 0
+
+    @staticmethod
+    def add_counts( x, y ):
+        if len(x) < len(y):
+            (x, y) = (y, x)
+        x = x.copy()
+        x[ :len(y) ] += y
+        return x
+
+    def count( self, name, values, n_zero = 0 ):
+        # add values (an integer array) to a numeric histogram, plus n_zero counts at key 0
+        values = np.asarray( values, dtype=np.int64 )
+        if len(values) and values.min() < 0:
+            raise AssertionError( 'Negative key %d in %s histogram' % (values.min(), name))
+        counts = np.bincount( values ) if len(values) else np.zeros( 1 if n_zero else 0, dtype=np.int64 )
+        if n_zero:
+            counts[0] += n_zero
+        self.hists[ name ] = EdgeStats.add_counts( self.hists[ name ], counts.astype( np.int64 ))
+
+    def count_flags( self, name, counts ):
+        h = self.hists[ name ]
+        for (k, v) in counts.items():
+            h[ k ] = h.get( k, 0 ) + v
+
+    def merge( self, other ):
+        for (name, numeric) in EdgeStats.HISTS:
+            if numeric:
+                self.hists[ name ] = EdgeStats.add_counts( self.hists[ name ], other.hists[ name ] )
+            else:
+                self.count_flags( name, other.hists[ name ] )
+        self.c_edges += other.c_edges
+        return self
+
+    @staticmethod
+    def from_columns( c ):
+        from cp6.tables.edge_columns import EdgeColumns
+        s = EdgeStats()
+        cols = c.cols
+        s.c_edges = len(c)
+        s.count( 'edges_per_node', np.concatenate( (cols['a'], cols['b']) ))
+        s.count( 'ngroups', cols['n_groups'] )
+        s.count( 'nwords', cols['n_words'] )
+        for (name, col) in zip( EdgeStats.FLAGS, ('same_user', 'same_location', 'shared_contact') ):
+            codes = np.bincount( cols[ col ], minlength=len(EdgeColumns.FLAG_STRS) )
+            s.count_flags( name, dict( (EdgeColumns.FLAG_STRS[i], int(n)) for (i, n) in enumerate( codes ) if n ))
+        for (name, l) in (('group_id', 'group'), ('word_id', 'word'), ('word_type', 'word_type')):
+            offsets = cols[ '%s_offsets' % l ]
+            values = cols[ '%s_values' % l ][ offsets[0]:offsets[-1] ]
+            s.count( name, values, int( np.count_nonzero( np.diff( offsets ) == 0 )))
+        return s
+
+    @staticmethod
+    def from_lines( lines, where ):
+        s = EdgeStats()
+        (ab, n_groups, n_words) = (array('l'), array('l'), array('l'))
+        flags = [ dict() for name in EdgeStats.FLAGS ]
+        lists = [ list(), list(), list() ]
+        nones = [ 0, 0, 0 ]
+        c_line = 0
+        for raw_line in lines:
+            c_line += 1
+            d = raw_line.split()
+            if len(d) != 10:
+                raise AssertionError( '%s line %d: expected 10 fields; found %d' % (where, c_line, len(d)))
+            ab.append( int(d[0]) )
+            ab.append( int(d[1]) )
+            n_groups.append( int(d[2]) )
+            n_words.append( int(d[3]) )
+            for (i, flag) in enumerate( d[7:10] ):
+                flags[i][ flag ] = flags[i].get( flag, 0 ) + 1
+            for i in range( 3 ):
+                field = d[ 4+i ]
+                if field == 'none':
+                    nones[i] += 1
+                    continue
+                n = d[3] if i else d[2]
+                if field.count( ',' ) + 1 != int(n):
+                    raise AssertionError( '%s line %d: found %d %s; expecting %s' % \
+                                          (where, c_line, field.count( ',' ) + 1, ('groups', 'words', 'word_types')[i], n))
+                lists[i].append( field )
+        s.c_edges = c_line
+        s.count( 'edges_per_node', np.frombuffer( ab, dtype=np.int_ ) if len(ab) else () )
+        s.count( 'ngroups', np.frombuffer( n_groups, dtype=np.int_ ) if len(n_groups) else () )
+        s.count( 'nwords', np.frombuffer( n_words, dtype=np.int_ ) if len(n_words) else () )
+        for (name, counts) in zip( EdgeStats.FLAGS, flags ):
+            s.count_flags( name, counts )
+        for (i, name) in enumerate( ('group_id', 'word_id', 'word_type') ):
+            values = np.fromstring( ','.join( lists[i] ), dtype=np.int64, sep=',' ) if lists[i] else ()
+            s.count( name, values, nones[i] )
+        return s
+
+    @staticmethod
+    def from_file( fn, n_workers = 1 ):
+        #
+        # fn may be a text table (optionally compressed), archive, or
+        # column directory; '-' reads a text table from stdin. n_workers
+        # > 1 (or None, one per CPU) parses a text table in parallel.
+        #
+        t_start = time.time()
+        if fn == '-':
+            s = EdgeStats.from_lines( sys.stdin, 'stdin' )
+        elif EdgeTable.is_archive( fn ):
+            from cp6.tables.edge_archive import EdgeArchive
+            s = EdgeStats()
+            for c in EdgeArchive.iter_blocks( fn ):
+                s.merge( EdgeStats.from_columns( c ))
+        else:
+            from cp6.tables.edge_columns import EdgeColumns
+            if EdgeColumns.is_columns_dir( fn ):
+                s = EdgeStats.from_columns( EdgeColumns.read_from_dir( fn ))
+            else:
+                s = EdgeStats()
+                for chunk in ChunkedReader.parallel_map( fn, read_stats_chunk, n_workers ):
+                    s.merge( chunk )
+        sys.stderr.write('Info: computed stats over %d edges from %s in %f seconds\n' % (s.c_edges, fn, time.time() - t_start))
+        return s
+
+    def write( self, prefix ):
+        for (name, numeric) in EdgeStats.HISTS:
+            h = self.hists[ name ]
+            with open( '%s%s_hist.txt' % (prefix, name), 'w' ) as f:
+                if numeric:
+                    keys = np.flatnonzero( h )
+                    f.writelines( '%d %d\n' % (k, v) for (k, v) in zip( keys.tolist(), h[ keys ].tolist() ))
+                else:
+                    f.writelines( '%s %d\n' % (k, h[k]) for k in sorted( h ))
+
+def read_stats_chunk( fn, start, end ):
+    # ChunkedReader worker: EdgeStats over one byte range of a text edge table
+    return EdgeStats.from_lines( ChunkedReader.iter_lines( fn, start, end ), '%s bytes %d-%d' % (fn, start, end) )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='Edge table histograms (the replacement for edge_table_stats.pl)' )
+    parser.add_argument( '--workers', type=int, default=1, help='parallel parse workers for text tables (0: one per CPU)' )
+    parser.add_argument( 'edge_table', help='edge table, archive, or column directory; - for a text table on stdin' )
+    parser.add_argument( 'output_prefix', help='prefix for the *_hist.txt output files' )
+    args = parser.parse_args()
+    EdgeStats.from_file( args.edge_table, args.workers or None ).write( args.output_prefix )
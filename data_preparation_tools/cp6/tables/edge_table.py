@@ -29,85 +29,452 @@
 # Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
 #
 
+import os
 import sys
-import copy
 import time
 import cProfile
 
-from cp6.utilities.image_edge import ImageEdge
+from cp6.utilities.image_edge import ImageEdge, LazyImageEdge
+from cp6.utilities.chunked_reader import ChunkedReader
+from cp6.utilities.table_io import TableIO
+from cp6.utilities.list_pool import ListPool
 
 class EdgeTable:
 
+    #
+    # edges is either a list of ImageEdges or, in compact mode, an
+    # EdgeColumnList (see edge_columns.py) which holds the edges as numpy
+    # arrays and hands out ImageEdge-like views.
+    #
+
+    # names accepted by the columns argument to read_from_file
+    COLUMNS = ( 'image_A_id', 'image_B_id', 'n_shared_groups', 'n_shared_words' ) + \
+              LazyImageEdge.LISTS + \
+              ( 'same_user_flag', 'same_location_flag', 'shared_contact_flag' )
+
+    # file formats, by extension: the text table, the archival format
+    # (see edge_archive.py), and the clique-compressed format (see
+    # edge_hypergraph.py). Any may also be compressed (see table_io.py),
+    # as in image_edge_table.txt.gz.
+    FORMATS = ( '.txt', '.cp6e', '.cp6h' )
+
     def __init__( self, e ):
         self.edges = e
 
+    @staticmethod
+    def is_archive( fn ):
+        return TableIO.base_name( fn ).endswith( '.cp6e' )
+
+    @staticmethod
+    def is_hyper( fn ):
+        return TableIO.base_name( fn ).endswith( '.cp6h' )
+
+    @staticmethod
+    def format_of( fn ):
+        # fn's entry in FORMATS, ignoring any compression suffix
+        if EdgeTable.is_archive( fn ):
+            return '.cp6e'
+        return '.cp6h' if EdgeTable.is_hyper( fn ) else '.txt'
+
+    @staticmethod
+    def find_table( dir_name, base = 'image_edge_table' ):
+        # the edge table named base in dir_name, in whichever format is there
+        for ext in EdgeTable.FORMATS:
+            fn = TableIO.find( dir_name, base + ext )
+            if fn is not None:
+                return fn
+        raise AssertionError( 'No %s{%s}[%s] in %s' % (base, ','.join( EdgeTable.FORMATS ), \
+                                                        ','.join( TableIO.SUFFIXES ), dir_name ))
+
+    def is_compact( self ):
+        return hasattr( self.edges, 'columns' )
+
     def write_to_file( self, fn, ids_to_keep = None ):
-        (c_total, c_written) = (0,0)
-        if ids_to_keep is not None:
-            maxid = max(ids_to_keep)
-            id_to_keep_list = [0]*(maxid+1)
-            for i in ids_to_keep:
-#                sys.stderr.write('index %d max %d len %d\n' % (i, maxid, len(id_to_keep_list)))
-                id_to_keep_list[i] = 1
+        if self.is_compact():
+            columns = self.edges.flush()
+            if EdgeTable.is_archive( fn ):
+                from cp6.tables.edge_archive import EdgeArchiveWriter
+                if ids_to_keep is not None:
+                    columns = columns.select( columns.keep_mask( ids_to_keep ))
+                with EdgeArchiveWriter( fn ) as w:
+                    w.write_columns( columns )
+                return (len(self.edges), len(columns))
+            if not EdgeTable.is_hyper( fn ):
+                return columns.write_text( fn, ids_to_keep )
 
-        with open(fn, 'w') as f:
-            for index in range(0,len(self.edges)):
-                e = self.edges[index]
-                (ea, eb) = (e.image_A_id, e.image_B_id)
-                c_total += 1
-#                write_this_edge = (ids_to_keep is None) or \
-#                                  ((e.image_A_id in ids_to_keep) and (e.image_B_id in ids_to_keep))
-                write_this_edge = (ids_to_keep is None) or\
-                                  ((ea <= maxid) and (id_to_keep_list[ea]==1) and\
-                                   (eb <= maxid) and (id_to_keep_list[eb]==1))
-                if not write_this_edge:
-                    continue
-                c_written += 1
-                f.write( '%d %d %d %d ' % (e.image_A_id, e.image_B_id, len(e.shared_groups), len(e.shared_words)))
-                group_str = ','.join(map(str,e.shared_groups)) if len(e.shared_groups) else 'none'
-                word_str = ','.join(map(str,e.shared_words)) if len(e.shared_words) else 'none'
-                word_type_str = ','.join(map(str,e.shared_word_types)) if len(e.shared_word_types) else 'none'
-                f.write( '%s %s %s ' % (group_str, word_str, word_type_str))
-                f.write( '%s %s %s\n' % (ImageEdge.canonical_flag( e.same_user_flag ), \
-                                         ImageEdge.canonical_flag( e.same_location_flag ), \
-                                         ImageEdge.canonical_flag( e.shared_contact_flag )))
-        return (c_total, c_written)
+        with EdgeTableWriter( fn, ids_to_keep ) as w:
+            for e in self.edges:
+                w.write( e )
+        return w.counts()
+
+    @staticmethod
+    def format_edge( e ):
+        # fields 2 and 3 are always the lengths of the group and word lists,
+        # whatever counts the edge was read with
+        if isinstance( e, LazyImageEdge ):
+            # don't decode lists just to re-join them
+            return '%d %d %d %d %s %s %s %s %s %s\n' % \
+                (e.image_A_id, e.image_B_id, e.list_len( 'shared_groups' ), e.list_len( 'shared_words' ), \
+                 e.raw_list( 'shared_groups' ), e.raw_list( 'shared_words' ), e.raw_list( 'shared_word_types' ), \
+                 ImageEdge.canonical_flag( e.same_user_flag ), \
+                 ImageEdge.canonical_flag( e.same_location_flag ), \
+                 ImageEdge.canonical_flag( e.shared_contact_flag ))
+        group_str = ','.join(map(str,e.shared_groups)) if len(e.shared_groups) else 'none'
+        word_str = ','.join(map(str,e.shared_words)) if len(e.shared_words) else 'none'
+        word_type_str = ','.join(map(str,e.shared_word_types)) if len(e.shared_word_types) else 'none'
+        return '%d %d %d %d %s %s %s %s %s %s\n' % \
+            (e.image_A_id, e.image_B_id, len(e.shared_groups), len(e.shared_words), \
+             group_str, word_str, word_type_str, \
+             ImageEdge.canonical_flag( e.same_user_flag ), \
+             ImageEdge.canonical_flag( e.same_location_flag ), \
+             ImageEdge.canonical_flag( e.shared_contact_flag ))
 
+    @staticmethod
+    def check_columns( columns ):
+        if columns is None:
+            return None
+        unknown = [ c for c in columns if c not in EdgeTable.COLUMNS ]
+        if unknown:
+            raise AssertionError( 'Unknown edge table column(s) %s; expected some of %s' % \
+                                  (','.join( unknown ), ','.join( EdgeTable.COLUMNS )))
+        return tuple( columns )
+
+    @staticmethod
+    def parse_fields( fields, columns = None, pool = None ):
+        # columns=None decodes everything into an ImageEdge; otherwise a
+        # LazyImageEdge which only decodes the lists named in columns.
+        # pool, a ListPool, shares identical lists between ImageEdges.
+        if columns is not None:
+            return LazyImageEdge( fields, columns )
+        if pool is not None:
+            return ImageEdge( int(fields[0]), int(fields[1]), \
+                              pool.intern_string( fields[4] ), pool.intern_string( fields[5] ), \
+                              pool.intern_string( fields[6] ), fields[7], fields[8], fields[9] )
+        # n_groups = fields[2], n_words = fields[3]
+        sharedGroups = ImageEdge.parse_list( fields[4] )
+        sharedWords = ImageEdge.parse_list( fields[5] )
+        sharedWordTypes = ImageEdge.parse_list( fields[6] )
+        return ImageEdge( int(fields[0]), int(fields[1]), \
+                          sharedGroups, sharedWords, sharedWordTypes, \
+                          fields[7], fields[8], fields[9] )
+
+    @staticmethod
+    def iter_file( fn, predicate=None, id_dict_to_keep=None, columns=None, pool=None ):
+        #
+        # Generator over the edges in fn, one line at a time. Edges with an
+        # endpoint not in id_dict_to_keep are skipped before the lists are
+        # decoded; predicate, if given, is then called on each ImageEdge
+        # and edges for which it returns False are skipped. See
+        # read_from_file for columns, parse_fields for pool.
+        #
+        if (id_dict_to_keep is not None) and not isinstance( id_dict_to_keep, (dict, set, frozenset) ):
+            id_dict_to_keep = set( id_dict_to_keep )
+        columns = EdgeTable.check_columns( columns )
+        if EdgeTable.is_hyper( fn ):
+            # expanded lazily; columns=None gets plain ImageEdges, as from text
+            from cp6.tables.edge_hypergraph import HyperedgeTable
+            for e in HyperedgeTable.read_from_file( fn ).iter_edges( id_dict_to_keep ):
+                if columns is None:
+                    e = e.to_image_edge()
+                    if pool is not None:
+                        pool.intern_edge( e )
+                if (predicate is None) or predicate( e ):
+                    yield e
+            return
+        if EdgeTable.is_archive( fn ):
+            from cp6.tables.edge_archive import EdgeArchive
+            for e in EdgeArchive.iter_edges( fn, id_dict_to_keep ):
+                if pool is not None:
+                    pool.intern_edge( e )
+                if (predicate is None) or predicate( e ):
+                    yield e
+            return
+        with TableIO.open( fn ) as f:
+            for e in EdgeTable.iter_lines( f, fn, id_dict_to_keep, columns, pool ):
+                if (predicate is None) or predicate( e ):
+                    yield e
 
     @staticmethod
-    def read_from_file( fn, id_dict_to_keep=None ):
-        edges = list()
+    def iter_lines( lines, where, id_dict_to_keep=None, columns=None, pool=None ):
+        # parse edge table lines; where names the source in error messages
         c_line = 0
-        with open(fn) as f:
-            t_start = time.clock()
-            while 1:
-                raw_line = f.readline()
-                if not raw_line:
-                    break
-                c_line += 1
-                fields = raw_line.strip().split()
-                if len(fields) != 10:
-                    raise AssertionError( '%s line %d: expected 10 fields, got %d' % \
-                                          (fn, c_line, len(fields) ))
-                (image_A_id, image_B_id) = (int(fields[0]), int(fields[1]))
-                if (id_dict_to_keep is None) or ( (image_A_id in id_dict_to_keep) and (image_B_id in id_dict_to_keep)):
-                    # n_groups = fields[2], n_words = fields[3]
-#                    sharedGroups = map( int, fields[4].split(',')) if fields[4] != 'none' else list()
-#                    sharedWords = map( int, fields[5].split(',')) if fields[5] != 'none' else list()
-#                    sharedWordTypes = map( int, fields[6].split(',')) if fields[6] != 'none' else list()
-                    sharedGroups = [int(s) for s in fields[4].split(',')] if fields[4] != 'none' else list()
-                    sharedWords = [int(s) for s in fields[5].split(',')] if fields[5] != 'none' else list()
-                    sharedWordTypes =  [int(s) for s in fields[6].split(',')] if fields[6] != 'none' else list()
-                    edges.append( ImageEdge( image_A_id, image_B_id, \
-                                             sharedGroups, sharedWords, sharedWordTypes, \
-                                             fields[7], fields[8], fields[9] ))
+        for raw_line in lines:
+            c_line += 1
+            fields = raw_line.split()
+            if len(fields) != 10:
+                raise AssertionError( '%s line %d: expected 10 fields, got %d' % \
+                                      (where, c_line, len(fields) ))
+            if (id_dict_to_keep is not None) and \
+               not ((int(fields[0]) in id_dict_to_keep) and (int(fields[1]) in id_dict_to_keep)):
+                continue
+            yield EdgeTable.parse_fields( fields, columns, pool )
+
+    @staticmethod
+    def copy_file( src_fn, dst_fn, ids_to_keep=None, predicate=None, transform=None ):
+        #
+        # Stream src_fn to dst_fn in constant memory: keep edges with both
+        # endpoints in ids_to_keep for which predicate is true, pass each
+        # through transform (which returns an edge, or None to drop it),
+        # and write. Returns (c_total, c_written) like write_to_file, where
+        # c_total counts the edges that survived the id filter.
+        #
+        c_total = 0
+        with EdgeTableWriter( dst_fn ) as w:
+            for e in EdgeTable.iter_file( src_fn, predicate, ids_to_keep ):
+                c_total += 1
+                if transform is not None:
+                    e = transform( e )
+                    if e is None:
+                        continue
+                w.write( e )
+        return (c_total, w.counts()[1])
+
+    @staticmethod
+    def route_file( src_fn, outputs ):
+        #
+        # copy_file to several outputs in a single pass over src_fn:
+        # outputs is a list of (dst_fn, ids_to_keep), and each edge is
+        # written to every output holding both its endpoints. The
+        # outputs' id sets are packed into one bitmap (bit i of mask[id]
+        # is set if id is in output i), so routing an edge is two lookups
+        # however many outputs there are. Returns (c_read, list of
+        # c_written per output.)
+        #
+        all_ids = [ ids for (dst_fn, ids) in outputs if len(ids) ]
+        maxid = max( [ max(ids) for ids in all_ids ] ) if all_ids else -1
+        mask = [0]*(maxid+1)
+        for (i, (dst_fn, ids)) in enumerate( outputs ):
+            for id in ids:
+                mask[id] |= (1 << i)
+        writers = list()
+        routes = dict()   # mask bits -> writers
+        c_read = 0
+        try:
+            for (dst_fn, ids) in outputs:
+                writers.append( EdgeTableWriter( dst_fn ))
+            def route( a, b ):
+                if (a > maxid) or (b > maxid):
+                    return None
+                r = mask[a] & mask[b]
+                if r == 0:
+                    return None
+                ws = routes.get( r )
+                if ws is None:
+                    ws = routes[ r ] = [ w for (i, w) in enumerate( writers ) if r & (1 << i) ]
+                return ws
+            if EdgeTable.format_of( src_fn ) != '.txt':
+                for e in EdgeTable.iter_file( src_fn ):
+                    c_read += 1
+                    for w in route( e.image_A_id, e.image_B_id ) or ():
+                        w.write( e )
+            else:
+                # route on the raw fields; only edges going somewhere are built
+                with TableIO.open( src_fn ) as f:
+                    for raw_line in f:
+                        c_read += 1
+                        fields = raw_line.split()
+                        if len(fields) != 10:
+                            raise AssertionError( '%s line %d: expected 10 fields, got %d' % \
+                                                  (src_fn, c_read, len(fields) ))
+                        (a, b) = (int(fields[0]), int(fields[1]))
+                        if (a > maxid) or (b > maxid) or not (mask[a] & mask[b]):
+                            continue
+                        ws = route( a, b )
+                        if ws:
+                            e = LazyImageEdge( fields )
+                            for w in ws:
+                                w.write( e )
+        finally:
+            for w in writers:
+                w.close()
+        return (c_read, [ w.counts()[1] for w in writers ])
+
+    @staticmethod
+    def read_from_file( fn, id_dict_to_keep=None, compact=False, n_workers=1, columns=None, intern=False ):
+        #
+        # compact=True returns a numpy-backed table (see edge_columns.py).
+        # n_workers > 1 (or None, for one per CPU) parses the file in
+        # parallel; this always goes through the columnar parser, and the
+        # edges are converted to ImageEdges afterwards unless compact.
+        #
+        # columns, if not None, lists the EdgeTable.COLUMNS the caller
+        # needs; the edges are then LazyImageEdges, and shared_groups,
+        # shared_words, and shared_word_types are only split into ints
+        # when listed here or first accessed. Use n_shared_groups and
+        # n_shared_words (fields 2 and 3) for counts. columns=() is the
+        # cheapest read. Ignored in compact mode and for archives and
+        # column directories, where nothing is decoded per edge anyway.
+        #
+        # Archives (.cp6e) are always decoded a block at a time into
+        # columns. Clique-compressed tables (.cp6h) are expanded; with
+        # columns, into HyperImageEdges, which only work out their lists
+        # when they're read.
+        #
+        # intern=True stores each distinct group, word, and word type list
+        # once (see list_pool.py), as a tuple shared by all the ImageEdges
+        # holding it. Ignored in compact and lazy (columns) modes.
+        #
+        # The columns parsed by compact and parallel reads of text tables
+        # and archives go through the table cache (see table_cache.py) when
+        # it's enabled, and load memory-mapped from it. Lazy and serial reads
+        # aren't cached: unpickling their edges is slower than parsing them.
+        #
+        from cp6.utilities.table_cache import TableCache
+        columns = EdgeTable.check_columns( columns )
+        if EdgeTable.is_hyper( fn ):
+            t_start = time.time()
+            pool = ListPool() if intern and (columns is None) and not compact else None
+            edges = list( EdgeTable.iter_file( fn, None, id_dict_to_keep, None if compact else columns, pool ))
+            sys.stderr.write('Info: expanded %d edges in %f seconds\n' % (len(edges), time.time() - t_start))
+            if pool is not None:
+                pool.report( fn )
+            if compact:
+                from cp6.tables.edge_columns import EdgeColumns, EdgeColumnList
+                return EdgeTable( EdgeColumnList( EdgeColumns.from_edges( edges )))
+            return EdgeTable( edges )
+        parallel = (n_workers is None) or (n_workers > 1)
+        columnar = os.path.isdir( fn ) or EdgeTable.is_archive( fn )
+        if (columns is not None) and not compact and not columnar:
+            t_start = time.time()
+            if parallel:
+                if (id_dict_to_keep is not None) and not isinstance( id_dict_to_keep, (dict, set, frozenset) ):
+                    id_dict_to_keep = set( id_dict_to_keep )
+                edges = list()
+                for chunk in ChunkedReader.parallel_map( fn, read_lazy_edge_chunk, n_workers, (id_dict_to_keep, columns) ):
+                    edges.extend( chunk )
+            else:
+                edges = list( EdgeTable.iter_file( fn, None, id_dict_to_keep, columns ))
+            sys.stderr.write('Info: read %d edges (columns %s) in %f seconds\n' % \
+                             (len(edges), ','.join( columns ) or 'none', time.time() - t_start))
+            return EdgeTable( edges )
+
+        if compact or parallel or columnar:
+            from cp6.tables.edge_columns import EdgeColumns, EdgeColumnList
+            if EdgeColumns.is_columns_dir( fn ):
+                columns = EdgeColumns.read_from_dir( fn )
+                if id_dict_to_keep is not None:
+                    columns = columns.select( columns.keep_mask( id_dict_to_keep ))
+            else:
+                if EdgeTable.is_archive( fn ):
+                    from cp6.tables.edge_archive import EdgeArchive
+                    parse = lambda: EdgeArchive.read_columns( fn, id_dict_to_keep )
+                else:
+                    parse = lambda: EdgeColumns.read_from_text_file( fn, id_dict_to_keep, n_workers )
+                columns = TableCache.get( fn, 'edge-columns', (id_dict_to_keep,), parse,
+                                          store=lambda c, d: c.write_to_dir( d ),
+                                          load=EdgeColumns.read_from_dir )
+            if compact:
+                return EdgeTable( EdgeColumnList( columns ))
+            edges = columns.to_edges()
+            if intern:
+                pool = ListPool()
+                for e in edges:
+                    pool.intern_edge( e )
+                pool.report( fn )
+            return EdgeTable( edges )
+
+        t_start = time.clock()
+        pool = ListPool() if intern else None
+        edges = list( EdgeTable.iter_file( fn, None, id_dict_to_keep, None, pool ))
         t_elapsed = time.clock() - t_start
         sys.stderr.write('Info: read in %f seconds\n' % t_elapsed)
+        if pool is not None:
+            pool.report( fn )
         return EdgeTable( edges )
 
+def read_lazy_edge_chunk( fn, start, end, id_dict_to_keep, columns ):
+    # ChunkedReader worker: one byte range of a text edge table -> list of LazyImageEdges
+    return list( EdgeTable.iter_lines( ChunkedReader.iter_lines( fn, start, end ), \
+                                       '%s bytes %d-%d' % (fn, start, end), id_dict_to_keep, columns ))
+
+class EdgeTableWriter:
+    #
+    # Streaming counterpart to EdgeTable.write_to_file: write edges one at
+    # a time, dropping any with an endpoint not in ids_to_keep. Use as a
+    # context manager; counts() returns (c_total, c_written). A .cp6e
+    # fn writes the archival format. A .cp6h fn is clique-compressed,
+    # which needs the whole table: its edges are held until close().
+    #
+
+    def __init__( self, fn, ids_to_keep = None ):
+        self.fn = fn
+        (self.c_total, self.c_written) = (0, 0)
+        self.id_to_keep_list = None
+        if ids_to_keep is not None:
+            self.maxid = max(ids_to_keep) if len(ids_to_keep) else -1
+            self.id_to_keep_list = [0]*(self.maxid+1)
+            for i in ids_to_keep:
+                self.id_to_keep_list[i] = 1
+        self.archive = None
+        self.f = None
+        self.held = None
+        if EdgeTable.is_hyper( fn ):
+            self.held = list()
+        elif EdgeTable.is_archive( fn ):
+            from cp6.tables.edge_archive import EdgeArchiveWriter
+            self.archive = EdgeArchiveWriter( fn )
+        else:
+            self.f = TableIO.open( fn, 'w' )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        self.close()
+        return False
+
+    def keep( self, ea, eb ):
+        if self.id_to_keep_list is None:
+            return True
+        return (ea <= self.maxid) and (self.id_to_keep_list[ea]==1) and \
+               (eb <= self.maxid) and (self.id_to_keep_list[eb]==1)
+
+    def write( self, e ):
+        self.c_total += 1
+        if not self.keep( e.image_A_id, e.image_B_id ):
+            return False
+        self.c_written += 1
+        if self.archive is not None:
+            self.archive.write( e )
+        elif self.held is not None:
+            self.held.append( e )
+        else:
+            self.f.write( EdgeTable.format_edge( e ))
+        return True
+
+    def counts( self ):
+        return (self.c_total, self.c_written)
+
+    def close( self ):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        if self.held is not None:
+            from cp6.tables.edge_hypergraph import HyperedgeTable
+            h = HyperedgeTable.from_edges( self.held )
+            self.held = None
+            h.report( self.fn )
+            h.write_to_file( self.fn )
+
 if __name__ == '__main__':
+    usage = 'Usage: $0 input-edge-table [output-edge-table]   (either may be .cp6e or .cp6h)\n' \
+            '       $0 --to-columns input-edge-table output-column-dir\n' \
+            '       $0 --from-columns input-column-dir output-edge-table\n'
+    if (len(sys.argv) == 4) and (sys.argv[1] in ('--to-columns', '--from-columns')):
+        from cp6.tables.edge_columns import EdgeColumns
+        if sys.argv[1] == '--to-columns':
+            c = EdgeColumns.read_from_text_file( sys.argv[2] )
+            c.write_to_dir( sys.argv[3] )
+        else:
+            c = EdgeColumns.read_from_dir( sys.argv[2] )
+            c.write_text( sys.argv[3] )
+        sys.stderr.write('Info: converted %d edges\n' % len(c))
+        sys.exit(0)
     if (len(sys.argv) != 3) and (len(sys.argv) != 2):
-        sys.stderr.write('Usage: $0 input-edge-table [output-edge-table]\n')
+        sys.stderr.write( usage )
         sys.exit(0)
     if len(sys.argv) == 3:
         t = EdgeTable.read_from_file( sys.argv[1] )
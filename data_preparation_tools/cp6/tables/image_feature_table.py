@@ -0,0 +1,158 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## An image feature table (CEDD.txt, Gabor.txt, caffe_histograms.txt, ...)
+## has one line per image:
+##
+## image_id N v_1 ... v_N
+##
+## with N fixed across the file. Parsing the text is slow, so the first
+## load writes the table as a matrix into a sidecar directory next to it
+## (<table>.mat), which later loads memory-map:
+##
+## ids          int64    sorted image IDs
+## values       float32  values[i] is the feature vector of ids[i]
+## matrix.txt            format version and the table's size and mtime
+##
+## The sidecar is rebuilt when the table changes (see Sidecar.) Values are
+## stored as float32, which halves the memory and I/O of the gather and is
+## well within the precision the features were written with.
+##
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from cp6.utilities.sidecar import Sidecar
+from cp6.utilities.table_io import TableIO
+
+class ImageFeatureTable:
+
+    VERSION = 1
+    STAMP = 'matrix.txt'
+
+    def __init__( self, fn, ids, values ):
+        self.fn = fn
+        self.ids = ids
+        self.values = values
+
+    def __len__( self ):
+        return len( self.ids )
+
+    def dim( self ):
+        return self.values.shape[1]
+
+    @staticmethod
+    def name_of( fn ):
+        # the feature name: CEDD for .../CEDD.txt.gz
+        return os.path.basename( TableIO.base_name( fn ))[ :-len('.txt') ] \
+            if TableIO.base_name( fn ).endswith( '.txt' ) else os.path.basename( fn )
+
+    @staticmethod
+    def find( dir_name, name ):
+        # the feature table for name (e.g. 'CEDD') in dir_name, possibly compressed
+        return TableIO.find_required( dir_name, name + '.txt' )
+
+    @staticmethod
+    def matrix_dir( fn ):
+        return fn + '.mat'
+
+    @staticmethod
+    def parse_file( fn ):
+        # (ids, values) from the text table, sorted by ID
+        (ids, rows, dim) = (list(), list(), None)
+        with TableIO.open( fn ) as f:
+            for (line_no, line) in enumerate( f, 1 ):
+                v = np.fromstring( line, dtype=np.float64, sep=' ' )
+                if len(v) == 0:
+                    continue
+                if (len(v) < 2) or (len(v) != int(v[1]) + 2):
+                    raise AssertionError( '%s line %d: expected image_id N and N values' % (fn, line_no ))
+                if dim is None:
+                    dim = len(v) - 2
+                elif len(v) - 2 != dim:
+                    raise AssertionError( '%s line %d: %d values; earlier lines have %d' % (fn, line_no, len(v)-2, dim ))
+                ids.append( int(v[0]) )
+                rows.append( v[2:].astype( np.float32 ))
+        ids = np.array( ids, dtype=np.int64 )
+        values = np.vstack( rows ) if rows else np.zeros( (0, 0), dtype=np.float32 )
+        order = np.argsort( ids, kind='mergesort' )
+        (ids, values) = (ids[order], values[order])
+        dupes = np.flatnonzero( ids[1:] == ids[:-1] )
+        if len(dupes):
+            raise AssertionError( '%s: image %d appears more than once' % (fn, ids[ dupes[0] ] ))
+        return (ids, values)
+
+    @staticmethod
+    def build( fn ):
+        t_start = time.time()
+        (ids, values) = ImageFeatureTable.parse_file( fn )
+
+        Sidecar.write_arrays( ImageFeatureTable.matrix_dir( fn ), { 'ids': ids, 'values': values }, \
+                              ImageFeatureTable.STAMP, fn, ImageFeatureTable.VERSION )
+        sys.stderr.write('Info: converted %d %d-d feature vectors from %s in %f seconds\n' % \
+                         (len(ids), values.shape[1], fn, time.time() - t_start))
+        return ImageFeatureTable( fn, ids, values )
+
+    @staticmethod
+    def is_fresh( fn ):
+        return Sidecar.is_fresh( os.path.join( ImageFeatureTable.matrix_dir( fn ), ImageFeatureTable.STAMP ), \
+                                 fn, ImageFeatureTable.VERSION )
+
+    @staticmethod
+    def load( fn, rebuild=True ):
+        # the table fn as a memory-mapped matrix, (re)built first if missing or stale (unless rebuild is False)
+        if not ImageFeatureTable.is_fresh( fn ):
+            if not rebuild:
+                raise AssertionError( '%s: feature matrix is missing or out of date' % fn )
+            return ImageFeatureTable.build( fn )
+        mat_dir = ImageFeatureTable.matrix_dir( fn )
+        return ImageFeatureTable( fn, np.load( os.path.join( mat_dir, 'ids.npy' ), mmap_mode='r' ), \
+                                  np.load( os.path.join( mat_dir, 'values.npy' ), mmap_mode='r' ))
+
+    def rows_of( self, image_ids ):
+        # row of each image ID in values, or -1 if the table has no vector for it
+        image_ids = np.asarray( image_ids, dtype=np.int64 )
+        if len( self.ids ) == 0:
+            return np.zeros( len(image_ids), dtype=np.int64 ) - 1
+        rows = np.searchsorted( self.ids, image_ids )
+        rows[ rows == len( self.ids ) ] = 0
+        return np.where( self.ids[ rows ] == image_ids, rows, -1 )
+
+    def vectors( self, image_ids ):
+        # the feature vectors of image_ids, as a float64 matrix; NaN rows for missing IDs
+        rows = self.rows_of( image_ids )
+        v = self.values[ np.maximum( rows, 0 ) ].astype( np.float64 )
+        v[ rows < 0 ] = np.nan
+        return v
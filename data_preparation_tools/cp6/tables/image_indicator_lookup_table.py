@@ -35,6 +35,7 @@
 
 import sys
 from cp6.utilities.util import Util
+from cp6.utilities.table_io import TableIO
 from cp6.utilities.image_indicator import ImageIndicator
 
 ##
@@ -226,7 +227,7 @@ class ImageIndicatorLookupTable:
         return True
 
     def write_to_file( self, fn ):
-        with open( fn, 'w' ) as f:
+        with TableIO.open( fn, 'w' ) as f:
             f.write( '%d %d\n' % (len(self.group_text_lut), len(self.tag_word_text_lut)))
             for i in sorted( self.group_text_lut.iteritems(), key=lambda x:x[1] ):
                 (entry_id, entry_text) = (i[1], i[0])
@@ -237,8 +238,15 @@ class ImageIndicatorLookupTable:
 
     @staticmethod
     def read_from_file( fn ):
+        # goes through the table cache (see table_cache.py) when it's enabled
+        from cp6.utilities.table_cache import TableCache
+        return TableCache.get( fn, 'image-indicator-lookup-table', (),
+                               lambda: ImageIndicatorLookupTable.parse_file( fn ))
+
+    @staticmethod
+    def parse_file( fn ):
         t = ImageIndicatorLookupTable()
-        with open( fn, 'r' ) as f:
+        with TableIO.open( fn, 'r' ) as f:
             header_fields = Util.qstr_split( f.readline().strip() )
             if len(header_fields) != 2:
                 raise AssertionError( 'ImageIndicatorLookupTable "%s": header had %d fields, expected 2' % \
@@ -32,6 +32,8 @@
 import sys
 from cp6.utilities.util import Util
 from cp6.utilities.image_indicator import ImageIndicator
+from cp6.utilities.chunked_reader import ChunkedReader
+from cp6.utilities.table_io import TableIO
 
 class ImageIndicatorTable:
 
@@ -41,7 +43,7 @@ class ImageIndicatorTable:
     def write_to_file( self, fn, id_list = None ):
         if not id_list:
             id_list = sorted( self.image_indicators.keys() )
-        with open( fn, 'w' ) as f:
+        with TableIO.open( fn, 'w' ) as f:
             for mir_id in sorted( id_list ):
                 imgind = self.image_indicators[ mir_id ]
                 group_str = ','.join( [str(x) for x in sorted(imgind.group_list.keys())]) if (len(imgind.group_list)) else 'none'
@@ -50,50 +52,85 @@ class ImageIndicatorTable:
                 f.write( '%d %s %s %s\n' % ( mir_id, group_str, word_str, flags_str ))
 
     @staticmethod
-    def read_from_file( fn, id_list = None ):
+    def iter_indicators( lines, where, id_list = None ):
+        # where names the source in error messages
+        c_line = 0
+        for raw_line in lines:
+            c_line += 1
+            fields = raw_line.strip().split()
+            if len(fields) != 4:
+                raise AssertionError( '%s line %d: expected 4 fields, got %d' % \
+                                    (where, c_line, len(fields)))
+            id = int( fields[0] )
+            if (id_list is not None) and (id not in id_list):
+                continue
+            ii = ImageIndicator( id )
+            if fields[1] != 'none':
+                ii.group_list = { int(x): True for x in fields[1].split(',') }
+            if fields[2] != 'none':
+                word_indices = fields[2].split(',')
+                ii.word_list = { int(x): True for x in word_indices }
+                if fields[3] == 'none':
+                    raise AssertionError('id %d: %d words, but no source flags?\n' % (id, len(word_indices)))
+                ii.word_source_list = dict()
+                d = fields[3].split(',')
+                if (len( word_indices ) != len( d )):
+                    raise AssertionError('id %d: %d words, but %d source flags\n' % (id, len(word_indices), len(d)))
+                for i in range(0, len(word_indices)):
+                    flag_target = int(word_indices[i])
+                    flag_value = int(d[i])
+                    ii.word_source_flags[ flag_target ] = flag_value
+            else:
+                if fields[3] != 'none':
+                    raise AssertionError('id %d: no words, but carries source flags?\n' % id )
+            yield ii
+
+    @staticmethod
+    def read_from_file( fn, id_list = None, n_workers = 1 ):
         #
         # note that this just reads the text from the file and recreates the
         # data structure. It does not enforce consistency with any instance
         # of an Image Indicator Lookup Table.
         #
+        # n_workers > 1 (or None, for one per CPU) parses the file in parallel.
+        # Goes through the table cache (see table_cache.py) when it's enabled.
+        #
+        from cp6.utilities.table_cache import TableCache
+        if (id_list is not None) and not isinstance( id_list, (dict, set, frozenset) ):
+            id_list = set( id_list )
+        return TableCache.get( fn, 'image-indicator-table', (id_list,),
+                               lambda: ImageIndicatorTable.parse_file( fn, id_list, n_workers ))
+
+    @staticmethod
+    def parse_file( fn, id_list, n_workers ):
         t = ImageIndicatorTable()
-        c_line = 0
-        with open( fn, 'r' ) as f:
-            while 1:
-                raw_line = f.readline()
-                if not raw_line:
-                    break
-                c_line += 1
-                fields = raw_line.strip().split()
-                if len(fields) != 4:
-                    raise AssertionError( '%s line %d: expected 4 fields, got %d' % \
-                                        (fn, c_line, len(fields)))
-                id = int( fields[0] )
-                if (id_list is not None) and (id not in id_list):
-                    next
-                ii = ImageIndicator( id )
-                if fields[1] != 'none':
-                    ii.group_list = { int(x): True for x in fields[1].split(',') }
-                if fields[2] != 'none':
-                    word_indices = fields[2].split(',')
-                    ii.word_list = { int(x): True for x in word_indices }
-                    if fields[3] == 'none':
-                        raise AssertionError('id %d: %d words, but no source flags?\n' % (id, len(word_indices)))
-                    ii.word_source_list = dict()
-                    d = fields[3].split(',')
-                    if (len( word_indices ) != len( d )):
-                        raise AssertionError('id %d: %d words, but %d source flags\n' % (id, len(word_indices), len(d)))
-                    for i in range(0, len(word_indices)):
-                        flag_target = int(word_indices[i])
-                        flag_value = int(d[i])
-                        ii.word_source_flags[ flag_target ] = flag_value
-                else:
-                    if fields[3] != 'none':
-                        raise AssertionError('id %d: no words, but carries source flags?\n' % id )
+        if (n_workers is None) or (n_workers > 1):
+            for indicators in ChunkedReader.parallel_map( fn, read_indicator_chunk, n_workers, (id_list,) ):
+                for ii in indicators:
+                    t.image_indicators[ ii.id ] = ii
+            return t
+        with TableIO.open( fn, 'r' ) as f:
+            for ii in ImageIndicatorTable.iter_indicators( f, fn, id_list ):
+                t.image_indicators[ ii.id ] = ii
+        return t
 
-                t.image_indicators[ id ] = ii
+    @staticmethod
+    def get( fn, id_list ):
+        # an ImageIndicatorTable of just those of id_list in fn, seeking to their rows
+        # via the row index (see row_index.py); compressed tables are read in full
+        from cp6.tables.row_index import RowIndex
+        if not RowIndex.can_index( fn ):
+            return ImageIndicatorTable.read_from_file( fn, id_list )
+        t = ImageIndicatorTable()
+        for ii in ImageIndicatorTable.iter_indicators( RowIndex.load( fn ).read_lines( id_list ), '%s (indexed)' % fn ):
+            t.image_indicators[ ii.id ] = ii
         return t
 
+def read_indicator_chunk( fn, start, end, id_list ):
+    # ChunkedReader worker: one byte range of an image indicator table -> list of ImageIndicators
+    return list( ImageIndicatorTable.iter_indicators( ChunkedReader.iter_lines( fn, start, end ), \
+                                                      '%s bytes %d-%d' % (fn, start, end), id_list ))
+
 if __name__ == '__main__':
     if len(sys.argv) != 3:
         sys.stderr.write('Usage: $0 input-img-indicator-table output-img-indicator-table\n')
@@ -30,31 +30,71 @@
 #
 
 import sys
-import codecs
 import copy
 
 from cp6.utilities.util import Util
+from cp6.utilities.chunked_reader import ChunkedReader
+from cp6.utilities.table_io import TableIO
 from cp6.utilities.exifdata import EXIFData
 from cp6.utilities.image_table_entry import ImageTableEntry
 
 class ImageTable:
 
+    #
+    # What read_from_file does with the free-text title and description
+    # (fields 3 and 4), which most tools never look at:
+    #
+    # TEXT_FULL  decode them as the table is read
+    # TEXT_LAZY  keep their UTF-8 bytes and decode on first use (see ImageTableEntry)
+    # TEXT_DROP  don't keep them; the table can't then be written back
+    #
+    (TEXT_FULL, TEXT_LAZY, TEXT_DROP) = ('full', 'lazy', 'drop')
+
     def __init__( self ):
         self.entries = dict()
+        self.labels = None  # LabelMatrix cache; see label_matrix()
+        self.strings = dict()  # one copy of each owner and locality string; see add_entry
+        self.text = ImageTable.TEXT_FULL
 
     def add_entry( self, e ):
         if e.mir_id in self.entries:
             raise AssertionError( 'Double-add of %d in image table' % e.mir_id )
+        # owners and localities repeat across many images; share one string for each
+        if e.flickr_owner is not None:
+            e.flickr_owner = self.strings.setdefault( e.flickr_owner, e.flickr_owner )
+        if e.flickr_locality is not None:
+            e.flickr_locality = self.strings.setdefault( e.flickr_locality, e.flickr_locality )
         self.entries[ e.mir_id ] = e
+        self.labels = None
+
+    def label_matrix( self ):
+        # the label vectors as a LabelMatrix, rows in self.entries order. Built on
+        # first use and dropped by add_entry; set_label keeps it in step, but
+        # code changing self.entries or a label vector directly must call
+        # labels_changed()
+        if self.labels is None:
+            from cp6.tables.label_matrix import LabelMatrix
+            self.labels = LabelMatrix.from_entries( self.entries )
+        return self.labels
+
+    def labels_changed( self ):
+        self.labels = None
+
+    def set_label( self, mir_id, label_index, value ):
+        self.entries[ mir_id ].label_vector[ label_index ] = value
+        if self.labels is not None:
+            self.labels.values[ self.labels.rows_of( [mir_id] )[0], label_index ] = value
 
     def write_to_file( self, fn, filter_package = None ):
         write_label_vector_as_testing = False
         if filter_package is not None:
             write_label_vector_as_testing = filter_package[1]
 
+        if self.text == ImageTable.TEXT_DROP:
+            raise AssertionError( 'Image table was read without titles and descriptions; not writing %s' % fn )
         sys.stderr.write('Info: writing image table %s; label vectors as testing? %d\n' % (fn, write_label_vector_as_testing ))
         (c_total, c_written, c_neg2_but_not_testing) = (0,0,0)
-        with codecs.open( fn, 'w', encoding='UTF-8' ) as f:
+        with TableIO.open( fn, 'w', encoding='UTF-8' ) as f:
             for mir_id in sorted( self.entries ):
                 e = self.entries[ mir_id ]
                 c_total += 1
@@ -67,8 +107,9 @@ class ImageTable:
                 f.write( '%d ' % e.mir_id ) # 0
                 f.write( '%d ' % e.flickr_id ) # 1
                 f.write( '%s ' % Util.qstr( e.flickr_owner )) # 2
-                f.write( '%s ' % Util.qstr( e.flickr_title )) # 3
-                f.write( '%s ' % Util.qstr( e.flickr_descr )) # 4
+                (title, descr) = e.text_fields()
+                f.write( '%s ' % Util.qstr( title )) # 3
+                f.write( '%s ' % Util.qstr( descr )) # 4
 
                 f.write( '%s ' % e.exif_data.to_table_str() ) # 5,6,7
 
@@ -95,38 +136,128 @@ class ImageTable:
         return (c_total, c_written)
 
     @staticmethod
-    def read_from_file( fn, id_dict_to_keep=None ):
+    def entry_from_fields( fields, text=TEXT_FULL ):
+        # for TEXT_LAZY, fields 3 and 4 are still UTF-8 bytes
+        e = ImageTableEntry()
+        e.mir_id = int( fields[0] )
+        e.flickr_id = int( fields[1] )
+        e.flickr_owner = fields[2] if (fields[2] != 'none') else None
+        if text == ImageTable.TEXT_FULL:
+            e.flickr_title = fields[3] if (fields[3] != 'none') else None
+            e.flickr_descr = fields[4] if (fields[4] != 'none') else None
+        elif text == ImageTable.TEXT_LAZY:
+            e.raw_text = fields[3] + '\n' + fields[4]
+        if (fields[5] == 'none') and \
+           (fields[6] == 'none') and \
+           (fields[7] == 'U'):
+            e.exif_data = EXIFData( e.mir_id, False, 'none', 'none', 'U' )
+        else:
+            e.exif_data = EXIFData( e.mir_id, True, fields[5], fields[6], fields[7])
+        e.flickr_locality = fields[8] if fields[8] != 'none' else None
+        e.label_vector = map(int, fields[9].split(','))
+        return e
+
+    @staticmethod
+    def iter_entries( lines, where, id_dict_to_keep=None ):
+        # lines are unicode; where names the source in error messages
         c = 0
+        for raw_line in lines:
+            c += 1
+            fields = Util.qstr_split( raw_line.strip() )
+            if len(fields) != 10:
+                raise AssertionError( 'Image table %s:%d: found %d fields, expecting 10' % (where, c, len(fields)))
+            id = int( fields[0] )
+            if not ( (id_dict_to_keep is None) or (id in id_dict_to_keep) ):
+                continue
+            yield ImageTable.entry_from_fields( fields )
+
+    @staticmethod
+    def iter_entries_undecoded( lines, where, id_dict_to_keep, text ):
+        #
+        # iter_entries for TEXT_LAZY or TEXT_DROP: lines are UTF-8 bytes,
+        # tokenized as bytes (no multi-byte character contains a space, tab,
+        # or quote byte), and every field but the title and description is
+        # decoded.
+        #
+        c = 0
+        for raw_line in lines:
+            c += 1
+            fields = Util.qstr_split( raw_line.strip() )
+            if len(fields) != 10:
+                raise AssertionError( 'Image table %s:%d: found %d fields, expecting 10' % (where, c, len(fields)))
+            id = int( fields[0] )
+            if not ( (id_dict_to_keep is None) or (id in id_dict_to_keep) ):
+                continue
+            for i in (2, 5, 6, 7, 8):
+                fields[i] = fields[i].decode( 'utf-8' )
+            yield ImageTable.entry_from_fields( fields, text )
+
+    @staticmethod
+    def read_from_file( fn, id_dict_to_keep=None, n_workers=1, text=TEXT_FULL ):
+        # n_workers > 1 (or None, for one per CPU) parses the file in parallel;
+        # text is one of the TEXT_ modes above. Goes through the table cache
+        # (see table_cache.py) when it's enabled.
+        from cp6.utilities.table_cache import TableCache
+        if text not in (ImageTable.TEXT_FULL, ImageTable.TEXT_LAZY, ImageTable.TEXT_DROP):
+            raise AssertionError( 'Image table %s: unknown text mode %s' % (fn, text))
+        return TableCache.get( fn, 'image-table', (text, id_dict_to_keep),
+                               lambda: ImageTable.parse_file( fn, id_dict_to_keep, n_workers, text ))
+
+    @staticmethod
+    def parse_file( fn, id_dict_to_keep=None, n_workers=1, text=TEXT_FULL ):
         t = ImageTable()
-        with codecs.open( fn, 'r', encoding='utf-8' ) as f:
-            while 1:
-                raw_line = f.readline()
-                if not raw_line:
-                    break
-                c += 1
-                fields = Util.qstr_split( raw_line.strip() )
-                if len(fields) != 10:
-                    raise AssertionError( 'Image table %s:%d: found %d fields, expecting 10' % (fn, c, len(fields)))
-                id = int( fields[0] )
-                if not ( (id_dict_to_keep is None) or (id in id_dict_to_keep) ):
-                    continue
-                e = ImageTableEntry()
-                e.mir_id = int( id )
-                e.flickr_id = int( fields[1] )
-                e.flickr_owner = fields[2] if (fields[2] != 'none') else None
-                e.flickr_title = fields[3] if (fields[3] != 'none') else None
-                e.flickr_descr = fields[4] if (fields[4] != 'none') else None
-                if (fields[5] == 'none') and \
-                   (fields[6] == 'none') and \
-                   (fields[7] == 'U'):
-                    e.exif_data = EXIFData( e.mir_id, False, 'none', 'none', 'U' )
-                else:
-                    e.exif_data = EXIFData( e.mir_id, True, fields[5], fields[6], fields[7])
-                e.flickr_locality = fields[8] if fields[8] != 'none' else None
-                e.label_vector = map(int, fields[9].split(','))
-                t.add_entry( e )
+        t.text = text
+        if (n_workers is None) or (n_workers > 1):
+            if (id_dict_to_keep is not None) and not isinstance( id_dict_to_keep, (dict, set, frozenset) ):
+                id_dict_to_keep = set( id_dict_to_keep )
+            for entries in ChunkedReader.parallel_map( fn, read_image_chunk, n_workers, (id_dict_to_keep, text) ):
+                for e in entries:
+                    t.add_entry( e )
+            return t
+        if text == ImageTable.TEXT_FULL:
+            with TableIO.open_text( fn, 'utf-8' ) as f:
+                for e in ImageTable.iter_entries( f, fn, id_dict_to_keep ):
+                    t.add_entry( e )
+        else:
+            with TableIO.open( fn, 'rb' ) as f:
+                for e in ImageTable.iter_entries_undecoded( f, fn, id_dict_to_keep, text ):
+                    t.add_entry( e )
         return t
 
+    @staticmethod
+    def read_label_matrix( fn, id_dict_to_keep=None ):
+        # just the image IDs and label vectors of fn, as a LabelMatrix in file
+        # order; much faster than read_from_file when nothing else is needed
+        from cp6.tables.label_matrix import LabelMatrix
+        return LabelMatrix.read_from_file( fn, id_dict_to_keep )
+
+    @staticmethod
+    def get( fn, ids, text=TEXT_FULL ):
+        # an ImageTable of just those of ids in fn, seeking to their rows via the
+        # row index (see row_index.py); compressed tables are read in full
+        from cp6.tables.row_index import RowIndex
+        if not RowIndex.can_index( fn ):
+            return ImageTable.read_from_file( fn, set( ids ), text=text )
+        t = ImageTable()
+        t.text = text
+        lines = RowIndex.load( fn ).read_lines( ids )
+        where = '%s (indexed)' % fn
+        if text == ImageTable.TEXT_FULL:
+            entries = ImageTable.iter_entries( ( line.decode( 'utf-8' ) for line in lines ), where )
+        else:
+            entries = ImageTable.iter_entries_undecoded( lines, where, None, text )
+        for e in entries:
+            t.add_entry( e )
+        return t
+
+def read_image_chunk( fn, start, end, id_dict_to_keep, text ):
+    # ChunkedReader worker: one byte range of an image table -> list of ImageTableEntries
+    where = '%s bytes %d-%d' % (fn, start, end)
+    if text != ImageTable.TEXT_FULL:
+        return list( ImageTable.iter_entries_undecoded( ChunkedReader.iter_lines( fn, start, end ), where, id_dict_to_keep, text ))
+    lines = ( line.decode( 'utf-8' ) for line in ChunkedReader.iter_lines( fn, start, end ))
+    return list( ImageTable.iter_entries( lines, where, id_dict_to_keep ))
+
 
 if __name__ == '__main__':
     if len(sys.argv) != 3:
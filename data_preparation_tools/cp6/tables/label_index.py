@@ -0,0 +1,240 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## An inverted index of an image table's label vectors: for each label and
+## each label value (1, 0, -1, -2), the sorted IDs of the images with that
+## value. It lives in a sidecar directory next to the table
+## (<table>.labels):
+##
+## images       int64    all image IDs, sorted
+## postings     int64    the posting lists, one after another
+## indptr       int64    list (label j, VALUES[k]) is postings[ indptr[4j+k] : indptr[4j+k+1] ]
+## labels.txt            format version and the table's size and mtime
+##
+## and is rebuilt when the table changes (see Sidecar.) Queries are set
+## operations on sorted arrays, e.g.
+##
+##   LabelIndex.load( fn ).query( 'sea AND NOT structures', label2id )
+##
+## Query syntax: a term is a label name (the images where it is 1) or
+## name=value for another value; terms combine with NOT, AND, OR (in that
+## order of precedence) and parentheses. Names with spaces or parentheses
+## are double-quoted.
+##
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from cp6.utilities.sidecar import Sidecar
+from cp6.utilities.util import Util
+from cp6.tables.label_matrix import LabelMatrix
+
+class LabelIndex:
+
+    VERSION = 1
+    STAMP = 'labels.txt'
+    VALUES = (1, 0, -1, -2)
+    ARRAYS = ('images', 'postings', 'indptr')
+
+    # fn -> (fingerprint, LabelIndex) for indices whose sidecar couldn't be written
+    unsaved = dict()
+
+    def __init__( self, fn, arrays ):
+        self.fn = fn
+        self.images = arrays['images']
+        self.postings = arrays['postings']
+        self.indptr = arrays['indptr']
+
+    def __len__( self ):
+        return len( self.images )
+
+    def n_labels( self ):
+        return ( len( self.indptr ) - 1 ) // len( LabelIndex.VALUES )
+
+    @staticmethod
+    def index_dir( fn ):
+        return fn + '.labels'
+
+    @staticmethod
+    def build( fn ):
+        t_start = time.time()
+        m = LabelMatrix.read_from_file( fn )
+        order = np.argsort( m.ids, kind='mergesort' )
+        (images, values) = (m.ids[ order ], m.values[ order ])
+        unknown = ~np.in1d( values, LabelIndex.VALUES ).reshape( values.shape )
+        if unknown.any():
+            (row, label) = [ x[0] for x in np.nonzero( unknown ) ]
+            raise AssertionError( '%s: image %d label %d has value %d; expecting one of %s' % \
+                                  (fn, images[ row ], label, values[ row, label ], LabelIndex.VALUES ))
+        (lists, indptr) = (list(), [0])
+        for j in range( m.n_labels() if len( m ) else 0 ):
+            column = values[ :, j ]
+            for v in LabelIndex.VALUES:
+                lists.append( images[ column == v ] )
+                indptr.append( indptr[-1] + len( lists[-1] ))
+        arrays = { 'images': images, \
+                   'postings': np.concatenate( lists ) if lists else np.zeros( 0, dtype=np.int64 ), \
+                   'indptr': np.array( indptr, dtype=np.int64 ) }
+
+        t = LabelIndex( fn, arrays )
+        if Sidecar.write_arrays( LabelIndex.index_dir( fn ), arrays, LabelIndex.STAMP, fn, LabelIndex.VERSION ):
+            LabelIndex.unsaved.pop( fn, None )
+        else:
+            LabelIndex.unsaved[ fn ] = (Sidecar.fingerprint( fn ), t)
+        sys.stderr.write('Info: indexed %d labels of %d images from %s in %f seconds\n' % \
+                         (( len( indptr ) - 1 ) // len( LabelIndex.VALUES ), len( images ), fn, time.time() - t_start))
+        return t
+
+    @staticmethod
+    def is_fresh( fn ):
+        return Sidecar.is_fresh( os.path.join( LabelIndex.index_dir( fn ), LabelIndex.STAMP ), fn, LabelIndex.VERSION )
+
+    @staticmethod
+    def load( fn, rebuild=True ):
+        # the index for fn, (re)built first if missing or stale (unless rebuild is False);
+        # one built in memory for an unwritable sidecar is reused while fn is unchanged
+        if LabelIndex.unsaved.get( fn, (None,) )[0] == Sidecar.fingerprint( fn ):
+            return LabelIndex.unsaved[ fn ][1]
+        if not LabelIndex.is_fresh( fn ):
+            if not rebuild:
+                raise AssertionError( '%s: label index is missing or out of date' % fn )
+            return LabelIndex.build( fn )
+        idx_dir = LabelIndex.index_dir( fn )
+        arrays = dict()
+        for name in LabelIndex.ARRAYS:
+            arrays[ name ] = np.load( os.path.join( idx_dir, '%s.npy' % name ), mmap_mode='r' )
+        return LabelIndex( fn, arrays )
+
+    #
+    # queries
+    #
+
+    def slot( self, label_index, value ):
+        if not (0 <= label_index < self.n_labels()):
+            raise AssertionError( '%s: no label %d; the table has %d' % (self.fn, label_index, self.n_labels()))
+        if value not in LabelIndex.VALUES:
+            raise AssertionError( 'Label value %s is not one of %s' % (value, LabelIndex.VALUES))
+        return label_index * len( LabelIndex.VALUES ) + LabelIndex.VALUES.index( value )
+
+    def ids_with( self, label_index, value=1 ):
+        # sorted IDs of the images whose label label_index is value
+        k = self.slot( label_index, value )
+        return self.postings[ self.indptr[k] : self.indptr[k+1] ]
+
+    def count( self, label_index, value=1 ):
+        k = self.slot( label_index, value )
+        return int( self.indptr[k+1] - self.indptr[k] )
+
+    def counts( self, value=1 ):
+        # per label, the number of images with value
+        k = LabelIndex.VALUES.index( value )
+        return np.diff( self.indptr )[ k::len( LabelIndex.VALUES ) ]
+
+    @staticmethod
+    def tokenize( expr ):
+        # parentheses are tokens of their own, outside quoted names
+        (spaced, quoted) = (list(), False)
+        for c in expr:
+            if c == '"':
+                quoted = not quoted
+            spaced.append( ' %s ' % c if (c in '()') and not quoted else c )
+        return Util.qstr_split( ''.join( spaced ))
+
+    def query( self, expr, label2id ):
+        # sorted IDs of the images matching expr (see the top of this file); label2id maps names to indices
+        tokens = LabelIndex.tokenize( expr )
+        (ids, pos) = self.parse_or( tokens, 0, label2id )
+        if pos != len( tokens ):
+            raise AssertionError( "Label query '%s': unexpected '%s'" % (expr, tokens[pos] ))
+        return ids
+
+    def parse_or( self, tokens, pos, label2id ):
+        (ids, pos) = self.parse_and( tokens, pos, label2id )
+        while (pos < len(tokens)) and (tokens[pos].upper() == 'OR'):
+            (rhs, pos) = self.parse_and( tokens, pos+1, label2id )
+            ids = np.union1d( ids, rhs )
+        return (ids, pos)
+
+    def parse_and( self, tokens, pos, label2id ):
+        (ids, pos) = self.parse_not( tokens, pos, label2id )
+        while (pos < len(tokens)) and (tokens[pos].upper() == 'AND'):
+            # 'a AND NOT b' is a difference, not an intersection with a complement
+            if (pos+1 < len(tokens)) and (tokens[pos+1].upper() == 'NOT'):
+                (rhs, pos) = self.parse_not( tokens, pos+2, label2id )
+                ids = np.setdiff1d( ids, rhs, assume_unique=True )
+            else:
+                (rhs, pos) = self.parse_not( tokens, pos+1, label2id )
+                ids = np.intersect1d( ids, rhs, assume_unique=True )
+        return (ids, pos)
+
+    def parse_not( self, tokens, pos, label2id ):
+        if pos == len(tokens):
+            raise AssertionError( 'Label query ends early' )
+        if tokens[pos].upper() == 'NOT':
+            (ids, pos) = self.parse_not( tokens, pos+1, label2id )
+            return (np.setdiff1d( self.images, ids, assume_unique=True ), pos)
+        if tokens[pos] == '(':
+            (ids, pos) = self.parse_or( tokens, pos+1, label2id )
+            if (pos == len(tokens)) or (tokens[pos] != ')'):
+                raise AssertionError( 'Label query: missing )' )
+            return (ids, pos+1)
+        (name, value) = (tokens[pos], '1')
+        if (name not in label2id) and ('=' in name):
+            (name, value) = name.rsplit( '=', 1 )
+        elif (pos+1 < len(tokens)) and tokens[pos+1].startswith( '=' ):
+            # "plant life"=-1 splits after the quote
+            pos += 1
+            value = tokens[pos][1:]
+        if name not in label2id:
+            raise AssertionError( "Label query: unknown label '%s'" % name )
+        if value.lstrip( '-' ) not in ('0', '1', '2'):
+            raise AssertionError( "Label query: bad value '%s' for label '%s'" % (value, name ))
+        return (np.asarray( self.ids_with( label2id[ name ], int( value ))), pos+1)
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        sys.stderr.write('Usage: $0 image-table label-table [query]\n')
+        sys.stderr.write('  With no query, prints the count of each label value; with one, the matching image IDs.\n')
+        sys.exit(0)
+    index = LabelIndex.load( sys.argv[1] )
+    (id2label, label2id) = Util.read_label_table( sys.argv[2] )
+    if len(sys.argv) == 4:
+        for id in index.query( sys.argv[3], label2id ):
+            sys.stdout.write( '%d\n' % id )
+    else:
+        sys.stdout.write( 'label %s\n' % ' '.join( map( str, LabelIndex.VALUES )))
+        for j in range( index.n_labels() ):
+            sys.stdout.write( '%s %s\n' % (Util.qstr( id2label.get( j, str(j) )), \
+                                           ' '.join( str( index.count( j, v )) for v in LabelIndex.VALUES )))
@@ -0,0 +1,174 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## The label vectors of an image table (field 9) as one matrix:
+##
+## ids     int64   image IDs, one per row
+## values  values[i, j] is label j of image ids[i]; int8 for the
+##                 1 / 0 / -1 / -2 truth flags, float64 for scores
+##
+## Per-label questions (how many images have label j? which ones?) become
+## column operations instead of loops over ImageTableEntries. Rows follow
+## the file order when read from a table, or the iteration order of the
+## entries dict when built from an ImageTable (see ImageTable.label_matrix.)
+##
+
+import os
+import sys
+
+import numpy as np
+
+from cp6.utilities.table_cache import TableCache
+from cp6.utilities.table_io import TableIO
+
+class LabelMatrix:
+
+    def __init__( self, ids, values ):
+        self.ids = ids
+        self.values = values
+        self.index = None  # (sorted ids, their rows); built by rows_of
+
+    def __len__( self ):
+        return len( self.ids )
+
+    def n_labels( self ):
+        return self.values.shape[1]
+
+    def column( self, label_index ):
+        return self.values[ :, label_index ]
+
+    def counts( self, flag=1 ):
+        # per label, the number of images whose label is flag
+        return ( self.values == flag ).sum( axis=0 )
+
+    def ids_with( self, label_index, flag=1 ):
+        # IDs of the images whose label label_index is flag, in row order
+        return self.ids[ self.column( label_index ) == flag ]
+
+    def rows_of( self, image_ids ):
+        # row of each image ID, or -1 if the matrix has no row for it
+        image_ids = np.asarray( image_ids, dtype=np.int64 )
+        if len( self.ids ) == 0:
+            return np.zeros( len(image_ids), dtype=np.int64 ) - 1
+        if self.index is None:
+            order = np.argsort( self.ids, kind='mergesort' )
+            self.index = ( self.ids[ order ], order )
+        (sorted_ids, order) = self.index
+        pos = np.searchsorted( sorted_ids, image_ids )
+        pos[ pos == len( sorted_ids ) ] = 0
+        return np.where( sorted_ids[ pos ] == image_ids, order[ pos ], -1 )
+
+    @staticmethod
+    def from_entries( entries, dtype=np.int8 ):
+        # entries: dict of mir_id -> ImageTableEntry, as in ImageTable.entries
+        ids = np.fromiter( entries.iterkeys(), dtype=np.int64, count=len(entries) )
+        if len(ids) == 0:
+            return LabelMatrix( ids, np.zeros( (0, 0), dtype=dtype ))
+        values = np.array( [ e.label_vector for e in entries.itervalues() ], dtype=dtype )
+        if values.ndim != 2:
+            raise AssertionError( 'Image table label vectors are not all the same length' )
+        return LabelMatrix( ids, values )
+
+    @staticmethod
+    def parse_fields( id_strs, label_strs, where, dtype=np.int8 ):
+        # id_strs and label_strs: fields 0 and 9 of each line
+        n = len( id_strs )
+        if n == 0:
+            return LabelMatrix( np.zeros( 0, dtype=np.int64 ), np.zeros( (0, 0), dtype=dtype ))
+        n_labels = label_strs[0].count( ',' ) + 1
+        for (i, s) in enumerate( label_strs ):
+            if s.count( ',' ) + 1 != n_labels:
+                raise AssertionError( 'Image table %s: entry %d (image %s) has %d labels; expecting %d' % \
+                                      (where, i+1, id_strs[i], s.count( ',' ) + 1, n_labels ))
+
+        # np.fromstring stops quietly at the first bad token, so check the counts
+        ids = np.fromstring( ' '.join( id_strs ), dtype=np.int64, sep=' ' )
+        if len(ids) != n:
+            raise AssertionError( 'Image table %s: bad image ID %s' % (where, id_strs[ len(ids) ] ))
+        sorted_ids = np.sort( ids, kind='mergesort' )
+        dupes = np.flatnonzero( sorted_ids[1:] == sorted_ids[:-1] )
+        if len(dupes):
+            raise AssertionError( 'Double-add of %d in image table %s' % (sorted_ids[ dupes[0] ], where ))
+        is_int = np.issubdtype( dtype, np.integer )
+        flat = np.fromstring( ','.join( label_strs ), dtype=np.int64 if is_int else np.float64, sep=',' )
+        if len(flat) != n * n_labels:
+            bad = len(flat) // n_labels
+            raise AssertionError( 'Image table %s: entry %d (image %s): bad label vector %s' % \
+                                  (where, bad+1, id_strs[bad], label_strs[bad] ))
+        if is_int and len(flat):
+            info = np.iinfo( dtype )
+            if (flat.min() < info.min) or (flat.max() > info.max):
+                raise AssertionError( 'Image table %s: label values outside %s' % (where, np.dtype( dtype ).name ))
+        return LabelMatrix( ids, flat.reshape( n, n_labels ).astype( dtype ))
+
+    def write_to_dir( self, d ):
+        np.save( os.path.join( d, 'ids.npy' ), self.ids )
+        np.save( os.path.join( d, 'values.npy' ), self.values )
+
+    @staticmethod
+    def read_from_dir( d ):
+        # copy-on-write maps: callers may overwrite values (cp6_eval's random mode)
+        return LabelMatrix( np.load( os.path.join( d, 'ids.npy' ), mmap_mode='c' ),
+                            np.load( os.path.join( d, 'values.npy' ), mmap_mode='c' ))
+
+    @staticmethod
+    def read_from_file( fn, id_dict_to_keep=None, dtype=np.int8 ):
+        return TableCache.get( fn, 'label-matrix', (np.dtype( dtype ).name, id_dict_to_keep),
+                               lambda: LabelMatrix.parse_file( fn, id_dict_to_keep, dtype ),
+                               store=lambda m, d: m.write_to_dir( d ),
+                               load=LabelMatrix.read_from_dir )
+
+    @staticmethod
+    def parse_file( fn, id_dict_to_keep=None, dtype=np.int8 ):
+        # only fields 0 and 9 of the image table fn: the image ID is the first
+        # token and the label vector the last, so the quoted fields in between
+        # never need to be tokenized
+        (id_strs, label_strs) = (list(), list())
+        with TableIO.open( fn ) as f:
+            for (line_no, line) in enumerate( f, 1 ):
+                tokens = line.split( None, 1 )
+                if len(tokens) != 2:
+                    raise AssertionError( 'Image table %s:%d: expecting 10 fields' % (fn, line_no ))
+                if (id_dict_to_keep is not None) and (int( tokens[0] ) not in id_dict_to_keep):
+                    continue
+                id_strs.append( tokens[0] )
+                label_strs.append( tokens[1].rsplit( None, 1 )[-1] )
+        return LabelMatrix.parse_fields( id_strs, label_strs, fn, dtype )
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.stderr.write('Usage: $0 image-table\n')
+        sys.exit(0)
+    m = LabelMatrix.read_from_file( sys.argv[1] )
+    sys.stderr.write('Info: %d images x %d labels\n' % (len(m), m.n_labels()))
+    for (flag, name) in ((1, 'yes'), (0, 'no'), (-1, 'ignore'), (-2, 'testing')):
+        sys.stdout.write('%s %s\n' % (name, ' '.join( map( str, m.counts( flag )))))
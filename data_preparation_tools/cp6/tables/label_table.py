@@ -32,6 +32,7 @@
 import sys
 
 from cp6.utilities.util import Util
+from cp6.utilities.table_io import TableIO
 
 class LabelTable:
     def __init__( self, L2I, I2L ):
@@ -43,7 +44,7 @@ class LabelTable:
         return len( self.idset )
 
     def write_to_file( self, fn ):
-        with open( fn, 'w' ) as f:
+        with TableIO.open( fn, 'w' ) as f:
             for index in self.idset:
                 f.write( '%d %s\n' % ( index, Util.qstr( self.id2label[index] )))
 
@@ -60,7 +61,7 @@ class LabelTable:
     def read_from_file( fn ):
         L2I = dict()
         I2L = dict()
-        with open( fn, 'r' ) as f:
+        with TableIO.open( fn, 'r' ) as f:
             while 1:
                 raw_line = f.readline()
                 if not raw_line:
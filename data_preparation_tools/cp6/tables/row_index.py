@@ -0,0 +1,159 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## A row index for a line table keyed by an integer ID in its first field
+## (image tables, image indicator tables): a sidecar directory next to the
+## table (<table>.rows) holding
+##
+## ids          int64    sorted IDs
+## offsets      int64    offsets[i] is the byte offset of the line for ids[i]
+## rows.txt              format version and the table's size and mtime
+##
+## built in one pass over the table. Looking up a few IDs is then a binary
+## search over the memory-mapped ids and a seek per line, instead of
+## parsing the whole table. The sidecar is rebuilt when the table changes
+## (see Sidecar.) Compressed tables can't be seeked into and aren't indexed.
+##
+
+import os
+import sys
+import time
+from array import array
+
+import numpy as np
+
+from cp6.utilities.sidecar import Sidecar
+from cp6.utilities.table_io import TableIO
+
+class RowIndex:
+
+    VERSION = 1
+    STAMP = 'rows.txt'
+
+    # fn -> (fingerprint, RowIndex), so repeated lookups skip re-opening the sidecar
+    loaded = dict()
+
+    def __init__( self, fn, ids, offsets ):
+        self.fn = fn
+        self.ids = ids
+        self.offsets = offsets
+
+    def __len__( self ):
+        return len( self.ids )
+
+    @staticmethod
+    def index_dir( fn ):
+        return fn + '.rows'
+
+    @staticmethod
+    def can_index( fn ):
+        return os.path.isfile( fn ) and not TableIO.compression( fn )
+
+    @staticmethod
+    def scan( fn ):
+        # (ids, offsets) for the table fn, sorted by ID
+        (ids, offsets) = (array('l'), array('l'))
+        pos = 0
+        with open( fn, 'rb' ) as f:
+            for line in f:
+                fields = line.split( None, 1 )
+                if fields:
+                    ids.append( int(fields[0]) )
+                    offsets.append( pos )
+                pos += len( line )
+        ids = np.frombuffer( ids, dtype=np.int_ ).astype( np.int64 )
+        offsets = np.frombuffer( offsets, dtype=np.int_ ).astype( np.int64 )
+        order = np.argsort( ids, kind='mergesort' )
+        (ids, offsets) = (ids[order], offsets[order])
+        dupes = np.flatnonzero( ids[1:] == ids[:-1] )
+        if len(dupes):
+            raise AssertionError( '%s: ID %d appears more than once' % (fn, ids[ dupes[0] ] ))
+        return (ids, offsets)
+
+    @staticmethod
+    def build( fn ):
+        if not RowIndex.can_index( fn ):
+            raise AssertionError( '%s: only uncompressed tables can be row-indexed' % fn )
+        t_start = time.time()
+        (ids, offsets) = RowIndex.scan( fn )
+
+        Sidecar.write_arrays( RowIndex.index_dir( fn ), { 'ids': ids, 'offsets': offsets }, RowIndex.STAMP, fn, RowIndex.VERSION )
+        sys.stderr.write('Info: indexed %d rows of %s in %f seconds\n' % (len(ids), fn, time.time() - t_start))
+        t = RowIndex( fn, ids, offsets )
+        RowIndex.loaded[ fn ] = (Sidecar.fingerprint( fn ), t)
+        return t
+
+    @staticmethod
+    def is_fresh( fn ):
+        return Sidecar.is_fresh( os.path.join( RowIndex.index_dir( fn ), RowIndex.STAMP ), fn, RowIndex.VERSION )
+
+    @staticmethod
+    def load( fn, rebuild=True ):
+        # the index for fn, (re)built first if missing or stale (unless rebuild is False);
+        # one built in memory for an unwritable sidecar is reused while fn is unchanged
+        fingerprint = Sidecar.fingerprint( fn )
+        if RowIndex.loaded.get( fn, (None,) )[0] == fingerprint:
+            return RowIndex.loaded[ fn ][1]
+        if not RowIndex.is_fresh( fn ):
+            if not rebuild:
+                raise AssertionError( '%s: row index is missing or out of date' % fn )
+            return RowIndex.build( fn )
+        idx_dir = RowIndex.index_dir( fn )
+        RowIndex.loaded[ fn ] = (fingerprint, RowIndex( fn, np.load( os.path.join( idx_dir, 'ids.npy' ), mmap_mode='r' ), \
+                                                        np.load( os.path.join( idx_dir, 'offsets.npy' ), mmap_mode='r' )))
+        return RowIndex.loaded[ fn ][1]
+
+    def offsets_of( self, ids ):
+        # byte offset of the line for each ID, or -1 if the table has no such ID
+        ids = np.asarray( ids, dtype=np.int64 )
+        if len( self.ids ) == 0:
+            return np.zeros( len(ids), dtype=np.int64 ) - 1
+        i = np.searchsorted( self.ids, ids )
+        i[ i == len( self.ids ) ] = 0
+        return np.where( self.ids[ i ] == ids, self.offsets[ i ], -1 )
+
+    def read_lines( self, ids ):
+        # the lines (byte strings) for those of ids in the table, in file order
+        offsets = self.offsets_of( ids )
+        lines = list()
+        with open( self.fn, 'rb' ) as f:
+            for offset in np.unique( offsets[ offsets >= 0 ] ).tolist():
+                f.seek( offset )
+                lines.append( f.readline() )
+        return lines
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.stderr.write('Usage: $0 table id [id ...]\n')
+        sys.exit(0)
+    for line in RowIndex.load( sys.argv[1] ).read_lines( map( int, sys.argv[2:] )):
+        sys.stdout.write( line )
@@ -0,0 +1,114 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Parse a large line-oriented table in parallel: split the file into
+## byte ranges which start and end on line boundaries, parse each range in
+## a worker process, and return the per-range results in file order.
+##
+## Compressed files (see table_io.py) can't be split by byte offset, so
+## they're parsed as a single range.
+##
+
+import os
+import sys
+import multiprocessing
+
+from cp6.utilities.table_io import TableIO
+
+class ChunkedReader:
+
+    # ranges per worker; more than one evens out the load when rows vary in length
+    CHUNKS_PER_WORKER = 4
+
+    @staticmethod
+    def byte_ranges( fn, n_chunks ):
+        # list of (start, end) byte offsets, each starting at a line start
+        if TableIO.compression( fn ):
+            return [ (0, sys.maxint) ]
+        size = os.path.getsize( fn )
+        bounds = [0]
+        with open( fn, 'rb' ) as f:
+            for k in range( 1, n_chunks ):
+                target = size * k / n_chunks
+                if target <= bounds[-1]:
+                    continue
+                f.seek( target-1 )
+                # if target-1 is a newline, target is already a line start
+                f.readline()
+                pos = f.tell()
+                if bounds[-1] < pos < size:
+                    bounds.append( pos )
+        bounds.append( size )
+        return [ (bounds[i], bounds[i+1]) for i in range( 0, len(bounds)-1 ) if bounds[i] < bounds[i+1] ]
+
+    @staticmethod
+    def iter_lines( fn, start, end ):
+        # the lines of fn starting in [start, end), as byte strings
+        with TableIO.open( fn, 'rb' ) as f:
+            if start > 0:
+                f.seek( start )
+            pos = start
+            while pos < end:
+                line = f.readline()
+                if not line:
+                    break
+                pos += len( line )
+                yield line
+
+    @staticmethod
+    def default_workers():
+        return multiprocessing.cpu_count()
+
+    @staticmethod
+    def parallel_map( fn, parse_chunk, n_workers, extra_args = () ):
+        #
+        # Call parse_chunk( fn, start, end, *extra_args ) for each byte range
+        # of fn and return the results in file order. parse_chunk must be a
+        # module-level function so it can be pickled; extra_args are sent
+        # to every worker (this is how ID filters get pushed down.)
+        #
+        if n_workers is None:
+            n_workers = ChunkedReader.default_workers()
+        ranges = ChunkedReader.byte_ranges( fn, max( 1, n_workers * ChunkedReader.CHUNKS_PER_WORKER ))
+        jobs = [ (parse_chunk, fn, start, end, tuple( extra_args )) for (start, end) in ranges ]
+        if n_workers <= 1:
+            return [ _run_chunk( j ) for j in jobs ]
+        pool = multiprocessing.Pool( n_workers )
+        try:
+            return pool.map( _run_chunk, jobs, chunksize=1 )
+        finally:
+            pool.close()
+            pool.join()
+
+def _run_chunk( job ):
+    (parse_chunk, fn, start, end, extra_args) = job
+    return parse_chunk( fn, start, end, *extra_args )
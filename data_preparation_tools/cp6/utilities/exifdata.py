@@ -38,25 +38,80 @@ import sys
 import re
 import datetime
 
-class EXIFData:
+class EXIFData( object ):
+    #
+    # One per image, so kept small: the date and time are stored as the
+    # integers YYYYMMDD and HHMMSS (date 0 when invalid) and the flash as
+    # one of the FLASH_ codes; the string forms (exif_date, exif_time,
+    # exif_flash) and exif_caldate are rebuilt when asked for. A date or
+    # time not in the canonical YYYY:MM:DD / HH:MM:SS form is kept verbatim
+    # in text, so to_table_str still writes back what was read.
+    #
+
+    __slots__ = ( 'mir_id', 'date', 'time', 'flash', 'text' )
+
+    (FLASH_UNKNOWN, FLASH_NO, FLASH_YES) = (0, 1, 2)
+    FLASH_CODES = 'UNY'
+
+    DATE_RE = re.compile( r'(\d{4}):(\d{2}):(\d{2})' )
+    TIME_RE = re.compile( r'(\d{2}):(\d{2}):(\d{2})\Z' )
+
     def __init__( self, id, v, edate, etime, eflash ):
         self.mir_id = id
-        self.valid = v
-        if not self.valid:
+        (self.date, self.time, self.flash, self.text) = (0, 0, EXIFData.FLASH_UNKNOWN, None)
+        if not v:
             return
-        self.exif_date = edate
-        self.exif_time = etime
-        self.exif_flash = eflash
-        m = re.search( '(\d{4}):(\d{2}):(\d{2})', edate )
+        m = EXIFData.DATE_RE.search( edate )
         if m:
             try:
-                self.exif_caldate = datetime.date( int( m.group(1) ), int( m.group(2) ), int(m.group(3) ))
+                datetime.date( int( m.group(1) ), int( m.group(2) ), int(m.group(3) ))
+                self.date = int( m.group(1) + m.group(2) + m.group(3) )
             except ValueError as e:
                 sys.stderr.write( "WARN: Couldn't construct date from '%s' in %d: %s; skipping\n" % (edate, id, e))
-                self.valid = False
+                return
         else:
             sys.stderr.write( "WARN: Couldn't parse edate %s in id %d; skipping\n" % (edate, id ) )
-            self.valid = False
+            return
+        t = EXIFData.TIME_RE.match( etime )
+        if t:
+            self.time = int( t.group(1) + t.group(2) + t.group(3) )
+        flash = EXIFData.FLASH_CODES.find( eflash ) if len( eflash ) == 1 else -1
+        if flash >= 0:
+            self.flash = flash
+        if (m.group(0) != edate) or (not t) or (flash < 0):
+            self.text = (edate, etime, eflash)
+
+    def __getstate__( self ):
+        return (self.mir_id, self.date, self.time, self.flash, self.text)
+
+    def __setstate__( self, state ):
+        (self.mir_id, self.date, self.time, self.flash, self.text) = state
+
+    @property
+    def valid( self ):
+        return self.date != 0
+
+    @property
+    def exif_date( self ):
+        if self.text:
+            return self.text[0]
+        return '%04d:%02d:%02d' % (self.date // 10000, self.date // 100 % 100, self.date % 100)
+
+    @property
+    def exif_time( self ):
+        if self.text:
+            return self.text[1]
+        return '%02d:%02d:%02d' % (self.time // 10000, self.time // 100 % 100, self.time % 100)
+
+    @property
+    def exif_flash( self ):
+        if self.text:
+            return self.text[2]
+        return EXIFData.FLASH_CODES[ self.flash ]
+
+    @property
+    def exif_caldate( self ):
+        return datetime.date( self.date // 10000, self.date // 100 % 100, self.date % 100 )
 
     def __str__( self ):
         if self.valid:
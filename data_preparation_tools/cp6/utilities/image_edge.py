@@ -49,6 +49,9 @@ class ImageEdge:
         self.same_location_flag = same_location
         self.shared_contact_flag = shared_contact
 
+    n_shared_groups = property( lambda self: len( self.shared_groups ))
+    n_shared_words = property( lambda self: len( self.shared_words ))
+
     @classmethod
     def from_data( cls, imgIndA, imgIndB, sharedGroups, sharedWords, \
                    same_user, same_location, shared_contact):
@@ -87,6 +90,11 @@ class ImageEdge:
             imgIndB.word_keys = set(imgIndB.word_list.keys())
         return list( imgIndA.word_keys & imgIndB.word_keys )
 
+    @staticmethod
+    def parse_list( s ):
+        # a comma list field from the edge table; 'none' is the empty list
+        return [int(x) for x in s.split(',')] if s != 'none' else list()
+
     @staticmethod
     def canonical_flag( s ):
         if (s == '0') or (s == '1') or (s == '.'):
@@ -104,10 +112,81 @@ class ImageEdge:
 
     @staticmethod
     def edges_in_nodeset( paths, phase_key, nodes ):
+        # the edges among nodes, via the table's per-node index (built on first use)
+        from cp6.tables.edge_index import EdgeIndex
         fn = paths.phase_tables[phase_key].image_edge_table
-        node_id_dict = dict( [id, True] for id in nodes)
-        (nodes, edges) = CP6ImageEdge.read_edges_from_file( fn, node_id_dict )
+        edges = EdgeIndex.load( fn ).induced_subgraph( nodes )
         sys.stderr.write('Info: read %d edges\n' % len(edges))
         return edges
 
-
+class LazyImageEdge( object ):
+    #
+    # An ImageEdge read with only some columns decoded (see the columns
+    # argument to EdgeTable.read_from_file.) The endpoints, counts, and
+    # flags are always parsed; the three comma lists are kept as the raw
+    # field strings and only split into ints the first time they're read.
+    #
+
+    LISTS = ( 'shared_groups', 'shared_words', 'shared_word_types' )
+
+    __slots__ = ( 'image_A_id', 'image_B_id', 'n_shared_groups', 'n_shared_words', \
+                  'same_user_flag', 'same_location_flag', 'shared_contact_flag', \
+                  '_groups', '_words', '_word_types' )
+
+    def __init__( self, fields, columns = () ):
+        self.image_A_id = int( fields[0] )
+        self.image_B_id = int( fields[1] )
+        self.n_shared_groups = int( fields[2] )
+        self.n_shared_words = int( fields[3] )
+        (self._groups, self._words, self._word_types) = (fields[4], fields[5], fields[6])
+        (self.same_user_flag, self.same_location_flag, self.shared_contact_flag) = (fields[7], fields[8], fields[9])
+        for c in columns:
+            if c in LazyImageEdge.LISTS:
+                getattr( self, c )
+
+    # raw strings (str) are decoded and replaced by the list on first
+    # access; assigning a list also updates the matching count
+
+    def _list_property( slot, count_slot ):
+        def get_list( self ):
+            v = getattr( self, slot )
+            if isinstance( v, str ):
+                v = ImageEdge.parse_list( v )
+                setattr( self, slot, v )
+            return v
+        def set_list( self, v ):
+            setattr( self, slot, v )
+            if count_slot is not None:
+                setattr( self, count_slot, len( v ))
+        return property( get_list, set_list )
+
+    shared_groups = _list_property( '_groups', 'n_shared_groups' )
+    shared_words = _list_property( '_words', 'n_shared_words' )
+    shared_word_types = _list_property( '_word_types', None )
+    del _list_property
+
+    def raw_list( self, name ):
+        # the list column as it would appear in the edge table, without decoding it
+        v = getattr( self, { 'shared_groups': '_groups', 'shared_words': '_words', 'shared_word_types': '_word_types' }[ name ] )
+        if isinstance( v, str ):
+            return v
+        return ','.join( map( str, v )) if len( v ) else 'none'
+
+    def list_len( self, name ):
+        # len( getattr( self, name )), without decoding it
+        raw = self.raw_list( name )
+        return 0 if raw == 'none' else raw.count( ',' ) + 1
+
+    def to_image_edge( self ):
+        return ImageEdge( self.image_A_id, self.image_B_id, \
+                          self.shared_groups, self.shared_words, self.shared_word_types, \
+                          self.same_user_flag, self.same_location_flag, self.shared_contact_flag )
+
+    # __slots__ classes need these to be pickled by protocols 0 and 1
+
+    def __getstate__( self ):
+        return tuple( getattr( self, k ) for k in LazyImageEdge.__slots__ )
+
+    def __setstate__( self, state ):
+        for (k, v) in zip( LazyImageEdge.__slots__, state ):
+            setattr( self, k, v )
@@ -29,15 +29,69 @@
 # Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
 #
 
-class ImageTableEntry:
+class ImageTableEntry( object ):
+
+    #
+    # One per image; slots instead of a per-instance __dict__. The title and
+    # description may be held undecoded (see ImageTable.TEXT_LAZY): raw_text
+    # is then the UTF-8 bytes of fields 3 and 4 joined by a newline, decoded
+    # into title_text and descr_text on first use of flickr_title or
+    # flickr_descr.
+    #
+
+    __slots__ = ( 'mir_id', 'flickr_id', 'flickr_owner', 'title_text', 'descr_text', \
+                  'exif_data', 'flickr_locality', 'label_vector', 'raw_text' )
 
     def __init__( self ):
         self.mir_id = None
         self.flickr_id = None
         self.flickr_owner = None
-        self.flickr_title = None
-        self.flickr_descr = None
+        self.title_text = None
+        self.descr_text = None
         self.exif_data = None
         self.flickr_locality = None
         self.label_vector = None
+        self.raw_text = None
+
+    def __getstate__( self ):
+        return tuple( getattr( self, k ) for k in ImageTableEntry.__slots__ )
+
+    def __setstate__( self, state ):
+        for (k, v) in zip( ImageTableEntry.__slots__, state ):
+            setattr( self, k, v )
+
+    @staticmethod
+    def decode_field( s ):
+        return s.decode( 'utf-8' ) if s != 'none' else None
+
+    def text_fields( self ):
+        # (title, descr), decoding raw_text without keeping the result
+        if self.raw_text is None:
+            return (self.title_text, self.descr_text)
+        (title, descr) = self.raw_text.split( '\n', 1 )
+        return (ImageTableEntry.decode_field( title ), ImageTableEntry.decode_field( descr ))
+
+    def decode_text( self ):
+        if self.raw_text is not None:
+            (self.title_text, self.descr_text) = self.text_fields()
+            self.raw_text = None
+
+    @property
+    def flickr_title( self ):
+        self.decode_text()
+        return self.title_text
+
+    @flickr_title.setter
+    def flickr_title( self, v ):
+        self.decode_text()
+        self.title_text = v
+
+    @property
+    def flickr_descr( self ):
+        self.decode_text()
+        return self.descr_text
 
+    @flickr_descr.setter
+    def flickr_descr( self, v ):
+        self.decode_text()
+        self.descr_text = v
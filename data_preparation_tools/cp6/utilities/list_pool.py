@@ -0,0 +1,133 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Interned integer lists. Many edges share exactly the same group or
+## word list (one owner's tag boilerplate, say); a ListPool keeps each
+## distinct list once, as a tuple, and hands out integer handles to it.
+## Handle 0 is always the empty list.
+##
+## Lists are interned either by value or by their edge table text (the
+## comma list, or 'none'), which skips parsing repeats altogether.
+##
+
+import sys
+
+import numpy as np
+
+class ListPool:
+
+    def __init__( self ):
+        self.lists = [ () ]                 # handle -> tuple
+        self.by_tuple = { (): 0 }           # tuple -> handle
+        self.by_string = { 'none': 0 }      # table text -> handle
+        self.c_refs = 0
+
+    def __len__( self ):
+        return len( self.lists )
+
+    def handle_of( self, values ):
+        self.c_refs += 1
+        t = tuple( values )
+        h = self.by_tuple.get( t )
+        if h is None:
+            h = self.by_tuple[ t ] = len( self.lists )
+            self.lists.append( t )
+        return h
+
+    def handle_of_string( self, s ):
+        h = self.by_string.get( s )
+        if h is None:
+            self.c_refs -= 1    # counted again by handle_of
+            h = self.by_string[ s ] = self.handle_of( [int(x) for x in s.split(',')] )
+        self.c_refs += 1
+        return h
+
+    def intern( self, values ):
+        return self.lists[ self.handle_of( values ) ]
+
+    def intern_string( self, s ):
+        return self.lists[ self.handle_of_string( s ) ]
+
+    def intern_edge( self, e ):
+        # replace an ImageEdge's lists with their pooled tuples
+        e.shared_groups = self.intern( e.shared_groups )
+        e.shared_words = self.intern( e.shared_words )
+        e.shared_word_types = self.intern( e.shared_word_types )
+        return e
+
+    def report( self, where ):
+        sys.stderr.write('Info: %s: %d list references share %d distinct lists\n' % (where, self.c_refs, len(self)))
+
+    @staticmethod
+    def dedup_csr( offsets, values, extra = None ):
+        #
+        # The distinct rows of a CSR list column, in order of first
+        # appearance: returns (dict_offsets, dict_values, handles), where
+        # row i is dict row handles[i]. extra, if given, is a second value
+        # array sharing offsets (word types alongside words) which is part
+        # of each row's identity; its dictionary values are returned too,
+        # as a fourth element.
+        #
+        n = len(offsets) - 1
+        keys = dict()
+        handles = np.zeros( n, dtype=np.int64 )
+        firsts = list()
+        v = np.ascontiguousarray( values, dtype=np.int64 )
+        x = None if extra is None else np.ascontiguousarray( extra, dtype=np.int64 )
+        bounds = np.asarray( offsets, dtype=np.int64 ).tolist()
+        for i in range( n ):
+            (s, e) = (bounds[i], bounds[i+1])
+            k = v[ s:e ].tostring() if x is None else (v[ s:e ].tostring(), x[ s:e ].tostring())
+            h = keys.get( k )
+            if h is None:
+                h = keys[ k ] = len( firsts )
+                firsts.append( i )
+            handles[i] = h
+        firsts = np.asarray( firsts, dtype=np.int64 )
+        starts = np.asarray( offsets, dtype=np.int64 )[ firsts ] if len(firsts) else np.zeros( 0, dtype=np.int64 )
+        lengths = (np.asarray( offsets, dtype=np.int64 )[ firsts+1 ] - starts) if len(firsts) else np.zeros( 0, dtype=np.int64 )
+        dict_offsets = np.zeros( len(firsts)+1, dtype=np.int64 )
+        np.cumsum( lengths, out=dict_offsets[1:] )
+        gather = np.arange( dict_offsets[-1], dtype=np.int64 ) + np.repeat( starts - dict_offsets[:-1], lengths )
+        if x is None:
+            return (dict_offsets, v[ gather ], handles)
+        return (dict_offsets, v[ gather ], handles, x[ gather ])
+
+    @staticmethod
+    def expand_csr( dict_offsets, dict_values, handles ):
+        # inverse of dedup_csr: (offsets, values) with row i = dict row handles[i]
+        starts = dict_offsets[ handles ]
+        lengths = dict_offsets[ handles+1 ] - starts
+        offsets = np.zeros( len(handles)+1, dtype=np.int64 )
+        np.cumsum( lengths, out=offsets[1:] )
+        gather = np.arange( offsets[-1], dtype=np.int64 ) + np.repeat( starts - offsets[:-1], lengths )
+        return (offsets, dict_values[ gather ], gather)
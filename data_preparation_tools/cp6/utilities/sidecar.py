@@ -0,0 +1,91 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Sidecar files: derived data (indices, caches) stored next to a table
+## and stamped with the table's size and modification time, so a sidecar
+## left over from an earlier version of the table is noticed and rebuilt.
+##
+
+import os
+import sys
+import shutil
+
+import numpy as np
+
+class Sidecar:
+
+    @staticmethod
+    def fingerprint( fn ):
+        s = os.stat( fn )
+        return '%d %.6f' % (s.st_size, s.st_mtime)
+
+    @staticmethod
+    def write_stamp( stamp_fn, fn, version ):
+        # write via a rename, so a reader never sees a half-written stamp
+        tmp_fn = '%s.tmp.%d' % (stamp_fn, os.getpid())
+        with open( tmp_fn, 'w' ) as f:
+            f.write( '%d %s\n' % (version, Sidecar.fingerprint( fn )))
+        os.rename( tmp_fn, stamp_fn )
+
+    @staticmethod
+    def is_fresh( stamp_fn, fn, version ):
+        # True if stamp_fn was written for this version of fn
+        if not os.path.isfile( stamp_fn ):
+            return False
+        with open( stamp_fn ) as f:
+            return f.readline().strip() == '%d %s' % (version, Sidecar.fingerprint( fn ))
+
+    @staticmethod
+    def write_arrays( out_dir, arrays, stamp, fn, version ):
+        #
+        # Save arrays (name -> numpy array) as out_dir/<name>.npy plus the
+        # stamp for fn, via a temporary directory renamed into place.
+        # Returns False, with a warning, if out_dir can't be written (e.g.
+        # next to a table in a read-only directory); callers then use the
+        # arrays they already have in memory.
+        #
+        tmp_dir = '%s.tmp.%d' % (out_dir, os.getpid())
+        try:
+            if os.path.isdir( tmp_dir ):
+                shutil.rmtree( tmp_dir )
+            os.makedirs( tmp_dir )
+            for (name, a) in arrays.iteritems():
+                np.save( os.path.join( tmp_dir, '%s.npy' % name ), a )
+            Sidecar.write_stamp( os.path.join( tmp_dir, stamp ), fn, version )
+            if os.path.isdir( out_dir ):
+                shutil.rmtree( out_dir )
+            os.rename( tmp_dir, out_dir )
+        except (IOError, OSError) as e:
+            sys.stderr.write('Warn: not writing %s: %s; using it from memory\n' % (out_dir, e))
+            shutil.rmtree( tmp_dir, ignore_errors=True )
+            return False
+        return True
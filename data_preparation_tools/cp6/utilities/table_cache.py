@@ -0,0 +1,225 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## A disk cache of parsed tables. read_from_file for the big tables (image,
+## image indicator, and lookup tables, label matrices, and the columns of
+## compact edge tables) goes through TableCache.get, which returns the table as it was stored after
+## an earlier parse of the same file, or parses and stores it.
+##
+## Set up with environment variables:
+##
+## CP6_TABLE_CACHE     the cache directory; the cache is off if unset or empty
+## CP6_TABLE_CACHE_MB  disk budget in MB (default 4096); least recently used
+##                     entries are removed to stay under it
+##
+## An entry is keyed on the table's absolute path, size, mtime and a hash
+## of sampled blocks of its contents, plus what the reader was asked for
+## (text mode, ID filter, ...); a changed table is a new key, and its old
+## entries age out. Hashing every byte would cost as much as a cold parse,
+## so the hash covers SAMPLES blocks spread evenly over the file.
+##
+## Entries are stored either as a pickle (protocol 2) or, for numpy-backed
+## tables, as a directory of .npy files which load memory-mapped. Files
+## smaller than MIN_BYTES aren't cached; they parse faster than they hash.
+##
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import cPickle
+
+import numpy as np
+
+class TableCache:
+
+    VERSION = 1
+    ENV_DIR = 'CP6_TABLE_CACHE'
+    ENV_MB = 'CP6_TABLE_CACHE_MB'
+    DEFAULT_MB = 4096
+    MIN_BYTES = 1 << 20
+    (SAMPLES, SAMPLE_BYTES) = (32, 1 << 14)
+    (PICKLE, SOURCE) = ('table.pkl', 'source.txt')
+
+    @staticmethod
+    def directory():
+        return os.environ.get( TableCache.ENV_DIR ) or None
+
+    @staticmethod
+    def budget_bytes():
+        return int( float( os.environ.get( TableCache.ENV_MB ) or TableCache.DEFAULT_MB ) * (1 << 20))
+
+    @staticmethod
+    def enabled_for( fn ):
+        # True if reads of fn go through the cache
+        return (TableCache.directory() is not None) and os.path.isfile( fn ) and \
+               (os.path.getsize( fn ) >= TableCache.MIN_BYTES)
+
+    @staticmethod
+    def sampled_hash( fn, size ):
+        h = hashlib.sha1()
+        with open( fn, 'rb' ) as f:
+            if size <= TableCache.SAMPLES * TableCache.SAMPLE_BYTES:
+                h.update( f.read() )
+            else:
+                step = (size - TableCache.SAMPLE_BYTES) // (TableCache.SAMPLES - 1)
+                for i in range( TableCache.SAMPLES ):
+                    f.seek( i * step )
+                    h.update( f.read( TableCache.SAMPLE_BYTES ))
+        return h.hexdigest()
+
+    @staticmethod
+    def id_set_key( ids ):
+        # a short stand-in for an ID filter in a key
+        a = np.sort( np.fromiter( ids, dtype=np.int64 ))
+        return 'ids %d %s' % (len(a), hashlib.sha1( a.tostring() ).hexdigest())
+
+    @staticmethod
+    def normalize( params ):
+        # params with any ID filters (sets, dicts, lists) replaced by id_set_key
+        return tuple( TableCache.id_set_key( p ) if isinstance( p, (set, frozenset, dict, list) ) else p for p in params )
+
+    @staticmethod
+    def key( fn, kind, params ):
+        s = os.stat( fn )
+        h = hashlib.sha1()
+        h.update( repr( (TableCache.VERSION, os.path.abspath( fn ), s.st_size, '%.6f' % s.st_mtime, \
+                         TableCache.sampled_hash( fn, s.st_size ), kind, params) ))
+        return '%s-%s' % (kind, h.hexdigest())
+
+    @staticmethod
+    def get( fn, kind, params, parse, store=None, load=None ):
+        #
+        # parse() unless enabled_for( fn ); otherwise the cached table for
+        # (fn, kind, params), parsing and storing it first on a miss.
+        # store( table, dir ) and load( dir ) give an array form; the
+        # default is a pickle.
+        #
+        if not TableCache.enabled_for( fn ):
+            return parse()
+        params = TableCache.normalize( params )
+        entry = os.path.join( TableCache.directory(), TableCache.key( fn, kind, params ))
+        if os.path.isfile( os.path.join( entry, TableCache.SOURCE )):
+            t_start = time.time()
+            try:
+                if load is not None:
+                    t = load( entry )
+                else:
+                    with open( os.path.join( entry, TableCache.PICKLE ), 'rb' ) as f:
+                        t = cPickle.load( f )
+            except (IOError, OSError, EOFError, ValueError, cPickle.UnpicklingError, AssertionError) as e:
+                # e.g. evicted by another process while we were reading; parse instead
+                sys.stderr.write( 'Warn: table cache entry %s unreadable (%s); re-parsing %s\n' % (entry, e, fn))
+            else:
+                os.utime( os.path.join( entry, TableCache.SOURCE ), None )
+                sys.stderr.write( 'Info: loaded %s from table cache in %f seconds\n' % (fn, time.time() - t_start))
+                return t
+
+        t = parse()
+        TableCache.put( entry, fn, kind, params, t, store )
+        return t
+
+    @staticmethod
+    def put( entry, fn, kind, params, t, store ):
+        # write into a temporary directory and rename it into place
+        tmp_dir = '%s.tmp.%d' % (entry, os.getpid())
+        try:
+            if os.path.isdir( tmp_dir ):
+                shutil.rmtree( tmp_dir )
+            os.makedirs( tmp_dir )
+            if store is not None:
+                store( t, tmp_dir )
+            else:
+                with open( os.path.join( tmp_dir, TableCache.PICKLE ), 'wb' ) as f:
+                    cPickle.dump( t, f, 2 )
+            # written last: an entry without it is incomplete
+            with open( os.path.join( tmp_dir, TableCache.SOURCE ), 'w' ) as f:
+                f.write( '%s\n%s\n%r\n' % (os.path.abspath( fn ), kind, params) )
+            if os.path.isdir( entry ):
+                shutil.rmtree( entry )
+            os.rename( tmp_dir, entry )
+        except (IOError, OSError, cPickle.PicklingError) as e:
+            sys.stderr.write( 'Warn: not caching %s: %s\n' % (fn, e))
+            shutil.rmtree( tmp_dir, ignore_errors=True )
+            return
+        TableCache.evict( os.path.dirname( entry ), TableCache.budget_bytes() )
+
+    @staticmethod
+    def entries( cache_dir ):
+        # list of (last use, bytes, path) for the complete entries in cache_dir
+        r = list()
+        for name in os.listdir( cache_dir ):
+            path = os.path.join( cache_dir, name )
+            source = os.path.join( path, TableCache.SOURCE )
+            if ('.tmp.' in name) or not os.path.isfile( source ):
+                continue
+            try:
+                n_bytes = sum( os.path.getsize( os.path.join( path, x )) for x in os.listdir( path ))
+                r.append( (os.path.getmtime( source ), n_bytes, path) )
+            except OSError:
+                # removed under us
+                continue
+        return r
+
+    @staticmethod
+    def evict( cache_dir, budget ):
+        # remove least recently used entries until the cache fits in budget bytes
+        entries = sorted( TableCache.entries( cache_dir ))
+        total = sum( e[1] for e in entries )
+        for (last_use, n_bytes, path) in entries:
+            if total <= budget:
+                break
+            shutil.rmtree( path, ignore_errors=True )
+            total -= n_bytes
+            sys.stderr.write( 'Info: table cache: evicted %s (%.1f MB)\n' % (path, n_bytes / 1048576.0))
+
+if __name__ == '__main__':
+    if (len(sys.argv) not in (1, 2)) or ((len(sys.argv) == 2) and (sys.argv[1] != 'clear')):
+        sys.stderr.write('Usage: $0 [clear]\n')
+        sys.stderr.write('  Lists (or removes) the entries in the table cache at $%s.\n' % TableCache.ENV_DIR)
+        sys.exit(0)
+    cache_dir = TableCache.directory()
+    if (cache_dir is None) or not os.path.isdir( cache_dir ):
+        sys.stderr.write('Info: no table cache (set %s)\n' % TableCache.ENV_DIR)
+        sys.exit(0)
+    entries = sorted( TableCache.entries( cache_dir ), reverse=True )
+    if len(sys.argv) == 2:
+        TableCache.evict( cache_dir, 0 )
+        sys.exit(0)
+    for (last_use, n_bytes, path) in entries:
+        with open( os.path.join( path, TableCache.SOURCE )) as f:
+            (source, kind) = (f.readline().strip(), f.readline().strip())
+        sys.stdout.write( '%s %8.1f MB %s %s\n' % (time.strftime( '%Y-%m-%d %H:%M', time.localtime( last_use )), \
+                                                 n_bytes / 1048576.0, kind, source))
+    sys.stdout.write( '%d entries, %.1f of %.1f MB\n' % (len(entries), sum( e[1] for e in entries ) / 1048576.0, \
+                                                        TableCache.budget_bytes() / 1048576.0))
@@ -0,0 +1,234 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## One place to open table files, so any of them can be kept compressed:
+## the compression is chosen by the file name's suffix (.gz, .bz2, .xz),
+## and anything else is opened exactly as before (open, or codecs.open
+## when an encoding is given.)
+##
+## Compressed files are streamed through large buffers. When reading, the
+## decompression can run on a background thread (zlib and bz2 release the
+## GIL while they work), so it overlaps with parsing.
+##
+## xz needs the lzma module (backports.lzma on Python 2).
+##
+
+import os
+import io
+import sys
+import gzip
+import bz2
+import codecs
+import threading
+import Queue
+
+class TableIO:
+
+    SUFFIXES = ( '.gz', '.bz2', '.xz' )
+    BUFFER_SIZE = 1 << 20
+    LEVEL = 6
+    # decompress on a background thread, unless open() says otherwise
+    BACKGROUND = True
+
+    @staticmethod
+    def compression( fn ):
+        # fn's compression suffix, or None
+        for s in TableIO.SUFFIXES:
+            if fn.endswith( s ):
+                return s
+        return None
+
+    @staticmethod
+    def base_name( fn ):
+        # fn without its compression suffix
+        s = TableIO.compression( fn )
+        return fn[ :-len(s) ] if s else fn
+
+    @staticmethod
+    def like( fn, src_fn ):
+        # fn, compressed the same way as src_fn
+        return TableIO.base_name( fn ) + (TableIO.compression( src_fn ) or '')
+
+    @staticmethod
+    def find( dir_name, name ):
+        # the path of name in dir_name, possibly compressed; None if absent
+        for s in ('',) + TableIO.SUFFIXES:
+            fn = os.path.join( dir_name, name + s )
+            if os.path.isfile( fn ):
+                return fn
+        return None
+
+    @staticmethod
+    def find_required( dir_name, name ):
+        fn = TableIO.find( dir_name, name )
+        if fn is None:
+            raise AssertionError( 'No %s{,%s} in %s' % (name, ','.join( TableIO.SUFFIXES ), dir_name ))
+        return fn
+
+    @staticmethod
+    def open_raw( fn, mode ):
+        # the decompressing / compressing file object for fn; mode is 'rb' or 'wb'
+        s = TableIO.compression( fn )
+        if s == '.gz':
+            return gzip.GzipFile( fn, mode, TableIO.LEVEL )
+        if s == '.bz2':
+            return bz2.BZ2File( fn, mode, TableIO.BUFFER_SIZE, TableIO.LEVEL )
+        try:
+            import lzma
+        except ImportError:
+            try:
+                from backports import lzma
+            except ImportError:
+                raise AssertionError( '%s: reading or writing .xz needs the lzma (backports.lzma) module' % fn )
+        return lzma.LZMAFile( fn, mode )
+
+    @staticmethod
+    def open( fn, mode = 'r', encoding = None, background = None ):
+        #
+        # Like open( fn, mode ), or codecs.open( fn, mode, encoding ), for
+        # possibly-compressed files. mode is one of r, rb, w, wb; with
+        # background (default: BACKGROUND), reads decompress on a separate
+        # thread.
+        #
+        if TableIO.compression( fn ) is None:
+            return codecs.open( fn, mode, encoding ) if encoding else open( fn, mode )
+        if mode.startswith( 'r' ):
+            raw = RawFileAdapter( TableIO.open_raw( fn, 'rb' ), True )
+            if TableIO.BACKGROUND if background is None else background:
+                raw = BackgroundReader( raw )
+            f = io.BufferedReader( raw, TableIO.BUFFER_SIZE )
+            return codecs.getreader( encoding )( f ) if encoding else f
+        if mode.startswith( 'w' ):
+            f = io.BufferedWriter( RawFileAdapter( TableIO.open_raw( fn, 'wb' ), False ), TableIO.BUFFER_SIZE )
+            return codecs.getwriter( encoding )( f ) if encoding else f
+        raise AssertionError( '%s: unsupported mode "%s" for a compressed table' % (fn, mode ))
+
+    @staticmethod
+    def open_text( fn, encoding ):
+        #
+        # A buffered reader of fn's lines as unicode. Unlike
+        # TableIO.open( fn, 'r', encoding ), this is io.TextIOWrapper,
+        # which decodes in C rather than through codecs' StreamReader, and
+        # only ends lines at '\n'; codecs also ends them at a lone '\r',
+        # \x0b, \x0c, \x1c-\x1e, \x85, \u2028, and \u2029, any of which
+        # can turn up in free text. Line endings are kept, as with codecs.
+        #
+        if TableIO.compression( fn ) is None:
+            return io.open( fn, 'r', TableIO.BUFFER_SIZE, encoding, newline='\n' )
+        return io.TextIOWrapper( TableIO.open( fn, 'rb' ), encoding, newline='\n' )
+
+class RawFileAdapter( io.RawIOBase ):
+    # presents a file-like object (GzipFile, BZ2File, ...) as raw I/O for io.Buffered*
+
+    def __init__( self, f, reading ):
+        io.RawIOBase.__init__( self )
+        self.f = f
+        self.reading = reading
+
+    def readable( self ):
+        return self.reading
+
+    def writable( self ):
+        return not self.reading
+
+    def readinto( self, b ):
+        data = self.f.read( len(b) )
+        n = len(data)
+        b[ :n ] = data
+        return n
+
+    def write( self, b ):
+        # b is a memoryview, whose str() on Python 2 is its repr
+        self.f.write( b.tobytes() if isinstance( b, memoryview ) else bytes( b ))
+        return len(b)
+
+    def close( self ):
+        if not self.closed:
+            self.f.close()
+        io.RawIOBase.close( self )
+
+class BackgroundReader( io.RawIOBase ):
+    #
+    # Reads a raw stream on a separate thread, CHUNK bytes at a time, at
+    # most DEPTH chunks ahead of the consumer.
+    #
+
+    (CHUNK, DEPTH) = (TableIO.BUFFER_SIZE, 4)
+
+    def __init__( self, raw ):
+        io.RawIOBase.__init__( self )
+        self.raw = raw
+        self.queue = Queue.Queue( BackgroundReader.DEPTH )
+        self.stopping = False
+        (self.chunk, self.pos, self.eof) = ('', 0, False)
+        self.thread = threading.Thread( target=self.fill )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def fill( self ):
+        try:
+            while not self.stopping:
+                data = self.raw.read( BackgroundReader.CHUNK )
+                self.queue.put( data )
+                if not data:
+                    return
+        except Exception:
+            self.queue.put( sys.exc_info() )
+
+    def readable( self ):
+        return True
+
+    def readinto( self, b ):
+        while self.pos == len( self.chunk ):
+            if self.eof:
+                return 0
+            item = self.queue.get()
+            if isinstance( item, tuple ):
+                raise item[0], item[1], item[2]
+            (self.chunk, self.pos) = (item, 0)
+            self.eof = (len(item) == 0)
+        n = min( len(b), len(self.chunk) - self.pos )
+        b[ :n ] = self.chunk[ self.pos:self.pos+n ]
+        self.pos += n
+        return n
+
+    def close( self ):
+        if not self.closed:
+            # unblock and retire the reader thread
+            self.stopping = True
+            while self.thread.is_alive():
+                try:
+                    self.queue.get( timeout=0.1 )
+                except Queue.Empty:
+                    pass
+            self.raw.close()
+        io.RawIOBase.close( self )
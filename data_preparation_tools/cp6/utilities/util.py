@@ -34,9 +34,11 @@
 ##
 
 import sys
+import re
 from collections import defaultdict
 
 from cp6.utilities.paths import Paths
+from cp6.utilities.table_io import TableIO
 
 class Util:
 
@@ -48,8 +50,36 @@ class Util:
         s = s.replace( '"',' ' ).replace( '\n', ' ').replace( '\r', ' ' )
         return unicode( '"%s"' % s )
 
+    #
+    # qstr_split's tokens, outside quotes separated by spaces and tabs: a
+    # quoted string (with any unquoted text run into its opening quote),
+    # an unbalanced quote running to the end of the line, or a plain word.
+    # Only the closing quote ends a quoted token, so '""' is an empty
+    # word and 'a"b c"d' is 'ab c', 'd'.
+    #
+    QSTR_TOKEN = re.compile( r'([^ \t"]*)"([^"]*)"|([^ \t"]*)"([^"]*)\Z|([^ \t"]+)' )
+
     @staticmethod
     def qstr_split( s ):
+        if '"' not in s:
+            return [ w for w in s.replace( '\t', ' ' ).split( ' ' ) if w ]
+        words = list()
+        for m in Util.QSTR_TOKEN.finditer( s ):
+            k = m.lastindex
+            if k == 2:
+                words.append( m.group(1) + m.group(2) )
+            elif k == 5:
+                words.append( m.group(5) )
+            else:
+                w = m.group(3) + m.group(4)
+                if len(w):
+                    words.append( w )
+                sys.stderr.write('WARN: unbalanced quotes in \'%s\'\n' % s)
+        return words
+
+    @staticmethod
+    def qstr_split_by_char( s ):
+        # the original character-at-a-time qstr_split, kept as the reference for exercise_qstr_split
         words = list()
         current_word = ''
         in_quote = False
@@ -79,68 +109,63 @@ class Util:
 
     @staticmethod
     def exercise_qstr_split():
+        c_differ = 0
         for s in ['', \
                   'a', '  a', 'a  ','  a  ', \
                   'aa bb', '  aa bb', 'aa    bb', 'aa  bb  ','  aa  bb  ',\
                   'a b c', ' a b c ', 'a    b c ', \
                   '""', 'a "b c" d', '"a" b c', ' "a " b c ', '"a ""b " "c" ', '"a""b""c"', \
-                  'a b "c d""e f"', ' a b d "e' ]:
+                  'a b "c d""e f"', ' a b d "e', \
+                  'a"b c"d', 'a\tb\t"c\td"', '"', 'a "', '"" ""', 'x\n', '"a\nb" c\r\n' ]:
             sys.stderr.write('TEST: input \'%s\'\n' % s)
             words = Util.qstr_split(s)
             for i in range(0, len(words)):
                 sys.stderr.write('TEST: output %d / %d: \'%s\'\n' % (i, len(words), words[i]))
-
+            if words != Util.qstr_split_by_char( s ):
+                sys.stderr.write('TEST: differs from qstr_split_by_char: %s\n' % Util.qstr_split_by_char( s ))
+                c_differ += 1
+        return c_differ
 
     @staticmethod
     def read_label_table( fn ):
         id2label = dict()
         label2id = dict()
-        with open(fn) as f:
+        with TableIO.open( fn ) as f:
             while 1:
                 raw_line = f.readline()
                 if not raw_line:
                     break
-                fields = Util.qstr_split( raw_line )
+                fields = Util.qstr_split( raw_line.strip() )
                 id2label[ int(fields[0]) ] = fields[1]
                 label2id[ fields[1] ] = int(fields[0])
         return (id2label, label2id)
 
     @staticmethod
     def count_labels_in_image_table( fn, flag_to_count = 1 ):
+        # key: label index; val: number of images with flag_to_count for that label
+        # (from the table's label index; see label_index.py)
+        from cp6.tables.label_index import LabelIndex
+        counts = LabelIndex.load( fn ).counts( flag_to_count )
         label_vector_count = defaultdict(int)
-        with open( fn ) as f:
-            while 1:
-                raw_line = f.readline()
-                if not raw_line:
-                    break
-                fields = Util.qstr_split( raw_line )
-                if len(fields) != 10:
-                    raise AssertionError("Expected 10 fields in '%s', found %d\n" % (raw_line, len(fields)))
-                for (ind, val) in enumerate( fields[9].split(',')):
-                    if int(val) == flag_to_count:
-                        label_vector_count[ ind ] += 1
+        for ind in counts.nonzero()[0]:
+            label_vector_count[ int(ind) ] = int( counts[ind] )
         return label_vector_count
 
     @staticmethod
     def node_ids_with_label_in_image_table( fn, label_index, flag_to_count = 1 ):
-        node_ids = list()
-        with open( fn ) as f:
-            while 1:
-                raw_line = f.readline()
-                if not raw_line:
-                    break
-                fields = Util.qstr_split( raw_line )
-                if len(fields) != 10:
-                    raise AssertionError("Expected 10 fields in '%s', found %d\n" % (raw_line, len(fields)))
-                labels = map(int, fields[9].split(','))
-                if labels[ label_index ] == flag_to_count:
-                    node_ids.append( int(fields[0]) )
-        return node_ids
+        # sorted IDs of the images with flag_to_count for label_index
+        from cp6.tables.label_index import LabelIndex
+        return LabelIndex.load( fn ).ids_with( label_index, flag_to_count ).tolist()
+
+    @staticmethod
+    def node_ids_matching_in_image_table( fn, query, label2id ):
+        # sorted IDs of the images matching a label query such as 'sea AND NOT structures'
+        from cp6.tables.label_index import LabelIndex
+        return LabelIndex.load( fn ).query( query, label2id ).tolist()
 
 
     @staticmethod
     def label_census( paths, phase_key ):
-        label_table = LabelTable.read_from_file( paths.label_table_path )
         (id2label, label2id) = Util.read_label_table( paths.label_table_path )
         label_vector_count = Util.count_labels_in_image_table( paths.phase_tables[phase_key].image_table )
         for ind in label_vector_count:
@@ -152,6 +177,11 @@ class Util:
         nodes = Util.node_ids_with_label_in_image_table( paths.phase_tables[phase_key].image_table, label2id[label_string])
         return nodes
 
+    @staticmethod
+    def nodes_matching( paths, phase_key, query ):
+        (id2label, label2id) = Util.read_label_table( paths.label_table_path )
+        return Util.node_ids_matching_in_image_table( paths.phase_tables[phase_key].image_table, query, label2id )
+
 
 if __name__ == '__main__':
     # Util.label_census( Paths(), 'r1train')
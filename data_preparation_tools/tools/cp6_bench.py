@@ -0,0 +1,1172 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+##
+## Benchmarks for the table-building and table-reading code, run against
+## synthetic data so they don't depend on having a sandbox handy.
+##
+## Usage: cp6_bench.py benchmark-name [options]; run with -h for the list.
+##
+
+import sys
+import os
+import time
+import random
+import shutil
+import filecmp
+import hashlib
+import argparse
+import gzip
+import tempfile
+import resource
+import multiprocessing
+import xml.etree.ElementTree as ET
+
+from cp6.bootstrap.cp6_data import CP6Data
+from cp6.bootstrap.cp6_mcauley_edge_features import CP6McAuleyEdge
+from cp6.utilities.data_split import DataSplit
+from cp6.utilities.image_indicator import ImageIndicator
+from cp6.tables.image_indicator_table import ImageIndicatorTable
+from cp6.tables.edge_table import EdgeTable
+from cp6.tables.edge_index import EdgeIndex
+from cp6.tables.edge_archive import EdgeArchive
+from cp6.tables.edge_sort import EdgeSorter
+from cp6.tables.edge_sparsify import EdgeSparsifier
+from cp6.tables.edge_partition import EdgeGraph, GraphPartitioner
+from cp6.tables.edge_stats import EdgeStats
+from cp6.tables.edge_columns import EdgeColumns
+from cp6.tables.edge_distances import EdgeDistances
+from cp6.tables.edge_hypergraph import HyperedgeTable
+from cp6.tables.image_feature_table import ImageFeatureTable
+from cp6.tables.image_table import ImageTable
+from cp6.tables.label_matrix import LabelMatrix
+from cp6.tables.label_index import LabelIndex
+from cp6.tables.row_index import RowIndex
+from cp6.utilities.image_edge import ImageEdge
+from cp6.utilities.image_table_entry import ImageTableEntry
+from cp6.utilities.exifdata import EXIFData
+from cp6.utilities.util import Util
+from cp6.utilities.table_io import TableIO
+from cp6.utilities.table_cache import TableCache
+
+#
+# Synthetic stand-ins for the XML and McAuley edge data; just enough
+# for CP6Data.get_image_edges*() to run.
+#
+
+class SyntheticXML:
+    def __init__( self ):
+        self.mir_nodes = dict()
+
+class SyntheticMcAuleyEdgeFeatures:
+    def __init__( self ):
+        self.edgemap = dict()
+
+class SyntheticCP6Data( CP6Data ):
+    #
+    # Roughly MIRFLICKR-shaped: a few photos per owner, zero to two groups
+    # out of n/5, three words out of 4n, and about n/2 McAuley edges, mostly
+    # between photos from the same owner.
+    #
+
+    def __init__( self, n_images, seed ):
+        rng = random.Random( seed )
+        self.n_mir_ids = n_images
+        self.xmldata = SyntheticXML()
+        self.image_indicator_table = ImageIndicatorTable()
+        self.mcauley_edge_features = SyntheticMcAuleyEdgeFeatures()
+        self.splits = dict()
+
+        n_owners = max( 1, n_images / 10 )
+        n_groups = max( 1, n_images / 5 )
+        n_words = 4 * n_images
+        word_sources = ( ImageIndicator.IN_TAG | ImageIndicator.SRC_IS_TAG, \
+                         ImageIndicator.IN_TITLE | ImageIndicator.SRC_IS_WORD, \
+                         ImageIndicator.IN_DESC | ImageIndicator.SRC_IS_WORD )
+
+        (owner_of, owner_photos) = (dict(), dict())
+        for mir_id in range( 1, n_images+1 ):
+            owner = rng.randint( 0, n_owners-1 )
+            owner_of[ mir_id ] = owner
+            owner_photos.setdefault( owner, list() ).append( mir_id )
+            photo = ET.Element( 'photo', id='%d' % (1000000 + 7*mir_id) )
+            ET.SubElement( photo, 'owner', nsid='owner%d@N00' % owner )
+            self.xmldata.mir_nodes[ mir_id ] = photo
+
+            ii = ImageIndicator( mir_id )
+            for i in range( 0, rng.randint( 0, 2 )):
+                ii.group_list[ rng.randint( 0, n_groups-1 ) ] = True
+            for i in range( 0, 3 ):
+                w = rng.randint( 0, n_words-1 )
+                ii.word_list[ w ] = True
+                ii.word_source_flags[ w ] = rng.choice( word_sources )
+            self.image_indicator_table.image_indicators[ mir_id ] = ii
+
+        for i in range( 0, n_images / 2 ):
+            a = rng.randint( 1, n_images )
+            if rng.random() < 0.8:
+                b = rng.choice( owner_photos[ owner_of[a] ] )
+            else:
+                b = rng.randint( 1, n_images )
+            if a == b:
+                continue
+            (fa, fb) = sorted( (self.get_flickr_id( a ), self.get_flickr_id( b )) )
+            # McAuley occasionally misses the same-user flag
+            user_flag = '1' if (owner_of[a] == owner_of[b]) and (rng.random() < 0.95) else '0'
+            e = CP6McAuleyEdge( '0', '0', '0', '0', rng.choice( ['0','1'] ), user_flag, rng.choice( ['0','1'] ))
+            self.mcauley_edge_features.edgemap[ '%d:%d' % (fa, fb) ] = e
+
+def timed( f, *args ):
+    t_start = time.time()
+    r = f( *args )
+    return (r, time.time() - t_start)
+
+def bench_edges( args ):
+    #
+    # Compare CP6Data.get_image_edges (all pairs) against
+    # get_image_edges_indexed (posting lists) and check their output is
+    # byte-identical. The all-pairs version is only run up to --brute-limit
+    # images; beyond that its time is extrapolated from the largest run.
+    #
+
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    brute_sec_per_pair = None
+    sys.stdout.write('n-images n-edges indexed-sec all-pairs-sec speedup identical\n')
+    try:
+        for n in [int(x) for x in args.sizes.split(',')]:
+            d = SyntheticCP6Data( n, args.seed )
+            split = DataSplit( sorted( d.xmldata.mir_nodes.keys() ), 1, DataSplit.TRAIN )
+            n_pairs = n * (n-1) / 2
+
+            (edges, t_indexed) = timed( d.get_image_edges_indexed, split )
+            indexed_fn = os.path.join( tmp_dir, 'indexed_%d.txt' % n )
+            EdgeTable( edges ).write_to_file( indexed_fn )
+
+            if n <= args.brute_limit:
+                (brute_edges, t_brute) = timed( d.get_image_edges, split )
+                brute_fn = os.path.join( tmp_dir, 'brute_%d.txt' % n )
+                EdgeTable( brute_edges ).write_to_file( brute_fn )
+                identical = 'yes' if filecmp.cmp( indexed_fn, brute_fn, shallow=False ) else 'NO'
+                brute_sec_per_pair = t_brute / max( 1, n_pairs )
+                brute_str = '%.2f' % t_brute
+            elif brute_sec_per_pair is not None:
+                t_brute = brute_sec_per_pair * n_pairs
+                (brute_str, identical) = ('~%.0f' % t_brute, 'n/a')
+            else:
+                (t_brute, brute_str, identical) = (None, 'n/a', 'n/a')
+
+            speedup = '%.1fx' % (t_brute / t_indexed) if (t_brute is not None) and (t_indexed > 0) else 'n/a'
+            sys.stdout.write('%d %d %.2f %s %s %s\n' % (n, len(edges), t_indexed, brute_str, speedup, identical ))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def write_synthetic_edge_table( fn, n_images, seed ):
+    d = SyntheticCP6Data( n_images, seed )
+    split = DataSplit( sorted( d.xmldata.mir_nodes.keys() ), 1, DataSplit.TRAIN )
+    return EdgeTable( d.get_image_edges_indexed( split )).write_to_file( fn )
+
+def edge_table_arg( args, tmp_dir ):
+    # the --edge-table argument, or a synthetic table of --images images
+    if args.edge_table:
+        return args.edge_table
+    fn = os.path.join( tmp_dir, 'synthetic_edges.txt' )
+    # generate in a child, so this process stays small for measure_in_child
+    p = multiprocessing.Process( target=write_synthetic_edge_table, args=(fn, args.images, args.seed) )
+    p.start()
+    p.join()
+    return fn
+
+def max_rss_kb():
+    # ru_maxrss is in kilobytes on Linux (bytes on OS X)
+    return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+
+def measure_in_child( f, *args ):
+    #
+    # Run f(*args) in a fresh process and return (peak RSS growth in KB,
+    # f's return value); a child has its own high-water mark, so
+    # successive measurements don't interfere.
+    #
+    q = multiprocessing.Queue()
+    def child():
+        before = max_rss_kb()
+        r = f( *args )
+        q.put( (max_rss_kb() - before, r) )
+    p = multiprocessing.Process( target=child )
+    p.start()
+    r = q.get()
+    p.join()
+    return r
+
+def load_edge_table( fn, compact ):
+    t_start = time.time()
+    t = EdgeTable.read_from_file( fn, None, compact )
+    return (len(t.edges), time.time() - t_start)
+
+def bench_edge_memory( args ):
+    # memory of list-of-ImageEdge vs. compact (numpy column) EdgeTables
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        fn = edge_table_arg( args, tmp_dir )
+        sys.stdout.write('mode n-edges load-sec rss-MB bytes-per-edge\n')
+        for (mode, compact) in (('objects', False), ('compact', True)):
+            (kb, (n, sec)) = measure_in_child( load_edge_table, fn, compact )
+            sys.stdout.write('%s %d %.2f %.1f %.0f\n' % (mode, n, sec, kb / 1024.0, kb * 1024.0 / max(1, n)))
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def bench_parallel_read( args ):
+    # edge table parse throughput vs. worker count
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        fn = edge_table_arg( args, tmp_dir )
+        mb = os.path.getsize( fn ) / (1024.0 * 1024.0)
+        sys.stdout.write('workers n-edges sec MB/sec speedup\n')
+        t_one = None
+        for n in [int(x) for x in args.workers.split(',')]:
+            (t, sec) = timed( EdgeTable.read_from_file, fn, None, True, n )
+            t_one = sec if t_one is None else t_one
+            sys.stdout.write('%d %d %.2f %.1f %.2fx\n' % (n, len(t.edges), sec, mb / sec, t_one / sec))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def bench_edge_index( args ):
+    #
+    # per-node edge index queries vs. scanning the table; note that with
+    # --edge-table, the index is left next to the table for later use
+    #
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        fn = edge_table_arg( args, tmp_dir )
+        (ix, t_build) = timed( EdgeIndex.build, fn )
+        (ix, t_load) = timed( EdgeIndex.load, fn )
+        rng = random.Random( args.seed )
+        nodes = ix.nodes.tolist()
+        queries = [ rng.choice( nodes ) for i in range( 0, args.queries ) ]
+        (r, t_nbrs) = timed( lambda: [ ix.neighbors( n ) for n in queries ] )
+        (r, t_has) = timed( lambda: [ ix.has_edge( n, rng.choice( nodes )) for n in queries ] )
+        subset = set( rng.sample( nodes, min( len(nodes), args.subgraph_size )))
+        (sub, t_sub) = timed( ix.induced_subgraph, subset )
+        (scan, t_scan) = timed( lambda: list( EdgeTable.iter_file( fn, None, subset )))
+        if [ EdgeTable.format_edge( e ) for e in sub ] != [ EdgeTable.format_edge( e ) for e in scan ]:
+            raise AssertionError( 'induced subgraph differs from a table scan' )
+        sys.stdout.write('edges %d nodes %d build-sec %.2f load-sec %.4f\n' % (len(ix), len(nodes), t_build, t_load))
+        sys.stdout.write('neighbors-ms %.3f has-edge-ms %.3f\n' % (1000 * t_nbrs / len(queries), 1000 * t_has / len(queries)))
+        sys.stdout.write('subgraph nodes %d edges %d index-ms %.1f scan-ms %.1f speedup %.0fx\n' % \
+                         (len(subset), len(sub), 1000 * t_sub, 1000 * t_scan, t_scan / max( t_sub, 1e-9 )))
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def gzip_file( src_fn, dst_fn, level ):
+    with open( src_fn, 'rb' ) as f_in:
+        with gzip.open( dst_fn, 'wb', level ) as f_out:
+            shutil.copyfileobj( f_in, f_out, 1 << 20 )
+
+def gunzip_file( src_fn, dst_fn ):
+    with gzip.open( src_fn, 'rb' ) as f_in:
+        with open( dst_fn, 'wb' ) as f_out:
+            shutil.copyfileobj( f_in, f_out, 1 << 20 )
+
+def canonical_lines( fn ):
+    # the table's lines with sorted lists, in sorted order, to check an archive round trip
+    lines = list()
+    for e in EdgeTable.iter_file( fn ):
+        e.shared_groups = sorted( e.shared_groups )
+        if len( e.shared_words ) == len( e.shared_word_types ):
+            pairs = sorted( zip( e.shared_words, e.shared_word_types ))
+            e.shared_words = [ w for (w, t) in pairs ]
+            e.shared_word_types = [ t for (w, t) in pairs ]
+        lines.append( EdgeTable.format_edge( e ))
+    return sorted( lines )
+
+def bench_edge_archive( args ):
+    # size and speed of the .cp6e archival format vs. gzip'd text
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        fn = edge_table_arg( args, tmp_dir )
+        size = os.path.getsize( fn )
+        out_fn = os.path.join( tmp_dir, 'decoded.txt' )
+        sys.stdout.write('format bytes ratio encode-sec decode-sec decode-MB/sec\n')
+        sys.stdout.write('text %d 1.00 - - -\n' % size)
+        for level in (6, 9):
+            gz_fn = os.path.join( tmp_dir, 'edges.txt.gz' )
+            (r, t_enc) = timed( gzip_file, fn, gz_fn, level )
+            (r, t_dec) = timed( gunzip_file, gz_fn, out_fn )
+            gz_size = os.path.getsize( gz_fn )
+            sys.stdout.write('gzip-%d %d %.2f %.2f %.2f %.1f\n' % (level, gz_size, float(size) / gz_size, t_enc, t_dec, size / (1048576.0 * t_dec)))
+        cp6e_fn = os.path.join( tmp_dir, 'edges.cp6e' )
+        (r, t_enc) = timed( EdgeArchive.encode_text_file, fn, cp6e_fn )
+        (r, t_dec) = timed( EdgeArchive.decode_to_text_file, cp6e_fn, out_fn )
+        (r, t_cols) = timed( EdgeArchive.read_columns, cp6e_fn )
+        cp6e_size = os.path.getsize( cp6e_fn )
+        sys.stdout.write('cp6e %d %.2f %.2f %.2f %.1f\n' % (cp6e_size, float(size) / cp6e_size, t_enc, t_dec, size / (1048576.0 * t_dec)))
+        sys.stdout.write('cp6e-to-columns %d %.2f - %.2f %.1f\n' % (cp6e_size, float(size) / cp6e_size, t_cols, size / (1048576.0 * t_cols)))
+        gz_fn = os.path.join( tmp_dir, 'edges.cp6e.gz' )
+        gzip_file( cp6e_fn, gz_fn, 9 )
+        sys.stdout.write('cp6e+gzip-9 %d %.2f - - -\n' % (os.path.getsize( gz_fn ), float(size) / os.path.getsize( gz_fn )))
+        sys.stdout.write('round trip (up to row and list order): %s\n' % \
+                         ('ok' if canonical_lines( fn ) == canonical_lines( out_fn ) else 'MISMATCH'))
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def bench_compressed_read( args ):
+    # reading an edge table through TableIO, plain and compressed
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        fn = edge_table_arg( args, tmp_dir )
+        sys.stdout.write('file bytes background read-sec\n')
+        for suffix in ('',) + TableIO.SUFFIXES:
+            copy_fn = os.path.join( tmp_dir, 'edges.txt' + suffix )
+            try:
+                EdgeTable.copy_file( fn, copy_fn )
+            except AssertionError as e:
+                sys.stdout.write('edges.txt%s skipped: %s\n' % (suffix, e))
+                continue
+            for background in ((False, True) if suffix else (False,)):
+                TableIO.BACKGROUND = background
+                (t, sec) = timed( EdgeTable.read_from_file, copy_fn, None, False, 1, () )
+                sys.stdout.write('edges.txt%s %d %s %.2f\n' % (suffix, os.path.getsize( copy_fn ), \
+                                                                 'yes' if background else 'no', sec))
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def write_unsorted_copy( src_fn, dst_fn, seed ):
+    # src_fn shuffled, with every tenth edge repeated and every other repeat reversed
+    rng = random.Random( seed )
+    lines = list()
+    with TableIO.open( src_fn ) as f:
+        for (i, line) in enumerate( f ):
+            lines.append( line )
+            if i % 10 == 0:
+                fields = line.split()
+                if i % 20 == 0:
+                    (fields[0], fields[1]) = (fields[1], fields[0])
+                    if fields[6] != 'none':
+                        fields[6] = ','.join( [ str( EdgeSorter.swap_word_type( int(t) )) for t in fields[6].split(',') ] )
+                lines.append( ' '.join( fields ) + '\n' )
+    rng.shuffle( lines )
+    with open( dst_fn, 'w' ) as f:
+        f.writelines( lines )
+    return len(lines)
+
+def sort_in_memory( src_fn, dst_fn ):
+    # the obvious approach: canonicalize everything into a dict, sort, write
+    kept = dict()
+    for e in EdgeTable.iter_file( src_fn ):
+        (c, swapped) = EdgeSorter.canonical_edge( e )
+        kept.setdefault( (c.image_A_id, c.image_B_id), EdgeTable.format_edge( c ))
+    with open( dst_fn, 'w' ) as f:
+        for k in sorted( kept ):
+            f.write( kept[k] )
+    return len(kept)
+
+def sort_external( src_fn, dst_fn, run_edges, tmp_dir ):
+    return EdgeSorter.sort_files( [src_fn], dst_fn, run_edges, tmp_dir ).c_out
+
+def bench_edge_sort( args ):
+    # external (bounded-memory) edge table sort vs. an in-memory sort
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        fn = edge_table_arg( args, tmp_dir )
+        in_fn = os.path.join( tmp_dir, 'unsorted.txt' )
+        n_in = write_unsorted_copy( fn, in_fn, args.seed )
+        ref_fn = os.path.join( tmp_dir, 'sorted_ref.txt' )
+        sys.stdout.write('input: %d edges\n' % n_in)
+        sys.stdout.write('mode run-edges n-out sec rss-MB same\n')
+        ((kb, n), sec) = timed( measure_in_child, sort_in_memory, in_fn, ref_fn )
+        sys.stdout.write('in-memory - %d %.2f %.1f -\n' % (n, sec, kb / 1024.0))
+        for run_edges in [int(x) for x in args.run_edges.split(',')]:
+            out_fn = os.path.join( tmp_dir, 'sorted_%d.txt' % run_edges )
+            ((kb, n), sec) = timed( measure_in_child, sort_external, in_fn, out_fn, run_edges, tmp_dir )
+            sys.stdout.write('external %d %d %.2f %.1f %s\n' % (run_edges, n, sec, kb / 1024.0, \
+                                                                 'yes' if filecmp.cmp( ref_fn, out_fn, shallow=False ) else 'NO'))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def bench_edge_route( args ):
+    # one routed pass to N outputs vs. N copy_file passes
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        fn = edge_table_arg( args, tmp_dir )
+        ids = set()
+        for e in EdgeTable.iter_file( fn, columns=() ):
+            ids.update( (e.image_A_id, e.image_B_id) )
+        ids = sorted( ids )
+        rng = random.Random( args.seed )
+        sys.stdout.write('outputs copy-sec route-sec speedup same\n')
+        for n in [int(x) for x in args.outputs.split(',')]:
+            id_sets = [ rng.sample( ids, len(ids) // 2 ) for i in range( n ) ]
+            copy_fns = [ os.path.join( tmp_dir, 'copy_%d.txt' % i ) for i in range( n ) ]
+            route_fns = [ os.path.join( tmp_dir, 'route_%d.txt' % i ) for i in range( n ) ]
+            t_start = time.time()
+            for (out_fn, s) in zip( copy_fns, id_sets ):
+                EdgeTable.copy_file( fn, out_fn, s )
+            copy_sec = time.time() - t_start
+            (r, route_sec) = timed( EdgeTable.route_file, fn, zip( route_fns, id_sets ))
+            same = all( [ filecmp.cmp( a, b, shallow=False ) for (a, b) in zip( copy_fns, route_fns ) ] )
+            sys.stdout.write('%d %.2f %.2f %.2fx %s\n' % (n, copy_sec, route_sec, copy_sec / route_sec, 'yes' if same else 'NO'))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def neighbor_vote_map( a, b, labels ):
+    #
+    # Leave-one-out mAP of predicting each labelled node's labels from its
+    # neighbors' (score = number of neighbors with the label), scored with
+    # cp6_eval's calculate_AP. A stand-in for the baseline's mAP which
+    # needs no external classifier.
+    #
+    from cp6_eval import calculate_AP
+    n_labels = len( labels.values()[0] ) if labels else 0
+    # every labelled node is ranked; those without votes score 0
+    votes = [ dict.fromkeys( labels, 0 ) for i in range( n_labels ) ]
+    for (x, y) in zip( a, b ):
+        for (node, nbr) in ((x, y), (y, x)):
+            if (node in labels) and (nbr in labels):
+                for (i, v) in enumerate( labels[ nbr ] ):
+                    if v == 1:
+                        votes[i][node] += 1
+    aps = list()
+    for i in range( n_labels ):
+        relevant = dict( (node, 1 if lv[i] == 1 else 0) for (node, lv) in labels.items() )
+        (ap, n) = calculate_AP( relevant, votes[i] )
+        if ap >= 0:
+            aps.append( ap )
+    return sum( aps ) / len( aps ) if aps else 0.0
+
+def bench_edge_sparsify( args ):
+    # top-k sparsification: edges kept, max degree, time, and (with --sandbox) neighbor-vote mAP
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        labels = None
+        if args.sandbox:
+            training = os.path.join( args.sandbox, 'run_in', 'training' )
+            fn = EdgeTable.find_table( training )
+            it = ImageTable.read_from_file( TableIO.find_required( training, 'image_table.txt' ))
+            labels = dict( (id, e.label_vector) for (id, e) in it.entries.items() if e.label_vector is not None )
+        else:
+            fn = edge_table_arg( args, tmp_dir )
+        columns = EdgeTable.read_from_file( fn, None, True ).edges.flush()
+        (a, b) = (columns.cols['a'], columns.cols['b'])
+        weights = EdgeSparsifier.parse_weights( args.score )
+        scores = EdgeSparsifier.scores( columns, weights )
+        sys.stdout.write('k mode n-edges kept-%% max-degree sec%s\n' % (' neighbor-vote-mAP' if labels else ''))
+        sys.stdout.write('all - %d 100.0 %d -%s\n' % (len(a), EdgeSparsifier.max_degree( a, b ), \
+                                                        ' %.4f' % neighbor_vote_map( a, b, labels ) if labels else ''))
+        for k in [int(x) for x in args.k.split(',')]:
+            for mode in EdgeSparsifier.MODES:
+                (keep, sec) = timed( EdgeSparsifier.keep_mask, a, b, scores, k, mode )
+                (ka, kb) = (a[ keep ], b[ keep ])
+                sys.stdout.write('%d %s %d %.1f %d %.3f%s\n' % (k, mode, len(ka), 100.0 * len(ka) / max( 1, len(a) ), \
+                                                              EdgeSparsifier.max_degree( ka, kb ), sec, \
+                                                              ' %.4f' % neighbor_vote_map( ka, kb, labels ) if labels else ''))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def bench_partition( args ):
+    # k-way partition cut and time vs. a random balanced assignment
+    import numpy as np
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        fn = edge_table_arg( args, tmp_dir )
+        g = EdgeGraph.from_edge_table( fn )
+        sys.stdout.write('nodes %d edges %d\n' % (len(g), g.n_edges()))
+        sys.stdout.write('k cut cut-% random-cut-% max-size sec\n')
+        for k in [int(x) for x in args.k.split(',')]:
+            (part, sec) = timed( GraphPartitioner.partition, g, k, args.imbalance )
+            rand = np.random.RandomState( args.seed ).permutation( len(g) ) % k
+            sys.stdout.write('%d %d %.2f %.2f %d %.2f\n' % (k, g.cut_size( part ), 100.0 * g.cut_size( part ) / max( 1, g.n_edges() ), \
+                                                         100.0 * g.cut_size( rand ) / max( 1, g.n_edges() ), \
+                                                         np.bincount( part ).max(), sec))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def bench_edge_stats( args ):
+    # edge table histograms from text (by worker count), archive, and column directory
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        fn = edge_table_arg( args, tmp_dir )
+        archive_fn = os.path.join( tmp_dir, 'edges.cp6e' )
+        EdgeArchive.encode_text_file( fn, archive_fn )
+        cols_dir = os.path.join( tmp_dir, 'edges.cols' )
+        EdgeColumns.read_from_text_file( fn ).write_to_dir( cols_dir )
+        runs = [ ('text-%d' % n, fn, n) for n in [int(x) for x in args.workers.split(',')] ] + \
+               [ ('archive', archive_fn, 1), ('columns', cols_dir, 1) ]
+        sys.stdout.write('source n-edges sec sec-per-100M-edges same\n')
+        ref_prefix = None
+        for (tag, src, n) in runs:
+            (stats, sec) = timed( EdgeStats.from_file, src, n )
+            prefix = os.path.join( tmp_dir, tag + '_' )
+            stats.write( prefix )
+            if ref_prefix is None:
+                ref_prefix = prefix
+            same = all( [ filecmp.cmp( '%s%s_hist.txt' % (ref_prefix, name), '%s%s_hist.txt' % (prefix, name), shallow=False ) \
+                          for (name, numeric) in EdgeStats.HISTS ] )
+            sys.stdout.write('%s %d %.2f %.0f %s\n' % (tag, stats.c_edges, sec, sec * 1.0e8 / max( 1, stats.c_edges ), \
+                                                     'yes' if same else 'NO'))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def load_edges_interned( fn, intern ):
+    t = EdgeTable.read_from_file( fn, None, False, 1, None, intern )
+    return len(t.edges)
+
+def bench_edge_intern( args ):
+    # memory of ImageEdge lists, plain vs. interned, and .cp6e size with and without dictionary pages
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        fn = edge_table_arg( args, tmp_dir )
+        sys.stdout.write('mode n-edges rss-MB bytes-per-edge\n')
+        for (mode, intern) in (('lists', False), ('interned', True)):
+            (kb, n) = measure_in_child( load_edges_interned, fn, intern )
+            sys.stdout.write('%s %d %.1f %.0f\n' % (mode, n, kb / 1024.0, kb * 1024.0 / max(1, n)))
+        sys.stdout.write('archive bytes\n')
+        for dictionary in (False, True):
+            EdgeArchive.DICTIONARY = dictionary
+            out_fn = os.path.join( tmp_dir, 'edges.cp6e' )
+            EdgeArchive.encode_text_file( fn, out_fn )
+            sys.stdout.write('cp6e%s %d\n' % ('+dictionary' if dictionary else '', os.path.getsize( out_fn )))
+        EdgeArchive.DICTIONARY = True
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def write_synthetic_feature_table( fn, ids, dim, seed ):
+    # sparse non-negative histograms, like CEDD
+    import numpy as np
+    rng = np.random.RandomState( seed )
+    with open( fn, 'w' ) as f:
+        for i in ids:
+            v = rng.rand( dim ) * (rng.rand( dim ) < 0.3)
+            f.write( '%d %d %s\n' % (i, dim, ' '.join( [ '%.4f' % x for x in v ] )))
+
+def per_edge_distances( a, b, table ):
+    # the obvious loop: one lookup and one set of distances per edge
+    import numpy as np
+    row_of = dict( (i, r) for (r, i) in enumerate( table.ids.tolist() ))
+    out = list()
+    for (ea, eb) in zip( a.tolist(), b.tolist() ):
+        (x, y) = (table.values[ row_of[ea] ].astype( np.float64 ), table.values[ row_of[eb] ].astype( np.float64 ))
+        d = x - y
+        s = np.abs( x ) + np.abs( y )
+        (nx, ny) = (np.sqrt( x.dot( x )), np.sqrt( y.dot( y )))
+        if (nx == 0) or (ny == 0):
+            # as documented in edge_distances.py: two zero vectors are at 0, one at 1
+            cosine = 0.0 if (nx == 0) and (ny == 0) else 1.0
+        else:
+            cosine = 1.0 - x.dot( y ) / (nx * ny)
+        out.append( (np.abs( d ).sum(), np.sqrt( d.dot( d )), cosine, \
+                     0.5 * (d[ s > 0 ] ** 2 / s[ s > 0 ]).sum() ))
+    return out
+
+def bench_edge_distances( args ):
+    # blocked, memory-mapped edge distances vs. a per-edge loop, by feature dimension
+    import numpy as np
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        fn = edge_table_arg( args, tmp_dir )
+        (a, b, offsets) = EdgeIndex.scan_endpoints( fn )
+        ids = np.unique( np.concatenate( (a, b) ))
+        sys.stdout.write('feature dim n-edges load-sec blocked-sec loop-sec speedup edges-per-sec\n')
+        for dim in [int(x) for x in args.dims.split(',')]:
+            feature_fn = os.path.join( tmp_dir, 'F%d.txt' % dim )
+            write_synthetic_feature_table( feature_fn, ids.tolist(), dim, args.seed )
+            ImageFeatureTable.build( feature_fn )
+            (table, t_load) = timed( ImageFeatureTable.load, feature_fn )
+            (d, t_blocked) = timed( EdgeDistances.compute, a, b, [table] )
+            n_loop = min( len(a), args.loop_edges )
+            (loop, t_loop) = timed( per_edge_distances, a[ :n_loop ], b[ :n_loop ], table )
+            if not np.allclose( np.array( loop ), d.values[ :n_loop ], rtol=1e-6, atol=1e-9 ):
+                raise AssertionError( 'blocked and per-edge distances differ at dim %d' % dim )
+            t_loop *= float( len(a) ) / max( 1, n_loop )
+            sys.stdout.write('F%d %d %d %.3f %.2f %s%.1f %.1fx %.0f\n' % (dim, dim, len(a), t_load, t_blocked, \
+                             '~' if n_loop < len(a) else '', t_loop, t_loop / max( t_blocked, 1e-9 ), len(a) / max( t_blocked, 1e-9 )))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def write_clique_edge_table( fn, n_images, owner_sizes, n_groups, seed ):
+    #
+    # An edge table whose edges come from owners (same_user 1), groups,
+    # and a sprinkling of random pairs sharing a word, like the cliques
+    # real owners and groups make; written sorted, in canonical form.
+    #
+    rng = random.Random( seed )
+    images = range( n_images )
+    rng.shuffle( images )
+    owner_of = dict()
+    pos = 0
+    for (i, n) in enumerate( owner_sizes ):
+        for x in images[ pos:pos+n ]:
+            owner_of[ x ] = i
+        pos += n
+    groups_of = dict()
+    for g in range( n_groups ):
+        for x in rng.sample( images, rng.randint( 3, 40 )):
+            groups_of.setdefault( x, set() ).add( g )
+    pairs = dict()
+    for i in range( len( owner_sizes )):
+        members = sorted( x for x in owner_of if owner_of[x] == i )
+        for (j, a) in enumerate( members ):
+            for b in members[ j+1: ]:
+                pairs[ (a, b) ] = None
+    members_of = dict()
+    for (x, gs) in groups_of.iteritems():
+        for g in gs:
+            members_of.setdefault( g, list() ).append( x )
+    for members in members_of.itervalues():
+        members.sort()
+        for (j, a) in enumerate( members ):
+            for b in members[ j+1: ]:
+                pairs[ (a, b) ] = None
+    for i in range( n_images ):
+        (a, b) = sorted( rng.sample( images, 2 ))
+        pairs[ (a, b) ] = rng.randint( 0, 999 )
+    with open( fn, 'w' ) as f:
+        for (a, b) in sorted( pairs ):
+            groups = sorted( groups_of.get( a, set() ) & groups_of.get( b, set() ))
+            word = pairs[ (a, b) ]
+            same = (a in owner_of) and (owner_of[a] == owner_of.get( b ))
+            flags = ('1', '0', '0') if same else ('.', '.', '.')
+            f.write( EdgeTable.format_edge( ImageEdge( a, b, groups, [word] if word is not None else [], \
+                                                       [17] if word is not None else [], *flags )))
+    return len( pairs )
+
+def load_for_edge_features( fn ):
+    # what SandboxAdapter does before write_edge_features: load, then read the counts and flags
+    t_start = time.time()
+    if EdgeTable.is_hyper( fn ):
+        edges = HyperedgeTable.read_from_file( fn ).edges
+    else:
+        edges = EdgeTable.read_from_file( fn, columns=() ).edges
+    c = 0
+    for e in edges:
+        c += e.n_shared_words + e.n_shared_groups + len( e.same_user_flag + e.same_location_flag + e.shared_contact_flag )
+    return (len( edges ), time.time() - t_start)
+
+def bench_edge_hyper( args ):
+    # clique-compressed (.cp6h) edge tables: size, conversion, and SandboxAdapter-style loading
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        if args.edge_table:
+            fn = args.edge_table
+        else:
+            fn = os.path.join( tmp_dir, 'clique_edges.txt' )
+            owner_sizes = [ int(x) for x in args.owners.split(',') ]
+            write_clique_edge_table( fn, args.images, owner_sizes, args.groups, args.seed )
+        hyper_fn = os.path.join( tmp_dir, 'edges.cp6h' )
+        (h, t_compress) = timed( HyperedgeTable.from_edges, EdgeTable.iter_file( fn ))
+        h.write_to_file( hyper_fn )
+        back_fn = os.path.join( tmp_dir, 'expanded.txt' )
+        (counts, t_expand) = timed( EdgeTable.copy_file, hyper_fn, back_fn )
+        canon_fn = os.path.join( tmp_dir, 'canonical.txt' )
+        EdgeSorter.sort_files( [fn], canon_fn )
+        same = filecmp.cmp( back_fn, canon_fn, shallow=False )
+        sys.stdout.write('n-edges hyperedges residual-rows txt-bytes cp6h-bytes ratio compress-sec expand-sec round-trip\n')
+        sys.stdout.write('%d %d %d %d %d %.1fx %.2f %.2f %s\n' % (h.n_edges, len( h.owners ) + len( h.groups ) + len( h.words ), \
+                         len( h.residual ), os.path.getsize( fn ), os.path.getsize( hyper_fn ), \
+                         float( os.path.getsize( fn )) / os.path.getsize( hyper_fn ), t_compress, t_expand, 'yes' if same else 'NO'))
+        sys.stdout.write('load-for-edge-features n-edges sec rss-MB\n')
+        for (tag, src) in (('txt', fn), ('cp6h', hyper_fn)):
+            (kb, (n, sec)) = measure_in_child( load_for_edge_features, src )
+            sys.stdout.write('%s %d %.2f %.1f\n' % (tag, n, sec, kb / 1024.0))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def write_synthetic_image_table( fn, n_images, seed, n_owners=None, descr_words=60 ):
+    # Flickr-like rows: short titles, descriptions of up to a few hundred words, some non-ASCII;
+    # owners are nearly all distinct unless drawn from a pool of n_owners
+    rng = random.Random( seed )
+    owners = [ u'%d@N%02d' % (rng.randint( 1000000, 9999999 ), rng.randint( 0, 9 )) for i in range( n_owners ) ] \
+             if n_owners else None
+    vocabulary = [ u'sunset', u'beach', u'caf\u00e9', u'na\u00efve', u'\u6771\u4eac', u'the', u'a', u'of', u'and', \
+                   u'my', u'friend', u'<a href=http://flickr.com/photos/x>link</a>', u'(c)', u'2008', u'photo' ]
+    t = ImageTable()
+    for i in range( n_images ):
+        e = ImageTableEntry()
+        (e.mir_id, e.flickr_id) = (i, 1000000 + i)
+        e.flickr_owner = rng.choice( owners ) if owners else \
+                         u'%d@N%02d' % (rng.randint( 1000000, 9999999 ), rng.randint( 0, 9 ))
+        e.flickr_title = u' '.join( rng.choice( vocabulary ) for j in range( rng.randint( 0, 6 )))
+        n_words = int( rng.expovariate( 1.0 / descr_words ))
+        e.flickr_descr = u' '.join( rng.choice( vocabulary ) for j in range( n_words ))
+        e.exif_data = EXIFData( i, True, '2008:07:%02d' % rng.randint( 1, 28 ), '12:34:56', rng.choice( 'YN' )) \
+                      if rng.random() < 0.8 else EXIFData( i, False, 'none', 'none', 'U' )
+        e.flickr_locality = u'Paris, \u00cele-de-France' if rng.random() < 0.3 else None
+        e.label_vector = [ rng.choice( (-1, 0, 1) ) for j in range( 24 ) ]
+        t.add_entry( e )
+    t.write_to_file( fn )
+
+def read_image_table_codecs( fn ):
+    # ImageTable.read_from_file as it was: codecs reader, character-at-a-time split
+    t = ImageTable()
+    with TableIO.open( fn, 'r', encoding='utf-8' ) as f:
+        for raw_line in f:
+            t.add_entry( ImageTable.entry_from_fields( Util.qstr_split_by_char( raw_line.strip() )))
+    return t
+
+def bench_qstr_split( args ):
+    # Util.qstr_split vs. the character-at-a-time original, and image table reads old vs. new
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        if args.image_table:
+            fn = args.image_table
+        else:
+            fn = os.path.join( tmp_dir, 'image_table.txt' )
+            write_synthetic_image_table( fn, args.images, args.seed )
+        with TableIO.open_text( fn, 'utf-8' ) as f:
+            lines = [ line.strip() for line in f ]
+        sys.stdout.write('%s: %d lines, %.1f MB\n' % (fn, len(lines), os.path.getsize( fn ) / 1048576.0))
+        sys.stdout.write('tokenizer sec us-per-line speedup same\n')
+        (ref, t_ref) = timed( lambda: [ Util.qstr_split_by_char( s ) for s in lines ] )
+        (new, t_new) = timed( lambda: [ Util.qstr_split( s ) for s in lines ] )
+        sys.stdout.write('by-char %.2f %.1f 1.0x\n' % (t_ref, t_ref * 1.0e6 / max( 1, len(lines) )))
+        sys.stdout.write('regex %.2f %.1f %.1fx %s\n' % (t_new, t_new * 1.0e6 / max( 1, len(lines) ), t_ref / max( t_new, 1e-9 ), \
+                                                          'yes' if ref == new else 'NO'))
+        sys.stdout.write('image-table-read sec speedup\n')
+        (old_t, t_old) = timed( read_image_table_codecs, fn )
+        (new_t, t_read) = timed( ImageTable.read_from_file, fn )
+        (old_fn, new_fn) = (os.path.join( tmp_dir, 'old.txt' ), os.path.join( tmp_dir, 'new.txt' ))
+        old_t.write_to_file( old_fn )
+        new_t.write_to_file( new_fn )
+        same = filecmp.cmp( old_fn, new_fn, shallow=False )
+        sys.stdout.write('codecs+by-char %.2f 1.0x\n' % t_old)
+        sys.stdout.write('io+regex %.2f %.1fx %s\n' % (t_read, t_old / max( t_read, 1e-9 ), 'same' if same else 'DIFFERENT'))
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def count_labels_by_line( fn, flag ):
+    # Util.count_labels_in_image_table as it was: every field of every line tokenized
+    counts = dict()
+    with TableIO.open( fn ) as f:
+        for raw_line in f:
+            for (ind, val) in enumerate( Util.qstr_split( raw_line )[9].split(',')):
+                if int(val) == flag:
+                    counts[ ind ] = counts.get( ind, 0 ) + 1
+    return counts
+
+def per_label_loops( t ):
+    # the cp6_eval / write_id_file access pattern: for each label, a pass over the entries
+    n_labels = len( next( t.entries.itervalues() ).label_vector )
+    (counts, positives) = (list(), list())
+    for i in range( n_labels ):
+        (c, ids) = ([0, 0, 0], list())
+        for (image_id, e) in t.entries.iteritems():
+            r = e.label_vector[i]
+            c[ r+1 ] += 1
+            if r == 1:
+                ids.append( image_id )
+        counts.append( c )
+        positives.append( ids )
+    return (counts, positives)
+
+def per_label_columns( t ):
+    m = t.label_matrix()
+    counts = [ [ int( (m.column(i) == r).sum() ) for r in (-1, 0, 1) ] for i in range( m.n_labels() ) ]
+    return (counts, [ m.ids_with( i, 1 ).tolist() for i in range( m.n_labels() ) ])
+
+def bench_label_matrix( args ):
+    # label vectors as a LabelMatrix vs. loops over ImageTableEntries
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        if args.image_table:
+            fn = args.image_table
+        else:
+            fn = os.path.join( tmp_dir, 'image_table.txt' )
+            write_synthetic_image_table( fn, args.images, args.seed )
+        sys.stdout.write('%s: %.1f MB\n' % (fn, os.path.getsize( fn ) / 1048576.0))
+        sys.stdout.write('task method sec speedup same\n')
+
+        (ref, t_ref) = timed( count_labels_by_line, fn, 1 )
+        (m, t_new) = timed( LabelMatrix.read_from_file, fn )
+        new = m.counts( 1 ).tolist()
+        sys.stdout.write('count-labels qstr-split-lines %.2f 1.0x\n' % t_ref)
+        sys.stdout.write('count-labels bulk-field-9 %.2f %.1fx %s\n' % (t_new, t_ref / max( t_new, 1e-9 ), \
+                                                                     'yes' if ref == dict( (i, c) for (i, c) in enumerate( new ) if c ) else 'NO'))
+
+        t = ImageTable.read_from_file( fn )
+        (ref, t_ref) = timed( per_label_loops, t )
+        (new, t_new) = timed( per_label_columns, t )
+        sys.stdout.write('per-label-scan entry-loops %.2f 1.0x\n' % t_ref)
+        sys.stdout.write('per-label-scan matrix-columns %.2f %.1fx %s\n' % (t_new, t_ref / max( t_new, 1e-9 ), \
+                                                                        'yes' if ref == new else 'NO'))
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def bench_row_index( args ):
+    # ImageTable.get through the row index vs. a filtered read of the whole table
+    import numpy as np
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        if args.image_table:
+            fn = args.image_table
+        else:
+            fn = os.path.join( tmp_dir, 'image_table.txt' )
+            write_synthetic_image_table( fn, args.images, args.seed )
+        (index, t_build) = timed( RowIndex.build, fn )
+        sys.stdout.write('%s: %d rows, %.1f MB; index built in %.2f sec\n' % \
+                         (fn, len( index ), os.path.getsize( fn ) / 1048576.0, t_build))
+        rng = random.Random( args.seed )
+        all_ids = index.ids.tolist()
+        RowIndex.loaded.clear()
+        (first, t_first) = timed( ImageTable.get, fn, [ all_ids[0] ] )
+        latencies = list()
+        for k in range( args.lookups ):
+            (t, sec) = timed( ImageTable.get, fn, [ rng.choice( all_ids ) ] )
+            latencies.append( sec )
+        latencies = np.array( latencies ) * 1000.0
+        sys.stdout.write('single-id ms: first %.3f median %.3f p99 %.3f max %.3f\n' % \
+                         (t_first * 1000.0, np.median( latencies ), np.percentile( latencies, 99 ), latencies.max()))
+
+        ids = rng.sample( all_ids, min( args.batch, len(all_ids) ))
+        (got, t_get) = timed( ImageTable.get, fn, ids )
+        (ref, t_ref) = timed( ImageTable.read_from_file, fn, set( ids ))
+        (got_fn, ref_fn) = (os.path.join( tmp_dir, 'got.txt' ), os.path.join( tmp_dir, 'ref.txt' ))
+        got.write_to_file( got_fn )
+        ref.write_to_file( ref_fn )
+        same = filecmp.cmp( got_fn, ref_fn, shallow=False )
+        sys.stdout.write('%d ids: get %.3f sec, read_from_file %.2f sec, %.0fx %s\n' % \
+                         (len(ids), t_get, t_ref, t_ref / max( t_get, 1e-9 ), 'same' if same else 'DIFFERENT'))
+    finally:
+        shutil.rmtree( tmp_dir )
+        if args.image_table and os.path.isdir( RowIndex.index_dir( args.image_table )):
+            shutil.rmtree( RowIndex.index_dir( args.image_table ))
+
+def load_image_table( fn ):
+    t_start = time.time()
+    t = ImageTable.read_from_file( fn )
+    sec = time.time() - t_start
+    owners = set( id( e.flickr_owner ) for e in t.entries.itervalues() )
+    return (len( t.entries ), sec, len( owners ))
+
+def bench_entry_memory( args ):
+    # memory per ImageTable entry (ImageTableEntry, EXIFData, strings, label vector) after read_from_file
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        if args.image_table:
+            fn = args.image_table
+        else:
+            fn = os.path.join( tmp_dir, 'image_table.txt' )
+            # in a child, so building the table doesn't raise this process's high-water mark
+            measure_in_child( write_synthetic_image_table, fn, args.images, args.seed, args.owners, args.descr_words )
+        (kb, (n, sec, n_owner_strings)) = measure_in_child( load_image_table, fn )
+        sys.stdout.write('%s: %.1f MB\n' % (fn, os.path.getsize( fn ) / 1048576.0))
+        sys.stdout.write('n-images load-sec rss-MB bytes-per-entry owner-string-objects\n')
+        sys.stdout.write('%d %.2f %.1f %.0f %d\n' % (n, sec, kb / 1024.0, kb * 1024.0 / max( 1, n ), n_owner_strings))
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def load_image_table_text( fn, text ):
+    t_start = time.time()
+    if text == 'label-matrix':
+        n = len( ImageTable.read_label_matrix( fn ))
+    else:
+        n = len( ImageTable.read_from_file( fn, text=text ).entries )
+    return (n, time.time() - t_start)
+
+def bench_image_table_text( args ):
+    # load time and RSS of an image table (e.g. cp6_eval's answer key) per text mode
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        if args.image_table:
+            fn = args.image_table
+        else:
+            fn = os.path.join( tmp_dir, 'image_table.txt' )
+            measure_in_child( write_synthetic_image_table, fn, args.images, args.seed, args.owners )
+        sys.stdout.write('%s: %.1f MB\n' % (fn, os.path.getsize( fn ) / 1048576.0))
+        sys.stdout.write('mode n-images load-sec rss-MB speedup rss-ratio\n')
+        base = None
+        for text in (ImageTable.TEXT_FULL, ImageTable.TEXT_LAZY, ImageTable.TEXT_DROP, 'label-matrix'):
+            (kb, (n, sec)) = measure_in_child( load_image_table_text, fn, text )
+            if base is None:
+                base = (sec, kb)
+            sys.stdout.write('%s %d %.2f %.1f %.1fx %.2f\n' % (text, n, sec, kb / 1024.0, base[0] / max( sec, 1e-9 ), \
+                                                              kb * 1.0 / max( base[1], 1 )))
+    finally:
+        shutil.rmtree( tmp_dir )
+
+def node_ids_by_line( fn, label_index ):
+    # Util.node_ids_with_label_in_image_table as it was: the whole table tokenized per query
+    node_ids = list()
+    with TableIO.open( fn ) as f:
+        for raw_line in f:
+            fields = Util.qstr_split( raw_line )
+            if int( fields[9].split(',')[ label_index ] ) == 1:
+                node_ids.append( int(fields[0]) )
+    return node_ids
+
+def bench_label_index( args ):
+    # one nodes-with-label query per label: re-parsing the table vs. the label index
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    try:
+        if args.image_table:
+            fn = args.image_table
+        else:
+            fn = os.path.join( tmp_dir, 'image_table.txt' )
+            write_synthetic_image_table( fn, args.images, args.seed )
+        (index, t_build) = timed( LabelIndex.build, fn )
+        n_labels = min( args.labels, index.n_labels() )
+        sys.stdout.write('%s: %d images, %.1f MB; index built in %.2f sec\n' % \
+                         (fn, len( index ), os.path.getsize( fn ) / 1048576.0, t_build))
+        sys.stdout.write('method queries sec ms-per-query same\n')
+        (ref, t_ref) = timed( lambda: [ sorted( node_ids_by_line( fn, j )) for j in range( n_labels ) ] )
+        (mat, t_mat) = timed( lambda: [ sorted( LabelMatrix.read_from_file( fn ).ids_with( j ).tolist() ) for j in range( n_labels ) ] )
+        (new, t_new) = timed( lambda: [ LabelIndex.load( fn ).ids_with( j ).tolist() for j in range( n_labels ) ] )
+        for (method, r, sec) in (('parse-lines', ref, t_ref), ('label-matrix', mat, t_mat), ('label-index', new, t_new)):
+            sys.stdout.write('%s %d %.3f %.3f %s\n' % (method, n_labels, sec, sec * 1000.0 / max( 1, n_labels ), \
+                                                      'yes' if r == ref else 'NO'))
+
+        # 'label 0 AND NOT label 1', by sets from the old helper and by query
+        label2id = { 'a': 0, 'b': 1 }
+        (ids, t_query) = timed( LabelIndex.load( fn ).query, 'a AND NOT b', label2id )
+        same = ids.tolist() == sorted( set( ref[0] ) - set( ref[1] ))
+        sys.stdout.write("query 'a AND NOT b': %d images in %.2f ms %s\n" % (len(ids), t_query * 1000.0, 'same' if same else 'DIFFERENT'))
+    finally:
+        shutil.rmtree( tmp_dir )
+        if args.image_table and os.path.isdir( LabelIndex.index_dir( args.image_table )):
+            shutil.rmtree( LabelIndex.index_dir( args.image_table ))
+
+def cached_table_loaders( image_fn, edge_fn, tmp_dir ):
+    # (name, load, fingerprint) for each cached reader; the fingerprints are compared across loads
+    import numpy as np
+    def write_fingerprint( t, tmp_fn ):
+        t.write_to_file( tmp_fn )
+        with open( tmp_fn ) as f:
+            return hashlib.sha1( f.read() ).hexdigest()
+    return (
+        ('image-table', lambda: ImageTable.read_from_file( image_fn ), \
+         lambda t: write_fingerprint( t, os.path.join( tmp_dir, 'check_image_table.txt' ))),
+        ('label-matrix', lambda: LabelMatrix.read_from_file( image_fn ), \
+         lambda m: hashlib.sha1( np.asarray( m.ids ).tostring() + np.asarray( m.values ).tostring() ).hexdigest()),
+        ('edges-compact', lambda: EdgeTable.read_from_file( edge_fn, None, True ), \
+         lambda t: write_fingerprint( t, os.path.join( tmp_dir, 'check_edges.txt' ))))
+
+def bench_table_cache( args ):
+    # reads with the table cache off, on a miss (parse and store), and on a hit; then eviction
+    tmp_dir = tempfile.mkdtemp( prefix='cp6_bench_' )
+    cache_dir = os.path.join( tmp_dir, 'cache' )
+    saved_env = os.environ.get( TableCache.ENV_DIR )
+    try:
+        if args.image_table:
+            image_fn = args.image_table
+        else:
+            image_fn = os.path.join( tmp_dir, 'image_table.txt' )
+            measure_in_child( write_synthetic_image_table, image_fn, args.images, args.seed )
+        edge_fn = edge_table_arg( args, tmp_dir )
+        sys.stdout.write('%s: %.1f MB; %s: %.1f MB\n' % (image_fn, os.path.getsize( image_fn ) / 1048576.0, \
+                                                        edge_fn, os.path.getsize( edge_fn ) / 1048576.0))
+        sys.stdout.write('table off-sec miss-sec hit-sec speedup same\n')
+        for (name, load, fingerprint) in cached_table_loaders( image_fn, edge_fn, tmp_dir ):
+            os.environ.pop( TableCache.ENV_DIR, None )
+            (ref, t_off) = timed( load )
+            ref = fingerprint( ref )
+            os.environ[ TableCache.ENV_DIR ] = cache_dir
+            (miss, t_miss) = timed( load )
+            (hit, t_hit) = timed( load )
+            same = (fingerprint( miss ) == ref) and (fingerprint( hit ) == ref)
+            sys.stdout.write('%s %.3f %.3f %.3f %.1fx %s\n' % (name, t_off, t_miss, t_hit, t_off / max( t_hit, 1e-9 ), \
+                                                               'yes' if same else 'NO'))
+            sys.stdout.flush()
+
+        # evict down to half the cache; the least recently used (the first tables) go first
+        entries = TableCache.entries( cache_dir )
+        total = sum( e[1] for e in entries )
+        TableCache.evict( cache_dir, total // 2 )
+        kept = TableCache.entries( cache_dir )
+        sys.stdout.write('eviction to %.1f MB: %d of %d entries (%.1f MB) kept: %s\n' % \
+                         (total / 2097152.0, len(kept), len(entries), sum( e[1] for e in kept ) / 1048576.0, \
+                          ' '.join( os.path.basename( e[2] ).split( '-' )[0] for e in sorted( kept ))))
+    finally:
+        if saved_env is None:
+            os.environ.pop( TableCache.ENV_DIR, None )
+        else:
+            os.environ[ TableCache.ENV_DIR ] = saved_env
+        shutil.rmtree( tmp_dir )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='PPAML CP6 benchmarks' )
+    subparsers = parser.add_subparsers( dest='benchmark' )
+
+    p = subparsers.add_parser( 'edges', help='all-pairs vs. posting-list edge generation' )
+    p.add_argument( '--sizes', default='5000,25000,250000', help='comma-separated list of synthetic image counts' )
+    p.add_argument( '--brute-limit', type=int, default=5000, help='largest size to run the all-pairs version on' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_edges )
+
+    p = subparsers.add_parser( 'edge-memory', help='memory of ImageEdge lists vs. compact EdgeTables' )
+    p.add_argument( '--edge-table', help='edge table to load (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count if no --edge-table' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_edge_memory )
+
+    p = subparsers.add_parser( 'parallel-read', help='chunked parallel edge table parsing vs. worker count' )
+    p.add_argument( '--edge-table', help='edge table to read (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=250000, help='synthetic image count if no --edge-table' )
+    p.add_argument( '--workers', default='1,2,4,8', help='comma-separated worker counts; the first is the baseline' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_parallel_read )
+
+    p = subparsers.add_parser( 'edge-index', help='per-node edge index queries vs. table scans' )
+    p.add_argument( '--edge-table', help='edge table to index (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count if no --edge-table' )
+    p.add_argument( '--queries', type=int, default=1000, help='number of neighbors / has-edge queries' )
+    p.add_argument( '--subgraph-size', type=int, default=1000, help='nodes in the induced subgraph query' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_edge_index )
+
+    p = subparsers.add_parser( 'edge-archive', help='.cp6e archival edge tables vs. gzip' )
+    p.add_argument( '--edge-table', help='edge table to compress, e.g. from the round-1-public sandbox (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count if no --edge-table' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_edge_archive )
+
+    p = subparsers.add_parser( 'compressed-read', help='edge table reads, plain vs. gzip/bz2/xz' )
+    p.add_argument( '--edge-table', help='edge table to read (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count if no --edge-table' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_compressed_read )
+
+    p = subparsers.add_parser( 'edge-sort', help='external edge table sort/dedup vs. an in-memory sort' )
+    p.add_argument( '--edge-table', help='edge table to shuffle and sort (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count if no --edge-table' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.add_argument( '--run-edges', default='10000,100000,1000000', help='comma list of run sizes to try' )
+    p.set_defaults( func=bench_edge_sort )
+
+    p = subparsers.add_parser( 'edge-route', help='single-pass multi-output edge filtering vs. one pass per output' )
+    p.add_argument( '--edge-table', help='edge table to filter (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count if no --edge-table' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.add_argument( '--outputs', default='1,2,4,8', help='comma list of output counts to try' )
+    p.set_defaults( func=bench_edge_route )
+
+    p = subparsers.add_parser( 'edge-sparsify', help='top-k edge sparsification: reduction, speed, and neighbor-vote mAP' )
+    p.add_argument( '--sandbox', help='sandbox whose run_in/training edges and labels to use (default: synthetic edges, no mAP)' )
+    p.add_argument( '--edge-table', help='edge table to sparsify if no --sandbox (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count if no --edge-table' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.add_argument( '--k', default='1,5,10,50', help='comma list of per-node edge budgets' )
+    p.add_argument( '--score', default='', help='score weights, as for edge_sparsify.py --score' )
+    p.set_defaults( func=bench_edge_sparsify )
+
+    p = subparsers.add_parser( 'partition', help='balanced k-way graph partition cut vs. random assignment' )
+    p.add_argument( '--edge-table', help='edge table to partition (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count if no --edge-table' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.add_argument( '--k', default='2,4,8', help='comma list of partition counts' )
+    p.add_argument( '--imbalance', type=float, default=GraphPartitioner.IMBALANCE, help='allowed partition size excess' )
+    p.set_defaults( func=bench_partition )
+
+    p = subparsers.add_parser( 'edge-stats', help='edge table histograms from text, archive, and column sources' )
+    p.add_argument( '--edge-table', help='edge table (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count if no --edge-table' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.add_argument( '--workers', default='1,4', help='comma list of text parse worker counts' )
+    p.set_defaults( func=bench_edge_stats )
+
+    p = subparsers.add_parser( 'edge-intern', help='memory and archive size with interned (shared) edge lists' )
+    p.add_argument( '--edge-table', help='edge table, e.g. from the round-1-public sandbox (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count if no --edge-table' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_edge_intern )
+
+    p = subparsers.add_parser( 'edge-distances', help='per-edge visual feature distances, blocked vs. per-edge loop' )
+    p.add_argument( '--edge-table', help='edge table (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count if no --edge-table' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.add_argument( '--dims', default='144,480,1032', help='comma list of synthetic feature dimensions (CEDD, Gabor, Scalable Color)' )
+    p.add_argument( '--loop-edges', type=int, default=20000, help='edges to time the per-edge loop on (extrapolated)' )
+    p.set_defaults( func=bench_edge_distances )
+
+    p = subparsers.add_parser( 'edge-hyper', help='clique-compressed (.cp6h) edge tables vs. text' )
+    p.add_argument( '--edge-table', help='edge table (default: synthetic, with owner and group cliques)' )
+    p.add_argument( '--images', type=int, default=20000, help='synthetic image count if no --edge-table' )
+    p.add_argument( '--owners', default='2000,500,200,100,50', help='comma list of synthetic owner photo counts' )
+    p.add_argument( '--groups', type=int, default=2000, help='synthetic group count' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_edge_hyper )
+
+    p = subparsers.add_parser( 'qstr-split', help='Util.qstr_split and image table reads vs. the character-at-a-time tokenizer' )
+    p.add_argument( '--image-table', help='image table, e.g. run_in/training/image_table.txt (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=25000, help='synthetic image count if no --image-table' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_qstr_split )
+
+    p = subparsers.add_parser( 'label-matrix', help='label counts and per-label scans: LabelMatrix vs. loops over image table entries' )
+    p.add_argument( '--image-table', help='image table, e.g. run_in/training/image_table.txt (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=25000, help='synthetic image count if no --image-table' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_label_matrix )
+
+    p = subparsers.add_parser( 'row-index', help='ImageTable.get via the row index: single-ID latency and batch lookups' )
+    p.add_argument( '--image-table', help='image table, e.g. run_in/training/image_table.txt (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count if no --image-table' )
+    p.add_argument( '--lookups', type=int, default=1000, help='single-ID lookups to time' )
+    p.add_argument( '--batch', type=int, default=1000, help='IDs in the batch lookup' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_row_index )
+
+    p = subparsers.add_parser( 'entry-memory', help='memory per image table entry after ImageTable.read_from_file' )
+    p.add_argument( '--image-table', help='image table, e.g. run_in/training/image_table.txt (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=1000000, help='synthetic image count if no --image-table' )
+    p.add_argument( '--owners', type=int, default=50000, help='distinct owners in the synthetic table' )
+    p.add_argument( '--descr-words', type=int, default=5, help='mean synthetic description length, in words' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_entry_memory )
+
+    p = subparsers.add_parser( 'image-table-text', help='image table load time and RSS with titles and descriptions decoded, lazy, or dropped' )
+    p.add_argument( '--image-table', help='image table, e.g. eval_in/testing/image_table.txt (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=200000, help='synthetic image count if no --image-table' )
+    p.add_argument( '--owners', type=int, default=20000, help='distinct owners in the synthetic table' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_image_table_text )
+
+    p = subparsers.add_parser( 'label-index', help='nodes-with-label queries: re-parsing the image table vs. the label index' )
+    p.add_argument( '--image-table', help='image table, e.g. run_in/training/image_table.txt (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count if no --image-table' )
+    p.add_argument( '--labels', type=int, default=24, help='number of labels to query' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_label_index )
+
+    p = subparsers.add_parser( 'table-cache', help='table reads with the parsed-table cache off, on a miss, and on a hit' )
+    p.add_argument( '--image-table', help='image table to read (default: synthetic)' )
+    p.add_argument( '--edge-table', help='edge table to read (default: synthetic)' )
+    p.add_argument( '--images', type=int, default=100000, help='synthetic image count for the tables not given' )
+    p.add_argument( '--seed', type=int, default=1, help='random number seed' )
+    p.set_defaults( func=bench_table_cache )
+
+    args = parser.parse_args()
+    args.func( args )
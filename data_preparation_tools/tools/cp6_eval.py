@@ -69,11 +69,11 @@
 
 import sys
 import argparse
-import random
 
-from cp6.utilities.util import Util
+import numpy as np
+
 from cp6.tables.image_table import ImageTable
-from cp6.utilities.image_table_entry import ImageTableEntry
+from cp6.tables.label_matrix import LabelMatrix
 from cp6.tables.label_table import LabelTable
 
 ##
@@ -114,6 +114,43 @@ def calculate_AP( relevant_map, score_map ):
     avgprec = 1.0*sum_ap / n_relevant_retrievals if n_relevant_retrievals > 0 else -1
     return (avgprec, n_retrievals)
 
+def calculate_AP_columns( image_ids, relevant, scores ):
+    #
+    # calculate_AP over arrays: relevant[k] and scores[k] are the truth and
+    # score of image_ids[k]. Ties in score are broken the way calculate_AP
+    # breaks them (by the iteration order of its score_map dict), so the
+    # APs come out identical.
+    #
+    n = len( image_ids )
+    dict_order = np.array( dict( zip( image_ids, range(n) )).values(), dtype=np.int64 )
+    (relevant, scores) = (relevant[ dict_order ], scores[ dict_order ])
+    ranked = relevant[ np.argsort( -scores, kind='mergesort' ) ]
+    hits = np.flatnonzero( ranked ) + 1
+    if len( hits ) == 0:
+        return (-1, n)
+    # summing in rank order, in python, to match calculate_AP's rounding
+    sum_ap = sum( ( np.arange( 1, len(hits)+1 ) * 1.0 / hits ).tolist(), 0 )
+    return (1.0 * sum_ap / len(hits), n)
+
+def read_score_table( fn, nLabels ):
+    # the scoring-only pseudo-image-table: 'image_id score_1 ... score_nLabels' per line
+    with open( fn ) as f:
+        lines = [ line for line in f.read().splitlines() if line.strip() ]
+    v = np.fromstring( ' '.join( lines ), dtype=np.float64, sep=' ' )
+    if len(v) != len(lines) * (nLabels+1):
+        for (i, line) in enumerate( lines, 1 ):
+            fields = line.split()
+            if len(fields) != (nLabels+1):
+                raise AssertionError('Attempted to read %s as a score-only pseudo-image-table, but found %d fields on line %d; expected %d\n' % \
+                                     (fn, len(fields), i, (nLabels+1)))
+        raise AssertionError('Attempted to read %s as a score-only pseudo-image-table, but could not parse its scores' % fn )
+    v = v.reshape( len(lines), nLabels+1 )
+    ids = np.array( [ int( line.split( None, 1 )[0] ) for line in lines ], dtype=np.int64 )
+    # a repeated image ID keeps its last line
+    (unique_ids, last) = np.unique( ids[::-1], return_index=True )
+    keep = np.sort( len(ids) - 1 - last )
+    return LabelMatrix( ids[ keep ], v[ keep, 1: ] )
+
 # AP test case
 def mk_correct_map():
     return { 0:1, 1:0, 2:1, 3:0, 4:1, 5:1}
@@ -127,6 +164,10 @@ def float_test( msg, expected, actual, eps = 1.0e-4 ):
 def test_AP():
     (ap_1, n_1) = calculate_AP(mk_correct_map(), mk_score_map())
     float_test( 'AP test #1', 0.7333333333333333, ap_1 )
+    (relevant, scores) = (mk_correct_map(), mk_score_map())
+    (ap_2, n_2) = calculate_AP_columns( relevant.keys(), np.array( [ relevant[k] == 1 for k in relevant ] ), \
+                                        np.array( [ scores[k] for k in relevant ], dtype=np.float64 ))
+    float_test( 'AP columns test #1', ap_1, ap_2, 1.0e-12 )
 
 def test_mAP():
     #
@@ -171,8 +212,8 @@ def main():
     lt = LabelTable.read_from_file( args.lt )
     sys.stderr.write('Info: read %d labels\n' % len(lt.idset))
 
-    true_it = ImageTable.read_from_file( args.tt )
-    sys.stderr.write('Info: read %d answer-key entries\n' % len( true_it.entries ))
+    true_lm = ImageTable.read_label_matrix( args.tt )
+    sys.stderr.write('Info: read %d answer-key entries\n' % len( true_lm ))
 
     nLabels = len(lt.idset)
 
@@ -186,47 +227,25 @@ def main():
 
     if n_fields == nLabels + 1:
         # attempt to read as a scoring-only pseudo-image-table
-        computed_it = ImageTable()
-        with open( args.ct ) as f:
-            while 1:
-                raw_line = f.readline()
-                if not raw_line:
-                    break
-                fields = raw_line.split()
-                if len(fields) != (nLabels+1):
-                    raise AssertionError('Attempted to read %s as a score-only pseudo-image-table, but found %d fields on line %d; expected %d\n' % \
-                                        (len(fields), len(t.entries)+1, (nLabels+1)))
-                e = ImageTableEntry()
-                e.mir_id = int(fields[0])
-                e.label_vector = map(float, fields[1:])
-                computed_it.entries[ e.mir_id ] = e
-
+        computed_lm = read_score_table( args.ct, nLabels )
     else:
         # read as a full-up image table
-        computed_it = ImageTable.read_from_file( args.ct )
+        computed_lm = LabelMatrix.read_from_file( args.ct, dtype=np.float64 )
 
-    sys.stderr.write('Info: read %d computed entries\n' % len(computed_it.entries ))
+    sys.stderr.write('Info: read %d computed entries\n' % len( computed_lm ))
 
     if args.r is not None:
         if args.r == 'b':
             sys.stderr.write('Info: Replacing computed answers with random 50/50 yes/no results...\n')
-            for (k, e) in computed_it.entries.iteritems():
-                for i in range(0, len(e.label_vector)):
-                    e.label_vector[i] = random.choice( [-1, 1] )
+            computed_lm.values[:] = np.random.choice( [-1, 1], size=computed_lm.values.shape )
 
         elif args.r == 'p':
             sys.stderr.write('Info: Replacing computed answers with random yes/no results based on truth priors...\n')
             # compute priors
-            counts = [0] * nLabels
-            for (k, e) in true_it.entries.iteritems():
-                for i in range(0, len(e.label_vector)):
-                    if e.label_vector[i] == 1:
-                        counts[i] += 1
-            nOpportunities = len(computed_it.entries)
-            for (k, e) in computed_it.entries.iteritems():
-                for i in range(0, len(e.label_vector)):
-                    v = random.randint(0, nOpportunities)
-                    e.label_vector[i] = 1 if v < counts[i] else -1
+            counts = true_lm.counts( 1 )
+            nOpportunities = len( computed_lm )
+            v = np.random.randint( 0, nOpportunities+1, size=computed_lm.values.shape )
+            computed_lm.values[:] = np.where( v < counts, 1, -1 )
         else:
             raise AssertionError('Logic error: unexpected "-r" argument %s' % args.r )
 
@@ -249,15 +268,20 @@ def main():
 # ...then report average of all AP@i
 #
 
-# key: image id; val: 0x01 if in truth, 0x02 if in computed
-    image_id_state_map = { i:0x02 for i in computed_it.entries.keys() }
-    for i in true_it.entries.keys():
-        v = 0x03 if i in image_id_state_map else 0x01
-        image_id_state_map[i] = v
-
-    sys.stderr.write('Info: Scored:     %d\n' % image_id_state_map.values().count( 0x03 ))
-    sys.stderr.write('Info: Unscored:   %d\n' % image_id_state_map.values().count( 0x01 ))
-    sys.stderr.write('Info: Extraneous: %d\n' % image_id_state_map.values().count( 0x02 ))
+# Work on the images in both tables, as columns: the truth and computed
+# label values, rows in the order calculate_AP has always seen them (the
+# iteration order of a dict of the truth table's image IDs.)
+    computed_rows = computed_lm.rows_of( true_lm.ids )
+    n_scored = int( ( computed_rows >= 0 ).sum() )
+    sys.stderr.write('Info: Scored:     %d\n' % n_scored )
+    sys.stderr.write('Info: Unscored:   %d\n' % (len( true_lm ) - n_scored))
+    sys.stderr.write('Info: Extraneous: %d\n' % (len( computed_lm ) - n_scored))
+
+    true_rows = np.array( dict( zip( true_lm.ids.tolist(), range( len( true_lm )))).values(), dtype=np.int64 )
+    true_rows = true_rows[ computed_rows[ true_rows ] >= 0 ]
+    image_ids = true_lm.ids[ true_rows ].tolist()
+    truth = true_lm.values[ true_rows ]
+    computed = computed_lm.values[ computed_rows[ true_rows ]]
 
 # emit CSV header
     sys.stdout.write('"index","label","AP","n-predictions","BER","n-instances","n-correct","%-correct","n-true-pos","n-est-pos-correct","pD","n-est-pos-wrong","n-true-neg","n-est-neg-correct","n-est-neg-wrong","FPR","FNR"\n')
@@ -265,61 +289,35 @@ def main():
     avgprecList = []
 
     for i in range(0, nLabels):
-        # create mapping from computed score to correct/incorrect
-        # ...need to allow for duplicate score values! Python doesn't seem
-        # to have a native multimap :(
-
         t = threshold_table[i]
-        score_map = dict()  # key: image_id, val: score
-        correct_map = dict() # key: image_id, val: True if correct, False if not -- this is NOT the "relevant" table used for AP
-        relevant_map = dict() # key: image_id, val: True is label is set, False if not
-
-        (n_instances, n_true_pos, n_predicted_pos_correct, n_predicted_pos_wrong, n_true_neg, n_predicted_neg_correct, n_predicted_neg_wrong) = (0,0,0,0,0,0,0)
-
-        for (image_id, true_image_entry) in true_it.entries.iteritems():
-            if image_id_state_map[ image_id ] != 0x03:
-                continue
-            s = computed_it.entries[ image_id ].label_vector[ i ]
-            r = true_image_entry.label_vector[ i ]
-            relevant_map[ image_id ] = r
-            if r == -1:
-                # don't score this label; skip
-                continue
-
-            n_instances += 1
-            score_map[ image_id ] = s
-
-            if  r == 1:
-                n_true_pos += 1
-                result = (s >= t)
-                if result:
-                    # truth is 1, result is 1: got it!
-                    n_predicted_pos_correct += 1
-                else:
-                    # truth is 1, result is 0: false negative
-                    n_predicted_neg_wrong += 1
-            elif r == 0:
-                n_true_neg += 1
-                result = (s < t)
-                if result:
-                    # truth is 0, result is 0: got it!
-                    n_predicted_neg_correct += 1
-                else:
-                    # truth is 0, result is 1: false positive
-                    n_predicted_pos_wrong += 1
-            else:
-                raise AssertionError( 'Image %d label %d: unexpected label vector value %f\n' % (image_id, i, r))
-
-            correct_map[ image_id ] = result
+        (r, s) = (truth[:, i], computed[:, i])
 
+        bad = np.flatnonzero( (r != 1) & (r != 0) & (r != -1) )
+        if len( bad ):
+            raise AssertionError( 'Image %d label %d: unexpected label vector value %f\n' % (image_ids[ bad[0] ], i, r[ bad[0] ]))
+
+        # -1: don't score this label
+        scored = np.flatnonzero( r != -1 )
+        n_instances = len( scored )
         if n_instances == 0:
             sys.stderr.write('Info: Skipping label %d: %s\n'% (i,lt.id2label[i]))
             continue
-
-        avgprec, n_predictions = calculate_AP( relevant_map, score_map )
+        (r, s) = (r[ scored ], s[ scored ])
+        (true_pos, true_neg) = (r == 1, r == 0)
+
+        n_true_pos = int( true_pos.sum() )
+        # truth is 1, result is 1: got it! (otherwise, a false negative)
+        n_predicted_pos_correct = int( ( true_pos & (s >= t) ).sum() )
+        n_predicted_neg_wrong = n_true_pos - n_predicted_pos_correct
+        n_true_neg = int( true_neg.sum() )
+        # truth is 0, result is 0: got it! (otherwise, a false positive)
+        n_predicted_neg_correct = int( ( true_neg & (s < t) ).sum() )
+        n_predicted_pos_wrong = n_true_neg - n_predicted_neg_correct
+
+        avgprec, n_predictions = calculate_AP_columns( [ image_ids[k] for k in scored.tolist() ], true_pos, s )
         avgprecList.append(avgprec)
 
-        n_correct_total = correct_map.values().count( True )
+        n_correct_total = n_predicted_pos_correct + n_predicted_neg_correct
 
         sys.stdout.write('%d,%s,' % (i, lt.id2label[i]))
         sys.stdout.write('%0.5f,%d,' % (avgprec, n_predictions) )
@@ -42,20 +42,20 @@ from igraph.drawing.text import TextDrawer
 
 from cp6.utilities.paths import Paths
 from cp6.utilities.util import Util
-from cp6.tables.cp6_image_edge import CP6ImageEdge
+from cp6.tables.edge_index import EdgeIndex
 
 (PHASE, LABEL) = ('r1train', 'car')
 
 def shared_groups_only( e ):
-    return (len(e.shared_groups) > 0) and \
-        (len(e.shared_words) == 0) and \
+    return (e.n_shared_groups > 0) and \
+        (e.n_shared_words == 0) and \
         (e.same_user_flag != '1') and \
         (e.same_location_flag != '1') and \
         (e.shared_contact_flag != '1')
 
 def shared_flags_only( e ):
-    return (len(e.shared_groups) == 0) and \
-        (len(e.shared_words) == 0) and \
+    return (e.n_shared_groups == 0) and \
+        (e.n_shared_words == 0) and \
         (   (e.same_user_flag == '1') or \
             (e.same_location_flag == '1') or \
             (e.shared_contact_flag == '1'))
@@ -64,8 +64,8 @@ def all_edges(e):
     return True
 
 def only_N_shared_words( e, N ):
-    return (len(e.shared_groups) == 0) and \
-        (len(e.shared_words) == N ) and \
+    return (e.n_shared_groups == 0) and \
+        (e.n_shared_words == N ) and \
         (e.same_user_flag != '1') and \
         (e.same_location_flag != '1') and \
         (e.shared_contact_flag != '1')
@@ -91,7 +91,8 @@ def make_graph( node_id_map, nodes, edges, edges_predicate, output_fn, tag ):
 
 p = Paths()
 nodes = Util.nodes_with_label(p, PHASE, LABEL)
-edges = CP6ImageEdge.edges_in_nodeset( p, PHASE, nodes)
+edges = EdgeIndex.load( p.phase_tables[PHASE].image_edge_table ).induced_subgraph( nodes, columns=() )
+sys.stderr.write('Info: %d edges among %d nodes\n' % (len(edges), len(nodes)))
 
 # map node and edge IDs to graph vertex ordinals
 node_id_map = dict( [val, idx] for (idx, val) in enumerate(nodes))
@@ -46,8 +46,8 @@ img_id = int(sys.argv[3])
 iilut = ImageIndicatorLookupTable.read_from_file( sys.argv[1] )
 sys.stderr.write( 'Info: IILUT has %d groups, %d tags\n' % (len(iilut.group_text_lut), len(iilut.tag_word_text_lut)))
 
-iit = ImageIndicatorTable.read_from_file( sys.argv[2] )
-sys.stderr.write( 'Info: IIT has %d images\n' % len(iit.image_indicators ))
+# seek to just this image's row rather than parsing the whole table
+iit = ImageIndicatorTable.get( sys.argv[2], [img_id] )
 
 if img_id not in iit.image_indicators:
     sys.stderr.write('Error: image ID %d not present in image indicator table\n' % img_id )
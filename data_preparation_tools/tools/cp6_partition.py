@@ -0,0 +1,136 @@
+# Copyright 2015 Kitware, Inc.
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+#  * Neither name of Kitware, Inc. nor the names of any contributors may be used
+#    to endorse or promote products derived from this software without specific
+#    prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS ``AS IS''
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE AUTHORS OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Part of the DARPA PPAML CP6 toolset; poc: roddy.collins@kitware.com
+#
+
+#
+# Split a sandbox into k smaller, independent sandboxes along its image
+# graph.
+#
+
+import sys
+import os
+import shutil
+import argparse
+
+from cp6.tables.edge_table import EdgeTable
+from cp6.tables.edge_partition import EdgeGraph, GraphPartitioner
+from cp6.tables.image_indicator_table import ImageIndicatorTable
+from cp6.utilities.table_io import TableIO
+from cp6_subset import SandboxPaths, SandboxSubsetWorker
+
+#
+# The training and testing images of src are each partitioned k ways
+# (see edge_partition.py) so that each partition has about the same
+# number of images and as few edges as possible cross partitions;
+# partition i's training and testing images go to dst/part_<i>, a full
+# sandbox laid out as in cp6_subset.py. Cut edges are dropped. Each
+# partition sandbox also gets partition.txt, listing its images in the
+# cp6_sandbox.py id-file format ('A id' for training, 'B id' for testing.)
+#
+# This is what the CRF baseline's hand-split "four independent databases"
+# are for: separate learners or inference runs can then work on the
+# partitions in parallel.
+#
+
+class SandboxPartitioner:
+    def __init__( self, src_dir, dst_dir, k, edge_format = None ):
+        self.src = SandboxPaths( src_dir )
+        self.k = k
+        if os.path.isdir( dst_dir ):
+            sys.stderr.write('Info: removing existing partition root %s...\n' % dst_dir )
+            shutil.rmtree( dst_dir )
+        os.mkdir( dst_dir )
+        self.workers = list()
+        for i in range( k ):
+            dst = SandboxPaths( os.path.join( dst_dir, 'part_%02d' % i ))
+            dst.mkdirs()
+            self.workers.append( SandboxSubsetWorker( self.src, dst, edge_format ))
+        # the source tables are loaded once and shared
+        w0 = self.workers[0]
+        w0.cache_image_tables()
+        for w in self.workers[1:]:
+            (w.image_table_train, w.image_table_test, w.image_table_eval) = \
+                (w0.image_table_train, w0.image_table_test, w0.image_table_eval)
+            w.image_table_fns = w0.image_table_fns
+        self.parts = dict()
+
+    def partition( self, imbalance = None ):
+        # image ID sets per partition, for run_training and run_testing
+        w0 = self.workers[0]
+        for (tag, table) in (('run_training', w0.image_table_train), ('run_testing', w0.image_table_test)):
+            sys.stderr.write('Info: partitioning %s %d ways\n' % (tag, self.k))
+            g = EdgeGraph.from_edge_table( EdgeTable.find_table( self.src.dirs[ tag ] ), table.entries.keys() )
+            parts = GraphPartitioner.partition_ids( g, self.k, imbalance )
+            if not all( parts ):
+                raise AssertionError( 'Only %d images in %s; too few for %d partitions' % (len(g), tag, self.k))
+            self.parts[ tag ] = [ set( p ) for p in parts ]
+
+    def write( self ):
+        (train, test) = (self.parts['run_training'], self.parts['run_testing'])
+        for (i, w) in enumerate( self.workers ):
+            w.populate_etc()
+            w.downsample_image_file( w.image_table_eval, 'eval_testing', test[i], False )
+            w.downsample_image_file( w.image_table_test, 'run_testing', test[i], True )
+            w.downsample_image_file( w.image_table_train, 'run_training', train[i], False )
+            w.downsample_feature_files( 'run_testing', test[i] )
+            w.downsample_feature_files( 'run_training', train[i] )
+            with open( os.path.join( w.dst.dirs['root'], 'partition.txt' ), 'w' ) as f:
+                for (code, ids) in (('A', train[i]), ('B', test[i])):
+                    for id in sorted( ids ):
+                        f.write( '%s %d\n' % (code, id) )
+
+        # one pass over each source edge table for all the partitions
+        SandboxSubsetWorker.downsample_edge_files_for( [ (w, tag, self.parts[ tag ][i]) \
+                                                         for tag in ('run_training', 'run_testing') \
+                                                         for (i, w) in enumerate( self.workers ) ] )
+
+        for tag in ('run_training', 'run_testing'):
+            src_fn = TableIO.find_required( self.src.dirs[ tag ], 'image_indicator_table.txt' )
+            iit = ImageIndicatorTable.read_from_file( src_fn )
+            for (i, w) in enumerate( self.workers ):
+                iit.write_to_file( TableIO.like( os.path.join( w.dst.dirs[ tag ], 'image_indicator_table.txt' ), src_fn ), \
+                                   self.parts[ tag ][i] )
+            sys.stderr.write( 'Info: partitioned %s image_indicator_table\n' % tag )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='PPAML CP6 sandbox partitioning tool' )
+    parser.add_argument( '--src', required=True, help='source sandbox' )
+    parser.add_argument( '--dst', required=True, help='destination root for the part_NN sandboxes (will be wiped and recreated)' )
+    parser.add_argument( '-k', type=int, required=True, help='number of partitions' )
+    parser.add_argument( '--imbalance', type=float, default=GraphPartitioner.IMBALANCE, \
+                         help='allowed partition size excess over n/k, as a fraction (default %(default)s)' )
+    parser.add_argument( '--edge-format', choices=[ f.lstrip('.') for f in EdgeTable.FORMATS ], \
+                         help='edge table format to write: txt, the compact cp6e archive, or clique-compressed cp6h ' \
+                              '(holds the whole table in memory until written; default: same as source)' )
+    args = parser.parse_args()
+
+    p = SandboxPartitioner( args.src, args.dst, args.k, '.' + args.edge_format if args.edge_format else None )
+    p.partition( args.imbalance )
+    p.write()
@@ -40,6 +40,7 @@ import shutil
 
 from cp6.tables.edge_table import EdgeTable
 from cp6.tables.image_table import ImageTable
+from cp6.utilities.table_io import TableIO
 
 #
 # Given a fully populated set of source files, we take a set of IDs:
@@ -50,6 +51,9 @@ from cp6.tables.image_table import ImageTable
 #
 # Each of A and B require a closed set of edges.
 #
+# Any of the source files may be compressed (see table_io.py); files
+# derived from a compressed source are written compressed the same way.
+#
 # .
 # +-- eval_in
 # |   +-- etc
@@ -62,13 +66,13 @@ from cp6.tables.image_table import ImageTable
 # +-- run_in
 # |   +-- testing
 # |   |   +-- caffe_histograms.txt
-# |   |   +-- image_edge_table.txt
+# |   |   +-- image_edge_table.txt (or .cp6e / .cp6h, see edge_archive.py, edge_hypergraph.py)
 # |   |   +-- image_indicator_table.txt
 # |   |   +-- image_table.txt
 # |   |   +-- image_feature_group
 # |   +-- training
 # |       +-- caffe_histograms.txt
-# |       +-- image_edge_table.txt
+# |       +-- image_edge_table.txt (or .cp6e / .cp6h)
 # |       +-- image_indicator_table.txt
 # |       +-- image_table.txt
 # |       +-- image_feature_group
@@ -76,7 +80,7 @@ from cp6.tables.image_table import ImageTable
 #
 
 class SandboxPaths:
-    def __init__( self, src_dir, target_dir ):
+    def __init__( self, src_dir, target_dir, edge_format = None ):
         if os.path.exists( target_dir ):
             raise AssertionError( '%s exists; please remove and re-run' % target_dir )
         self.dirs = dict()
@@ -99,39 +103,54 @@ class SandboxPaths:
             os.mkdir( self.dirs[d] )
 
         self.src_dir = src_dir
+        # extension for written edge tables ('.txt', '.cp6e' or '.cp6h'); None to follow the source.
+        # A .cp6h table is clique-compressed, and its edges are held in memory until it's closed.
+        self.edge_format = edge_format
 
 
     def populate_etc( self ):
         # copy over the files which don't change
         for i in ['caffe_dictionary.txt', 'image_indicator_lookup_table.txt', 'label_table.txt' ]:
-            src_fn = os.path.join( self.src_dir,'fixed', i )
-            if not os.path.isfile( src_fn ):
-                raise AssertionError( 'No file %s' % src_fn )
-            shutil.copy( src_fn, os.path.join( self.dirs['etc'], i ))
+            src_fn = TableIO.find( os.path.join( self.src_dir,'fixed' ), i )
+            if src_fn is None:
+                raise AssertionError( 'No file %s' % os.path.join( self.src_dir,'fixed', i ))
+            shutil.copy( src_fn, os.path.join( self.dirs['etc'], os.path.basename( src_fn )))
             sys.stderr.write('Info: copied %s\n' % i)
 
+    def downsample_edge_files( self, tag_ids ):
+        # tag_ids maps each destination dir tag to its ids; the source edge
+        # table is streamed once for all of them, never held in memory
+        edge_src_fn = EdgeTable.find_table( os.path.join( self.src_dir, 'edge' ))
+        ext = self.edge_format or EdgeTable.format_of( edge_src_fn )
+        outputs = list()
+        for (tag, ids) in sorted( tag_ids.items() ):
+            fn = TableIO.like( os.path.join( self.dirs[ tag ], 'image_edge_table' + ext ), edge_src_fn )
+            sys.stderr.write( 'Info: writing %s from %s, filtered to %d nodes\n' % (fn, edge_src_fn, len(ids)) )
+            outputs.append( (fn, ids) )
+        (c_read, c_written) = EdgeTable.route_file( edge_src_fn, outputs )
+        for ((fn, ids), c) in zip( outputs, c_written ):
+            sys.stderr.write( 'Info: wrote %d edges to %s\n' % (c, fn ))
+        sys.stderr.write( 'Info: read %d edges from %s\n' % (c_read, edge_src_fn ))
+
     def downsample_edge_file( self, dst_dir_tag, ids ):
-        fn = os.path.join( self.dirs[ dst_dir_tag ], 'image_edge_table.txt' )
-        sys.stderr.write( 'Info: writing %s\n' % fn )
-        (c_total, c_written) = self.edge_table.write_to_file( fn, ids )
-        sys.stderr.write( 'Info: wrote %d of %d edges to %s\n' % (c_written, c_total, fn ))
+        self.downsample_edge_files( { dst_dir_tag: ids } )
 
     def downsample_image_file( self, dst_dir_tag, ids, testing_mode_flag ):
         filter_package = (ids, testing_mode_flag )
-        fn = os.path.join( self.dirs[ dst_dir_tag ], 'image_table.txt' )
+        fn = TableIO.like( os.path.join( self.dirs[ dst_dir_tag ], 'image_table.txt' ), self.img_src_fn )
         sys.stderr.write( 'Info: writing %s\n' % fn )
         (c_total, c_written) = self.image_table.write_to_file( fn, filter_package )
         sys.stderr.write( 'Info: wrote %d of %d images to %s\n' % (c_written, c_total, fn ))
 
     def downsample_id_files( self, dst_dir_tag, ids ):
-        gsrc =  os.path.join( self.src_dir, 'id-based', '*.txt')
-        g = glob.glob( gsrc )
+        gsrc =  os.path.join( self.src_dir, 'id-based', '*.txt*')
+        g = [ fn for fn in glob.glob( gsrc ) if TableIO.base_name( fn ).endswith( '.txt' ) ]
         sys.stderr.write( 'Info: found %d files in %s\n' % (len(g), gsrc))
         for src in g:
             dst = os.path.join( self.dirs[ dst_dir_tag ], os.path.basename( src ))
             c = 0
-            with open( src ) as f_in:
-                with open (dst, 'w') as f_out:
+            with TableIO.open( src ) as f_in:
+                with TableIO.open( dst, 'w' ) as f_out:
                     while 1:
                         raw_line = f_in.readline()
                         if not raw_line:
@@ -146,7 +165,7 @@ class SandboxPaths:
     def load_id_files( self, id_fn ):
         self.id_tables = dict()
         self.all_ids = dict()
-        with open( id_fn ) as f:
+        with TableIO.open( id_fn ) as f:
             while 1:
                 raw_line = f.readline()
                 if not raw_line:
@@ -158,16 +177,11 @@ class SandboxPaths:
                 self.id_tables[ code ].append( id )
                 self.all_ids[ id ] = True
 
-    def cache_edge_table( self ):
-        edge_src_fn = os.path.join( self.src_dir, 'edge', 'image_edge_table.txt' )
-        sys.stderr.write( 'Info: loading edge table %s, filtering to edges with %d nodes\n' % (edge_src_fn, len(self.all_ids)) )
-        self.edge_table = EdgeTable.read_from_file( edge_src_fn, self.all_ids )
-        sys.stderr.write( 'Info: loaded %d edges\n' % len(self.edge_table.edges) )
-
     def cache_image_table( self, round ):
-        img_src_fn = os.path.join( self.src_dir, 'image', 'image_table_round_%d.txt' % round )
-        sys.stderr.write( 'Info: loading image table %s, filtering to %d images\n' % (img_src_fn, len(self.all_ids)) )
-        self.image_table = ImageTable.read_from_file( img_src_fn, self.all_ids )
+        self.img_src_fn = TableIO.find_required( os.path.join( self.src_dir, 'image' ), 'image_table_round_%d.txt' % round )
+        sys.stderr.write( 'Info: loading image table %s, filtering to %d images\n' % (self.img_src_fn, len(self.all_ids)) )
+        # titles and descriptions are only copied through, so leave them undecoded
+        self.image_table = ImageTable.read_from_file( self.img_src_fn, self.all_ids, text=ImageTable.TEXT_LAZY )
         sys.stderr.write( 'Info: loaded %d images\n' % len(self.image_table.entries) )
 
 #
@@ -175,13 +189,14 @@ class SandboxPaths:
 #
 
 if __name__ == '__main__':
-    if len(sys.argv) != 5:
-        sys.stderr.write( 'Usage: $0 round src-dir dst-dir id-file\n' )
+    if (len(sys.argv) != 5) and not ((len(sys.argv) == 6) and ('.' + sys.argv[5] in EdgeTable.FORMATS)):
+        sys.stderr.write( 'Usage: $0 round src-dir dst-dir id-file [txt|cp6e|cp6h]\n' )
+        sys.stderr.write( '  The optional last argument sets the output edge table format; default is same as the source.\n' )
+        sys.stderr.write( '  cp6h (clique-compressed) holds each edge table in memory until it is written.\n' )
         sys.exit(0)
     cp6_round = int( sys.argv[1] )
-    p = SandboxPaths( sys.argv[2], sys.argv[3] )
+    p = SandboxPaths( sys.argv[2], sys.argv[3], '.' + sys.argv[5] if len(sys.argv) == 6 else None )
     p.load_id_files( sys.argv[4] )
-    p.cache_edge_table()
     p.cache_image_table( cp6_round )
 
     p.populate_etc()
@@ -191,13 +206,14 @@ if __name__ == '__main__':
 
     # run_in/training
     p.downsample_image_file( 'run_training', p.id_tables[ 'A' ], False )
-    p.downsample_edge_file( 'run_training', p.id_tables[ 'A' ])
     p.downsample_id_files( 'run_training', p.id_tables[ 'A' ])
 
     # run_in/testing
     p.downsample_image_file( 'run_testing', p.id_tables[ 'B' ], True )
-    p.downsample_edge_file( 'run_testing', p.id_tables[ 'B' ])
     p.downsample_id_files( 'run_testing', p.id_tables[ 'B' ])
 
+    # both edge tables, in one pass over the source
+    p.downsample_edge_files( { 'run_training': p.id_tables[ 'A' ], 'run_testing': p.id_tables[ 'B' ] } )
+
 
 
@@ -44,11 +44,15 @@ import random
 from cp6.tables.edge_table import EdgeTable
 from cp6.tables.image_table import ImageTable
 from cp6.tables.image_indicator_table import ImageIndicatorTable
+from cp6.utilities.table_io import TableIO
 
 #
 # src is a fully populated sandbox. given a set of image IDs (aka nodes)
 # copy those nodes and edges over to a new sandbox.
 #
+# Any of the files below may be compressed (see table_io.py); files
+# derived from a compressed source are written compressed the same way.
+#
 # Sandbox structure is:
 #
 # .
@@ -63,13 +67,13 @@ from cp6.tables.image_indicator_table import ImageIndicatorTable
 # +-- run_in
 # |   +-- testing
 # |   |   +-- caffe_histograms.txt
-# |   |   +-- image_edge_table.txt
+# |   |   +-- image_edge_table.txt (or .cp6e / .cp6h, see edge_archive.py, edge_hypergraph.py)
 # |   |   +-- image_indicator_table.txt
 # |   |   +-- image_table.txt
 # |   |   +-- image_feature_group
 # |   +-- training
 # |       +-- caffe_histograms.txt
-# |       +-- image_edge_table.txt
+# |       +-- image_edge_table.txt (or .cp6e / .cp6h)
 # |       +-- image_indicator_table.txt
 # |       +-- image_table.txt
 # |       +-- image_feature_group
@@ -106,29 +110,53 @@ class SandboxPaths:
             os.mkdir( self.dirs[d] )
 
 class SandboxSubsetWorker:
-    def __init__( self, s, d ):
+    def __init__( self, s, d, edge_format = None ):
         self.src = s
         self.dst = d
+        # extension for written edge tables ('.txt', '.cp6e' or '.cp6h'); None to follow the source.
+        # A .cp6h table is clique-compressed, and its edges are held in memory until it's closed.
+        self.edge_format = edge_format
         self.image_table_train = None
         self.image_table_test = None
-        self.edge_table = None
+        # source image table paths, by dir tag
+        self.image_table_fns = dict()
 
     def populate_etc( self ):
         # copy over the files which don't change
         for i in ['caffe_dictionary.txt', 'image_indicator_lookup_table.txt', 'label_table.txt' ]:
-            src_fn = os.path.join( self.src.dirs['etc'], i )
-            if not os.path.isfile( src_fn ):
-                raise AssertionError( 'No file %s' % src_fn )
-            shutil.copy( src_fn, os.path.join( self.dst.dirs['etc'], i ))
+            src_fn = TableIO.find( self.src.dirs['etc'], i )
+            if src_fn is None:
+                raise AssertionError( 'No file %s' % os.path.join( self.src.dirs['etc'], i ))
+            shutil.copy( src_fn, os.path.join( self.dst.dirs['etc'], os.path.basename( src_fn )))
             sys.stderr.write('Info: copied %s\n' % i)
 
-    def downsample_edge_file( self, table, dst_dir_tag, ids ):
-        # dst_dir_tag is either run_training or run_testing. ids is
-        # the list of image IDs to write.
-        fn = os.path.join( self.dst.dirs[ dst_dir_tag ], 'image_edge_table.txt' )
-        sys.stderr.write( 'Info: writing %s\n' % fn )
-        (c_total, c_written) = table.write_to_file( fn, ids )
-        sys.stderr.write( 'Info: wrote %d of %d edges to %s\n' % (c_written, c_total, fn ))
+    def edge_output_fn( self, dst_dir_tag, src_fn ):
+        ext = self.edge_format or EdgeTable.format_of( src_fn )
+        return TableIO.like( os.path.join( self.dst.dirs[ dst_dir_tag ], 'image_edge_table' + ext ), src_fn )
+
+    @staticmethod
+    def downsample_edge_files_for( jobs ):
+        # jobs is a list of (worker, dst_dir_tag, ids). Jobs whose source
+        # edge tables are the same file share one streamed pass over it
+        # (see EdgeTable.route_file); nothing is held in memory.
+        by_src = dict()
+        for (w, tag, ids) in jobs:
+            src_fn = EdgeTable.find_table( w.src.dirs[ tag ] )
+            fn = w.edge_output_fn( tag, src_fn )
+            sys.stderr.write( 'Info: writing %s from %s, filtered to %d nodes\n' % (fn, src_fn, len(ids)) )
+            by_src.setdefault( os.path.realpath( src_fn ), (src_fn, list()) )[1].append( (fn, ids) )
+        for (src_fn, outputs) in by_src.values():
+            (c_read, c_written) = EdgeTable.route_file( src_fn, outputs )
+            for ((fn, ids), c) in zip( outputs, c_written ):
+                sys.stderr.write( 'Info: wrote %d edges to %s\n' % (c, fn ))
+
+    def downsample_edge_files( self, tag_ids ):
+        # tag_ids maps destination dir tags (run_training, run_testing)
+        # to the image IDs to write there
+        SandboxSubsetWorker.downsample_edge_files_for( [ (self, tag, ids) for (tag, ids) in sorted( tag_ids.items() ) ] )
+
+    def downsample_edge_file( self, dst_dir_tag, ids ):
+        self.downsample_edge_files( { dst_dir_tag: ids } )
 
     def downsample_image_file( self, table, dst_dir_tag, ids, testing_mode_flag ):
         # dst_dir_tag is one of run_training, run_testing, or eval_testing; ids is the
@@ -136,7 +164,7 @@ class SandboxSubsetWorker:
         # output image table is 'testing' (contains true image labels)
         # or 'training' (true image labels are masked.)
         filter_package = (ids, testing_mode_flag )
-        fn = os.path.join( self.dst.dirs[ dst_dir_tag ], 'image_table.txt' )
+        fn = TableIO.like( os.path.join( self.dst.dirs[ dst_dir_tag ], 'image_table.txt' ), self.image_table_fns[ dst_dir_tag ] )
         sys.stderr.write( 'Info: writing %s\n' % fn )
         (c_total, c_written) = table.write_to_file( fn, filter_package )
         sys.stderr.write( 'Info: wrote %d of %d images to %s\n' % (c_written, c_total, fn ))
@@ -150,11 +178,11 @@ class SandboxSubsetWorker:
                   'caffe_histograms.txt' ]
 
         for fn in files:
-            src = os.path.join( self.src.dirs[ dst_dir_tag ], fn )
-            dst = os.path.join( self.dst.dirs[ dst_dir_tag ], fn )
+            src = TableIO.find_required( self.src.dirs[ dst_dir_tag ], fn )
+            dst = os.path.join( self.dst.dirs[ dst_dir_tag ], os.path.basename( src ))
             c = 0
-            with open( src ) as f_in:
-                with open (dst, 'w') as f_out:
+            with TableIO.open( src ) as f_in:
+                with TableIO.open( dst, 'w' ) as f_out:
                     while 1:
                         raw_line = f_in.readline()
                         if not raw_line:
@@ -167,24 +195,16 @@ class SandboxSubsetWorker:
             sys.stderr.write('Info: wrote %d lines to %s\n' % (c, dst ))
 
 
-    def cache_edge_tables( self, train_ids, test_ids ):
-        # The edge tables can take a while to load.
-        sys.stderr.write( 'Info: loading training edge table filtered to %d nodes...\n' % len(train_ids ))
-        self.edge_table_train = EdgeTable.read_from_file( os.path.join( self.src.dirs['run_training'], 'image_edge_table.txt'), train_ids )
-        sys.stderr.write( 'Info: loaded %d training edges\n' % len(self.edge_table_train.edges))
-
-        sys.stderr.write( 'Info: loading testing edge table filtered to %d nodes...\n' % len(test_ids ))
-        self.edge_table_test = EdgeTable.read_from_file( os.path.join( self.src.dirs['run_testing'], 'image_edge_table.txt'), test_ids )
-        sys.stderr.write( 'Info: loaded %d testing edges\n' % len(self.edge_table_test.edges))
-
-
     def cache_image_tables( self ):
+        for tag in ('run_training', 'run_testing', 'eval_testing'):
+            self.image_table_fns[ tag ] = TableIO.find_required( self.src.dirs[ tag ], 'image_table.txt' )
+        # titles and descriptions are only copied through, so leave them undecoded
         sys.stderr.write( 'Info: loading source training image table...\n' )
-        self.image_table_train = ImageTable.read_from_file( os.path.join( self.src.dirs['run_training'], 'image_table.txt' ))
+        self.image_table_train = ImageTable.read_from_file( self.image_table_fns['run_training'], text=ImageTable.TEXT_LAZY )
         sys.stderr.write( 'Info: loading source testing image table...\n' )
-        self.image_table_test = ImageTable.read_from_file( os.path.join( self.src.dirs['run_testing'], 'image_table.txt' ))
+        self.image_table_test = ImageTable.read_from_file( self.image_table_fns['run_testing'], text=ImageTable.TEXT_LAZY )
         sys.stderr.write( 'Info: loading source eval image table...\n' )
-        self.image_table_eval = ImageTable.read_from_file( os.path.join( self.src.dirs['eval_testing'], 'image_table.txt' ))
+        self.image_table_eval = ImageTable.read_from_file( self.image_table_fns['eval_testing'], text=ImageTable.TEXT_LAZY )
 
 #
 #
@@ -291,6 +311,9 @@ if __name__ == '__main__':
     parser.add_argument( '--dst', required=True, help='destination sandbox (will be wiped and recreated each time)' )
     parser.add_argument( '--ids', required=True, help='ID selection policy; set to "help" for more details' )
     parser.add_argument( '--seed', help='Random number seed, for reproducibility' )
+    parser.add_argument( '--edge-format', choices=[ f.lstrip('.') for f in EdgeTable.FORMATS ], \
+                         help='edge table format to write: txt, the compact cp6e archive, or clique-compressed cp6h ' \
+                              '(holds the whole table in memory until written; default: same as source)' )
     args = parser.parse_args()
     if (args.ids == 'help'):
         IDSelector.show_id_help()
@@ -306,16 +329,13 @@ if __name__ == '__main__':
     dst_sandbox = SandboxPaths( args.dst )
     dst_sandbox.mkdirs()
 
-    w = SandboxSubsetWorker( src_sandbox, dst_sandbox )
+    w = SandboxSubsetWorker( src_sandbox, dst_sandbox, '.' + args.edge_format if args.edge_format else None )
 
     # first, load the source image tables so we can populate any pending ID lists
     w.cache_image_tables()
     ids.ids_train.set_list_from_image_table( w.image_table_train )
     ids.ids_test.set_list_from_image_table( w.image_table_test )
 
-    # load only those edges we care about
-    w.cache_edge_tables( ids.ids_train.ids, ids.ids_test.ids )
-
     # start writing!
 
     # copy files that don't change
@@ -329,11 +349,8 @@ if __name__ == '__main__':
     # ....training
     w.downsample_image_file( w.image_table_train, 'run_training', ids.ids_train.ids , False )
 
-    # edge tables:
-    # ...testing
-    w.downsample_edge_file( w.edge_table_test, 'run_testing', ids.ids_test.ids )
-    # ...training
-    w.downsample_edge_file( w.edge_table_train, 'run_training', ids.ids_train.ids )
+    # edge tables, one pass per distinct source table
+    w.downsample_edge_files( { 'run_testing': ids.ids_test.ids, 'run_training': ids.ids_train.ids } )
 
     # image feature files
     # ...testing
@@ -341,14 +358,12 @@ if __name__ == '__main__':
     # ...training
     w.downsample_feature_files( 'run_training', ids.ids_train.ids )
 
-    # image indicator tables:
-    # ...testing
-    iit_train = ImageIndicatorTable.read_from_file( os.path.join( w.src.dirs['run_training'], 'image_indicator_table.txt' ))
-    iit_train.write_to_file( os.path.join( w.dst.dirs['run_training'], 'image_indicator_table.txt' ), ids.ids_train.ids )
-    sys.stderr.write( 'Downsampled training image_indicator_table\n' )
-    iit_test = ImageIndicatorTable.read_from_file( os.path.join( w.src.dirs['run_testing'], 'image_indicator_table.txt' ))
-    iit_test.write_to_file( os.path.join( w.dst.dirs['run_testing'], 'image_indicator_table.txt' ), ids.ids_test.ids )
-    sys.stderr.write( 'Downsampled testing image_indicator_table\n' )
+    # image indicator tables, compressed like their sources
+    for (tag, which, tag_ids) in (('run_training', 'training', ids.ids_train.ids), ('run_testing', 'testing', ids.ids_test.ids)):
+        src_fn = TableIO.find_required( w.src.dirs[ tag ], 'image_indicator_table.txt' )
+        iit = ImageIndicatorTable.read_from_file( src_fn )
+        iit.write_to_file( TableIO.like( os.path.join( w.dst.dirs[ tag ], 'image_indicator_table.txt' ), src_fn ), tag_ids )
+        sys.stderr.write( 'Downsampled %s image_indicator_table\n' % which )
 
     ## all done!
 